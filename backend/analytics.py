@@ -0,0 +1,292 @@
+"""Columnar snapshots of the wellness entry collections for population analytics.
+
+The export streams each entry collection once (preferring a secondary) and
+writes one ``.npy`` file per column into a timestamped snapshot directory.
+Queries memory-map the newest snapshot and answer group-by questions with
+NumPy, so admin analytics never scan the primary database.
+
+The API schedules one export per ``ANALYTICS_EXPORT_INTERVAL_MINUTES`` as a
+background job, so the database is scanned once per interval however many
+instances run; they all read the result from a shared snapshot directory.
+Export manually with:
+
+    python analytics.py --snapshot-dir /data/analytics
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import shutil
+import time
+from array import array
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+from pymongo import ReadPreference
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SNAPSHOT_DIR = Path(__file__).parent / "analytics_snapshots"
+CURRENT_POINTER = "CURRENT"
+SNAPSHOTS_TO_KEEP = 3
+EXPORT_BATCH_SIZE = 5000
+
+HABIT_CATEGORIES = ["exercise", "nutrition", "mental_health", "productivity", "social", "sleep", "learning"]
+WEEKDAYS = ["monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday"]
+
+# dataset -> (source collection, numeric columns that can be aggregated)
+DATASETS = {
+    "mood": ("mood_entries", ["mood_level"]),
+    "stress": ("stress_entries", ["stress_level"]),
+    "productivity": ("productivity_entries", ["productivity_score", "tasks_completed", "focus_time_minutes"]),
+    "habit_checkins": ("habit_checkins", ["completed"]),
+}
+DIMENSIONS = ["all", "age_bucket", "weekday", "month", "category"]
+AGGREGATIONS = ["mean", "sum", "count"]
+
+
+class AnalyticsError(ValueError):
+    pass
+
+
+# Ages are stored as int32; missing, zero or out-of-range ages are recorded as unknown (-1)
+AGE_MAX = 2 ** 31 - 1
+
+
+def _epoch_seconds(value: Optional[datetime]) -> int:
+    if not value:
+        return 0
+    # Entries are stored as naive UTC; query parameters may carry an offset
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return int((value - datetime(1970, 1, 1)).total_seconds())
+
+
+def _age(value: Any) -> int:
+    return value if isinstance(value, int) and 0 < value <= AGE_MAX else -1
+
+
+async def export_snapshot(db, snapshot_dir: Path = DEFAULT_SNAPSHOT_DIR) -> Dict[str, Any]:
+    """Stream the entry collections into a new columnar snapshot and make it current."""
+    started = time.perf_counter()
+    snapshot_dir = Path(snapshot_dir)
+    snapshot_dir.mkdir(parents=True, exist_ok=True)
+    generated_at = datetime.utcnow()
+    name = generated_at.strftime("%Y%m%dT%H%M%S")
+    tmp_dir = snapshot_dir / f".{name}.tmp"
+    if tmp_dir.exists():
+        shutil.rmtree(tmp_dir)
+    tmp_dir.mkdir()
+
+    def collection(name: str):
+        return db.get_collection(name, read_preference=ReadPreference.SECONDARY_PREFERRED)
+
+    async def save(dataset: str, column: str, values: array, dtype: str) -> None:
+        # Converting and writing a column can take a while; keep it off the event loop
+        await asyncio.to_thread(
+            np.save, tmp_dir / f"{dataset}.{column}.npy", np.frombuffer(values, dtype=values.typecode).astype(dtype)
+        )
+
+    # Users become dense ordinals so entry columns can store an int32 instead of a uuid
+    user_index: Dict[str, int] = {}
+    ages = array("i")
+    async for user in collection("users").find({}, {"_id": 0, "id": 1, "age": 1}).batch_size(EXPORT_BATCH_SIZE):
+        user_index[user["id"]] = len(ages)
+        ages.append(_age(user.get("age")))
+    await save("users", "age", ages, "int32")
+
+    habit_category: Dict[str, int] = {}
+    async for habit in collection("habits").find({}, {"_id": 0, "id": 1, "category": 1}).batch_size(EXPORT_BATCH_SIZE):
+        category = habit.get("category")
+        habit_category[habit["id"]] = HABIT_CATEGORIES.index(category) if category in HABIT_CATEGORIES else -1
+
+    row_counts: Dict[str, int] = {}
+    trigger_vocab: Dict[str, int] = {}
+    for dataset, (source, metrics) in DATASETS.items():
+        users, dates = array("i"), array("q")
+        columns = {metric: array("q") for metric in metrics}
+        categories = array("b")
+        trigger_offsets, trigger_codes = array("q", [0]), array("i")
+        projection = {"_id": 0, "user_id": 1, "date": 1, "habit_id": 1, "triggers": 1, **{m: 1 for m in metrics}}
+
+        async for entry in collection(source).find({}, projection).batch_size(EXPORT_BATCH_SIZE):
+            users.append(user_index.get(entry.get("user_id"), -1))
+            dates.append(_epoch_seconds(entry.get("date")))
+            for metric in metrics:
+                columns[metric].append(int(entry.get(metric) or 0))
+            if dataset == "habit_checkins":
+                categories.append(habit_category.get(entry.get("habit_id"), -1))
+            if dataset == "stress":
+                for trigger in entry.get("triggers") or []:
+                    key = trigger.strip().lower()
+                    if key:
+                        trigger_codes.append(trigger_vocab.setdefault(key, len(trigger_vocab)))
+                trigger_offsets.append(len(trigger_codes))
+
+        await save(dataset, "user", users, "int32")
+        await save(dataset, "date", dates, "int64")
+        for metric in metrics:
+            await save(dataset, metric, columns[metric], "int32")
+        if dataset == "habit_checkins":
+            await save(dataset, "category", categories, "int8")
+        if dataset == "stress":
+            await save(dataset, "trigger_offsets", trigger_offsets, "int64")
+            await save(dataset, "trigger_codes", trigger_codes, "int32")
+        row_counts[dataset] = len(users)
+
+    meta = {
+        "generated_at": generated_at.isoformat(),
+        "users": len(ages),
+        "rows": row_counts,
+        "trigger_vocab": sorted(trigger_vocab, key=trigger_vocab.get),
+    }
+    (tmp_dir / "meta.json").write_text(json.dumps(meta))
+
+    final_dir = snapshot_dir / name
+    tmp_dir.rename(final_dir)
+    pointer_tmp = snapshot_dir / f".{CURRENT_POINTER}.tmp"
+    pointer_tmp.write_text(name)
+    pointer_tmp.replace(snapshot_dir / CURRENT_POINTER)
+
+    for old in sorted(p for p in snapshot_dir.iterdir() if p.is_dir() and not p.name.startswith("."))[:-SNAPSHOTS_TO_KEEP]:
+        await asyncio.to_thread(shutil.rmtree, old, ignore_errors=True)
+
+    elapsed = time.perf_counter() - started
+    logger.info("Exported analytics snapshot %s (%s) in %.1fs", name, row_counts, elapsed)
+    return {"snapshot": name, "rows": row_counts, "seconds": round(elapsed, 3)}
+
+
+class Snapshot:
+    def __init__(self, path: Path):
+        self.path = path
+        self.meta = json.loads((path / "meta.json").read_text())
+        self._columns: Dict[str, np.ndarray] = {}
+
+    @property
+    def generated_at(self) -> str:
+        return self.meta["generated_at"]
+
+    def column(self, dataset: str, name: str) -> np.ndarray:
+        key = f"{dataset}.{name}"
+        if key not in self._columns:
+            self._columns[key] = np.load(self.path / f"{key}.npy", mmap_mode="r")
+        return self._columns[key]
+
+    def _date_mask(self, dataset: str, since: Optional[datetime], until: Optional[datetime]) -> Optional[np.ndarray]:
+        if since is None and until is None:
+            return None
+        dates = self.column(dataset, "date")
+        mask = np.ones(len(dates), dtype=bool)
+        if since is not None:
+            mask &= dates >= _epoch_seconds(since)
+        if until is not None:
+            mask &= dates < _epoch_seconds(until)
+        return mask
+
+    def _group_keys(self, dataset: str, group_by: str, age_bucket_size: int):
+        rows = len(self.column(dataset, "date"))
+        if group_by == "all":
+            return np.zeros(rows, dtype=np.int64), lambda key: "all"
+        if group_by == "age_bucket":
+            ages = np.asarray(self.column("users", "age"), dtype=np.int64)
+            users = np.asarray(self.column(dataset, "user"), dtype=np.int64)
+            user_ages = np.where(users >= 0, ages[np.clip(users, 0, None)] if len(ages) else -1, -1)
+            keys = np.where(user_ages >= 0, user_ages // age_bucket_size, -1)
+            return keys, lambda key: f"{key * age_bucket_size}-{(key + 1) * age_bucket_size - 1}"
+        days = np.asarray(self.column(dataset, "date"), dtype=np.int64) // 86400
+        if group_by == "weekday":
+            # 1970-01-01 was a Thursday
+            return (days + 3) % 7, lambda key: WEEKDAYS[key]
+        if group_by == "month":
+            months = np.asarray(self.column(dataset, "date"), dtype="datetime64[s]").astype("datetime64[M]").astype(np.int64)
+            return months % 12, lambda key: key + 1
+        if group_by == "category":
+            if dataset != "habit_checkins":
+                raise AnalyticsError("category grouping is only available for habit_checkins")
+            return np.asarray(self.column(dataset, "category"), dtype=np.int64), lambda key: HABIT_CATEGORIES[key]
+        raise AnalyticsError(f"Unknown dimension '{group_by}'")
+
+    def group_by(self, dataset: str, metric: str, group_by: str = "all", agg: str = "mean",
+                 since: Optional[datetime] = None, until: Optional[datetime] = None,
+                 age_bucket_size: int = 10) -> List[Dict[str, Any]]:
+        if dataset not in DATASETS:
+            raise AnalyticsError(f"Unknown dataset '{dataset}'")
+        if metric not in DATASETS[dataset][1]:
+            raise AnalyticsError(f"Unknown metric '{metric}' for dataset '{dataset}'")
+        if agg not in AGGREGATIONS:
+            raise AnalyticsError(f"Unknown aggregation '{agg}'")
+        if age_bucket_size < 1:
+            raise AnalyticsError("age_bucket_size must be positive")
+
+        keys, label = self._group_keys(dataset, group_by, age_bucket_size)
+        values = np.asarray(self.column(dataset, metric), dtype=np.float64)
+        mask = keys >= 0
+        date_mask = self._date_mask(dataset, since, until)
+        if date_mask is not None:
+            mask &= date_mask
+        keys, values = keys[mask], values[mask]
+        if not len(keys):
+            return []
+
+        counts = np.bincount(keys)
+        sums = np.bincount(keys, weights=values)
+        results = []
+        for key in np.flatnonzero(counts):
+            count = int(counts[key])
+            value = {"mean": sums[key] / count, "sum": sums[key], "count": count}[agg]
+            results.append({"group": label(int(key)), "value": round(float(value), 4), "count": count})
+        return results
+
+    def trigger_frequencies(self, limit: int = 20, since: Optional[datetime] = None,
+                            until: Optional[datetime] = None) -> List[Dict[str, Any]]:
+        vocab = self.meta["trigger_vocab"]
+        codes = np.asarray(self.column("stress", "trigger_codes"), dtype=np.int64)
+        date_mask = self._date_mask("stress", since, until)
+        if date_mask is not None:
+            per_entry = np.diff(self.column("stress", "trigger_offsets"))
+            codes = codes[np.repeat(date_mask, per_entry)]
+        counts = np.bincount(codes, minlength=len(vocab))
+        top = np.argsort(counts, kind="stable")[::-1][:limit]
+        return [{"trigger": vocab[code], "count": int(counts[code])} for code in top if counts[code] > 0]
+
+
+class SnapshotStore:
+    """Serves the current snapshot and picks up newer exports as they land."""
+
+    def __init__(self, snapshot_dir: Path = DEFAULT_SNAPSHOT_DIR):
+        self.snapshot_dir = Path(snapshot_dir)
+        self._snapshot: Optional[Snapshot] = None
+
+    def current(self) -> Snapshot:
+        pointer = self.snapshot_dir / CURRENT_POINTER
+        if not pointer.exists():
+            raise AnalyticsError("No analytics snapshot has been exported yet")
+        name = pointer.read_text().strip()
+        if self._snapshot is None or self._snapshot.path.name != name:
+            self._snapshot = Snapshot(self.snapshot_dir / name)
+        return self._snapshot
+
+
+def main() -> None:
+    from dotenv import load_dotenv
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    parser = argparse.ArgumentParser(description="Export wellness entries to columnar analytics snapshots")
+    parser.add_argument("--snapshot-dir", default=os.environ.get("ANALYTICS_SNAPSHOT_DIR", str(DEFAULT_SNAPSHOT_DIR)))
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    load_dotenv(Path(__file__).parent / '.env')
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+    try:
+        summary = asyncio.run(export_snapshot(client[os.environ['DB_NAME']], Path(args.snapshot_dir)))
+    finally:
+        client.close()
+    print(f"Exported snapshot {summary['snapshot']} {summary['rows']} in {summary['seconds']}s")
+
+
+if __name__ == "__main__":
+    main()
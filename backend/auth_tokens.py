@@ -0,0 +1,126 @@
+"""JWT signing and verification with key rotation and a verified-token cache.
+
+Keys are configured by key id (``kid``). The active key signs new tokens and
+every configured key verifies, so a key can be rotated out by switching
+``JWT_ACTIVE_KID`` and removing the old key once its tokens have expired.
+
+For HMAC algorithms each key is a shared secret. For RSA/EC/EdDSA algorithms
+each key is a path to a PEM file: private keys can sign and verify, public keys
+only verify. The public halves are published as a JWKS document so other
+services can verify tokens without holding a secret.
+"""
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict
+
+import jwt
+from cryptography.hazmat.primitives import serialization
+
+HMAC_ALGORITHMS = {"HS256", "HS384", "HS512"}
+DEFAULT_KID = "default"
+
+
+class TokenManager:
+    def __init__(self, algorithm: str, keys: Dict[str, Any], active_kid: str,
+                 cache_size: int = 10000, cache_ttl_seconds: float = 300.0):
+        if active_kid not in keys:
+            raise ValueError(f"Active JWT key id '{active_kid}' is not configured")
+        self.algorithm = algorithm
+        self.active_kid = active_kid
+        self.cache_size = cache_size
+        self.cache_ttl_seconds = cache_ttl_seconds
+        self._signing_keys: Dict[str, Any] = {}
+        self._verification_keys: Dict[str, Any] = {}
+        for kid, key in keys.items():
+            self._load_key(kid, key)
+        if active_kid not in self._signing_keys:
+            raise ValueError(f"Active JWT key '{active_kid}' cannot sign (public key only?)")
+        # sha256(token) -> (claims, cache expiry as epoch seconds)
+        self._cache: "OrderedDict[bytes, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0}
+
+    @classmethod
+    def from_env(cls, environ: Dict[str, str], default_secret: str) -> "TokenManager":
+        algorithm = environ.get("JWT_ALGORITHM", "HS256")
+        raw_keys = environ.get("JWT_KEYS")
+        keys = json.loads(raw_keys) if raw_keys else {DEFAULT_KID: default_secret}
+        active_kid = environ.get("JWT_ACTIVE_KID", next(iter(keys)))
+        return cls(
+            algorithm,
+            keys,
+            active_kid,
+            cache_size=int(environ.get("JWT_CACHE_SIZE", "10000")),
+            cache_ttl_seconds=float(environ.get("JWT_CACHE_TTL_SECONDS", "300")),
+        )
+
+    def _load_key(self, kid: str, key: Any) -> None:
+        if self.algorithm in HMAC_ALGORITHMS:
+            self._signing_keys[kid] = key
+            self._verification_keys[kid] = key
+            return
+        pem = Path(key).read_bytes()
+        try:
+            private_key = serialization.load_pem_private_key(pem, password=None)
+        except ValueError:
+            self._verification_keys[kid] = serialization.load_pem_public_key(pem)
+        else:
+            self._signing_keys[kid] = private_key
+            self._verification_keys[kid] = private_key.public_key()
+
+    def encode(self, claims: Dict[str, Any]) -> str:
+        return jwt.encode(claims, self._signing_keys[self.active_kid], algorithm=self.algorithm,
+                          headers={"kid": self.active_kid})
+
+    def decode(self, token: str) -> Dict[str, Any]:
+        """Verify ``token`` and return its claims, raising a ``jwt.PyJWTError`` on failure."""
+        digest = hashlib.sha256(token.encode("utf-8")).digest()
+        now = time.time()
+        with self._lock:
+            cached = self._cache.get(digest)
+            if cached is not None:
+                claims, expires_at = cached
+                if now < expires_at:
+                    self._cache.move_to_end(digest)
+                    self.stats["hits"] += 1
+                    return claims
+                del self._cache[digest]
+
+        self.stats["misses"] += 1
+        kid = jwt.get_unverified_header(token).get("kid", DEFAULT_KID)
+        key = self._verification_keys.get(kid)
+        if key is None:
+            # Tokens issued before key ids were introduced carry no kid
+            if kid != DEFAULT_KID:
+                raise jwt.InvalidKeyError("Unknown signing key")
+            key = self._verification_keys[self.active_kid]
+        claims = jwt.decode(token, key, algorithms=[self.algorithm])
+
+        # Never trust a cached entry past the token's own expiry
+        expires_at = min(now + self.cache_ttl_seconds, claims.get("exp", now))
+        if expires_at > now:
+            with self._lock:
+                self._cache[digest] = (claims, expires_at)
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        return claims
+
+    def clear_cache(self) -> None:
+        with self._lock:
+            self._cache.clear()
+
+    def jwks(self) -> Dict[str, Any]:
+        """Public verification keys as a JWKS document (empty for HMAC algorithms)."""
+        if self.algorithm in HMAC_ALGORITHMS:
+            return {"keys": []}
+        algorithm = jwt.get_algorithm_by_name(self.algorithm)
+        keys = []
+        for kid, key in self._verification_keys.items():
+            jwk = algorithm.to_jwk(key, as_dict=True)
+            jwk.update({"kid": kid, "alg": self.algorithm, "use": "sig"})
+            keys.append(jwk)
+        return {"keys": keys}
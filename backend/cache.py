@@ -0,0 +1,99 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+logger = logging.getLogger(__name__)
+
+Loader = Callable[[], Awaitable[Any]]
+
+
+class AsyncResultCache:
+    """In-process cache for expensive async computations.
+
+    Entries are fresh for ``ttl`` seconds and may then be served stale for a
+    further ``stale_ttl`` seconds while a single background refresh runs.
+    Concurrent misses for the same key share one in-flight computation.
+
+    ``invalidate`` only reaches this process. To see writes made elsewhere,
+    pass ``get`` a ``version`` that every write bumps, such as a counter kept
+    in the database: entries and in-flight loads made for another version
+    are not used.
+    """
+
+    def __init__(self, ttl: float, stale_ttl: float = 0.0, max_entries: int = 10000):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()  # key -> (stored_at, version, value)
+        self._inflight: Dict[Hashable, tuple] = {}  # key -> (version, task)
+        self.stats = {"hits": 0, "stale_hits": 0, "misses": 0, "coalesced": 0, "refresh_errors": 0}
+
+    async def get(self, key: Hashable, loader: Loader, version: Hashable = None) -> Any:
+        entry = self._entries.get(key)
+        if entry is not None and entry[1] == version:
+            stored_at, _, value = entry
+            age = time.monotonic() - stored_at
+            if age < self.ttl:
+                self.stats["hits"] += 1
+                self._entries.move_to_end(key)
+                return value
+            if age < self.ttl + self.stale_ttl:
+                self.stats["stale_hits"] += 1
+                self._entries.move_to_end(key)
+                if key not in self._inflight:
+                    self._start_load(key, loader, version).add_done_callback(self._log_refresh_error)
+                return value
+
+        inflight = self._inflight.get(key)
+        if inflight is not None and inflight[0] == version:
+            self.stats["coalesced"] += 1
+            task = inflight[1]
+        else:
+            self.stats["misses"] += 1
+            task = self._start_load(key, loader, version)
+        # Shield so a disconnecting caller does not cancel the shared computation
+        return await asyncio.shield(task)
+
+    def invalidate(self, key: Hashable) -> None:
+        """Drop the cached value and detach any in-flight load started before the write."""
+        self._entries.pop(key, None)
+        self._inflight.pop(key, None)
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._inflight.clear()
+
+    def peek(self, key: Hashable) -> Optional[Any]:
+        entry = self._entries.get(key)
+        return entry[2] if entry is not None else None
+
+    def _start_load(self, key: Hashable, loader: Loader, version: Hashable) -> asyncio.Task:
+        task = asyncio.ensure_future(self._load(key, loader, version))
+        self._inflight[key] = (version, task)
+        return task
+
+    def _is_current(self, key: Hashable, task: asyncio.Task) -> bool:
+        inflight = self._inflight.get(key)
+        return inflight is not None and inflight[1] is task
+
+    async def _load(self, key: Hashable, loader: Loader, version: Hashable) -> Any:
+        task = asyncio.current_task()
+        try:
+            value = await loader()
+            # Only store if no invalidation (or load for a newer version) happened while we were computing
+            if self._is_current(key, task):
+                self._entries[key] = (time.monotonic(), version, value)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+            return value
+        finally:
+            if self._is_current(key, task):
+                del self._inflight[key]
+
+    def _log_refresh_error(self, task: asyncio.Task) -> None:
+        if not task.cancelled() and task.exception() is not None:
+            self.stats["refresh_errors"] += 1
+            logger.warning("Background cache refresh failed: %r", task.exception())
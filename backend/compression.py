@@ -0,0 +1,98 @@
+"""Response compression middleware with Brotli and GZip support.
+
+The encoding is picked by the client's ``Accept-Encoding`` q-values; codings
+with ``q=0`` are never used, and Brotli wins ties when the ``brotli`` package
+is installed. Bodies smaller than
+``minimum_size`` and already-encoded or streaming responses pass through
+untouched.
+"""
+import gzip
+from typing import Dict, List, Optional
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+try:
+    import brotli
+except ImportError:  # optional dependency
+    brotli = None
+
+
+def _parse_accept_encoding(accept_encoding: str) -> Dict[str, float]:
+    """Map each coding in an ``Accept-Encoding`` header to its q-value."""
+    accepted = {}
+    for part in accept_encoding.split(","):
+        coding, *params = (item.strip() for item in part.split(";"))
+        if not coding:
+            continue
+        q = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted[coding.lower()] = q
+    return accepted
+
+
+def choose_encoding(accept_encoding: str) -> Optional[str]:
+    accepted = _parse_accept_encoding(accept_encoding)
+    available = ["br", "gzip"] if brotli is not None else ["gzip"]
+    # Codings the client didn't list take the q-value of "*", if it sent one
+    quality = {coding: accepted.get(coding, accepted.get("*", 0.0)) for coding in available}
+    candidates = [coding for coding in available if quality[coding] > 0]
+    # max() keeps the first of equal q-values, so the server's preference order breaks ties
+    return max(candidates, key=quality.get) if candidates else None
+
+
+def compress(body: bytes, encoding: str, level: Optional[int] = None) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=5 if level is None else level)
+    return gzip.compress(body, compresslevel=6 if level is None else level)
+
+
+class CompressionMiddleware:
+    def __init__(self, app: ASGIApp, minimum_size: int = 500):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = choose_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start: List[Message] = []
+        passthrough = False
+
+        async def send_compressed(message: Message) -> None:
+            nonlocal passthrough
+            if message["type"] == "http.response.start":
+                start.append(message)
+                return
+            if message["type"] != "http.response.body" or passthrough:
+                await send(message)
+                return
+
+            headers = MutableHeaders(raw=start[0]["headers"])
+            body = message.get("body", b"")
+            if message.get("more_body", False) or "content-encoding" in headers or len(body) < self.minimum_size:
+                # Streaming, already encoded or too small to be worth it
+                passthrough = True
+                await send(start[0])
+                await send(message)
+                return
+
+            compressed = compress(body, encoding)
+            headers["Content-Encoding"] = encoding
+            headers["Content-Length"] = str(len(compressed))
+            headers.add_vary_header("Accept-Encoding")
+            await send(start[0])
+            await send({"type": "http.response.body", "body": compressed})
+
+        await self.app(scope, receive, send_compressed)
@@ -0,0 +1,49 @@
+from typing import Any, Optional
+
+
+class LazyDatabase:
+    """Stands in for a Motor database, creating the client on first use.
+
+    Importing motor (and pymongo's DNS/SRV machinery) is a large share of
+    process start-up, so it is deferred until the first query instead of
+    happening when the app module is imported.
+    """
+
+    def __init__(self, url: str, name: str):
+        self._url = url
+        self._name = name
+        self._client: Optional[Any] = None
+        self._database: Optional[Any] = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            from motor.motor_asyncio import AsyncIOMotorClient
+
+            self._client = AsyncIOMotorClient(self._url)
+            self._database = self._client[self._name]
+        return self._client
+
+    @property
+    def database(self):
+        if self._database is None:
+            self.client
+        return self._database
+
+    @property
+    def connected(self) -> bool:
+        return self._client is not None
+
+    def close(self) -> None:
+        if self._client is not None:
+            self._client.close()
+            self._client = None
+            self._database = None
+
+    def __getattr__(self, name: str):
+        if name.startswith("__"):
+            raise AttributeError(name)
+        return getattr(self.database, name)
+
+    def __getitem__(self, name: str):
+        return self.database[name]
@@ -0,0 +1,238 @@
+"""Per-habit completion calendars kept on the habit document.
+
+Each habit stores, per year, a day count map and a completion bitmap:
+
+    completion_counts: {"2025": {"0321": 2, ...}}   # completed check-ins per day (MMDD)
+    completion_bits:   {"2025": {"m03": 1048576, ...}}  # bit d-1 set once day d hit the target
+
+Month words fit in a signed int32, so check-ins update them atomically with
+``$inc`` and ``$bit``; for habits with a target above one, a single pipeline
+update sets the bit in the same write in which the count reaches the target.
+Rates and streaks are computed from the year bitmap with integer bit
+operations instead of scanning ``habit_checkins``.
+
+Backfill calendars for habits created before this existed with:
+
+    python habit_calendar.py
+"""
+import asyncio
+import calendar
+import logging
+import os
+from datetime import date, datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+COUNTS_FIELD = "completion_counts"
+BITS_FIELD = "completion_bits"
+CALENDAR_FIELDS = (COUNTS_FIELD, BITS_FIELD)
+
+
+def _year_key(day: date) -> str:
+    return str(day.year)
+
+
+def _day_key(day: date) -> str:
+    return f"{day.month:02d}{day.day:02d}"
+
+
+def _month_key(month: int) -> str:
+    return f"m{month:02d}"
+
+
+def count_path(day: date) -> str:
+    return f"{COUNTS_FIELD}.{_year_key(day)}.{_day_key(day)}"
+
+
+def calendar_increment(day: date) -> Dict[str, int]:
+    """``$inc`` fragment recording one completed check-in on ``day``."""
+    return {count_path(day): 1}
+
+
+def calendar_bit(day: date) -> Dict[str, Dict[str, int]]:
+    """``$bit`` fragment marking ``day`` as complete."""
+    return {f"{BITS_FIELD}.{_year_key(day)}.{_month_key(day.month)}": {"or": 1 << (day.day - 1)}}
+
+
+def calendar_checkin_stage(day: date, target_frequency: int) -> Dict[str, Any]:
+    """Pipeline ``$set`` fields counting one completed check-in on ``day`` and marking the day complete
+    once the new count reaches ``target_frequency``."""
+    count = count_path(day)
+    word = f"{BITS_FIELD}.{_year_key(day)}.{_month_key(day.month)}"
+    bit = 1 << (day.day - 1)
+    new_count = {"$add": [{"$ifNull": [f"${count}", 0]}, 1]}
+    old_word = {"$ifNull": [f"${word}", 0]}
+    # $bitOr needs MongoDB 6.3; adding the bit when it is still clear is the same thing
+    bit_clear = {"$eq": [{"$mod": [{"$floor": {"$divide": [old_word, bit]}}, 2]}, 0]}
+    reached = {"$and": [{"$gte": [new_count, target_frequency]}, bit_clear]}
+    return {count: new_count, word: {"$cond": [reached, {"$add": [old_word, bit]}, old_word]}}
+
+
+def day_count(habit: Dict[str, Any], day: date) -> int:
+    return habit.get(COUNTS_FIELD, {}).get(_year_key(day), {}).get(_day_key(day), 0)
+
+
+def year_projection(year: int) -> Dict[str, int]:
+    return {f"{COUNTS_FIELD}.{year}": 1, f"{BITS_FIELD}.{year}": 1}
+
+
+def _month_offsets(year: int) -> List[int]:
+    offsets, total = [0], 0
+    for month in range(1, 12):
+        total += calendar.monthrange(year, month)[1]
+        offsets.append(total)
+    return offsets
+
+
+def year_bitmap(month_words: Dict[str, int], year: int) -> int:
+    """Fold the twelve month words into one integer with bit n = day-of-year n (0-based)."""
+    bitmap = 0
+    for month, offset in enumerate(_month_offsets(year), start=1):
+        bitmap |= month_words.get(_month_key(month), 0) << offset
+    return bitmap
+
+
+def year_counts(day_counts: Dict[str, int], year: int) -> List[int]:
+    days_in_year = 366 if calendar.isleap(year) else 365
+    counts = [0] * days_in_year
+    offsets = _month_offsets(year)
+    for key, count in day_counts.items():
+        counts[offsets[int(key[:2]) - 1] + int(key[2:]) - 1] = count
+    return counts
+
+
+def longest_run(bitmap: int) -> int:
+    # Each AND with a shifted copy shortens every run of ones by one
+    length = 0
+    while bitmap:
+        bitmap &= bitmap << 1
+        length += 1
+    return length
+
+
+def run_ending_at(bitmap: int, index: int) -> int:
+    """Length of the run of set bits ending at bit ``index``."""
+    if index < 0:
+        return 0
+    window = (1 << (index + 1)) - 1
+    gaps = ~bitmap & window
+    return index + 1 if gaps == 0 else index - gaps.bit_length() + 1
+
+
+def summarize(habit: Dict[str, Any], year: int, today: Optional[date] = None) -> Dict[str, Any]:
+    today = today or datetime.utcnow().date()
+    bitmap = year_bitmap(habit.get(BITS_FIELD, {}).get(str(year), {}), year)
+    counts = year_counts(habit.get(COUNTS_FIELD, {}).get(str(year), {}), year)
+
+    # Days the habit could have been completed this year, up to today
+    first = date(year, 1, 1)
+    created_at = habit.get("created_at")
+    if created_at is not None:
+        first = max(first, created_at.date())
+    last = min(today, date(year, 12, 31))
+    elapsed_days = max((last - first).days + 1, 0)
+
+    last_index = last.timetuple().tm_yday - 1 if last >= date(year, 1, 1) else -1
+    current_streak = run_ending_at(bitmap, last_index)
+    if current_streak == 0 and last == today:
+        # Today isn't finished yet; a streak through yesterday is still current
+        current_streak = run_ending_at(bitmap, last_index - 1)
+
+    completed_days = bitmap.bit_count()
+    return {
+        "habit_id": habit["id"],
+        "year": year,
+        "target_frequency": habit.get("target_frequency", 1),
+        "counts": counts,
+        "bitmap": format(bitmap, "x"),
+        "completed_days": completed_days,
+        "completion_rate": round(completed_days / elapsed_days * 100, 1) if elapsed_days else 0.0,
+        "current_streak": current_streak,
+        "longest_streak": longest_run(bitmap),
+    }
+
+
+def overall_streaks(habit: Dict[str, Any], today: Optional[date] = None) -> Tuple[int, int]:
+    """Current and longest streak across every year on the calendar, runs crossing New Year included."""
+    today = today or datetime.utcnow().date()
+    years = sorted(int(year) for year in habit.get(BITS_FIELD, {}))
+    if not years:
+        return 0, 0
+
+    # Concatenate the year bitmaps, oldest year in the lowest bits
+    combined, today_index, offset = 0, -1, 0
+    for year in range(years[0], max(years[-1], today.year) + 1):
+        combined |= year_bitmap(habit[BITS_FIELD].get(str(year), {}), year) << offset
+        if year == today.year:
+            today_index = offset + today.timetuple().tm_yday - 1
+        offset += 366 if calendar.isleap(year) else 365
+
+    current = run_ending_at(combined, today_index) or run_ending_at(combined, today_index - 1)
+    return current, longest_run(combined)
+
+
+async def rebuild_habit_calendar(db, habit: Dict[str, Any]) -> None:
+    """Recompute a habit's calendar from its check-ins (backfill and imports).
+
+    Months whose check-ins retention has archived (see retention.py) are no
+    longer fully in ``habit_checkins``, so there the live check-ins are only
+    merged into the stored calendar; every other month is rewritten.
+    """
+    rows = await db.habit_checkins.aggregate([
+        {"$match": {"habit_id": habit["id"], "completed": True}},
+        {"$group": {"_id": {"$dateToString": {"format": "%Y%m%d", "date": "$date"}}, "count": {"$sum": 1}}},
+    ]).to_list(None)
+    archived_months = {
+        month.strftime("%Y%m")
+        for month in await db.archives.distinct("month", {"collection": "habit_checkins", "archived": True})
+    }
+
+    target = habit.get("target_frequency", 1)
+    words: Dict[str, int] = {}  # YYYYMM -> bit d-1 set once day d hit the target
+    update: Dict[str, Dict[str, Any]] = {"$set": {}, "$max": {}, "$bit": {}}
+    for row in rows:
+        month = row["_id"][:6]
+        day = date(int(month[:4]), int(month[4:]), int(row["_id"][6:]))
+        words[month] = words.get(month, 0) | ((1 << (day.day - 1)) if row["count"] >= target else 0)
+        update["$max" if month in archived_months else "$set"][count_path(day)] = row["count"]
+
+    for month, word in words.items():
+        path = f"{BITS_FIELD}.{month[:4]}.{_month_key(int(month[4:]))}"
+        if month not in archived_months:
+            update["$set"][path] = word
+        elif word:
+            update["$bit"][path] = {"or": word}
+
+    update = {operator: fields for operator, fields in update.items() if fields}
+    if update:
+        await db.habits.update_one({"id": habit["id"]}, update)
+
+
+async def rebuild_all_calendars(db) -> int:
+    rebuilt = 0
+    async for habit in db.habits.find({}, {"_id": 0, "id": 1, "target_frequency": 1}):
+        await rebuild_habit_calendar(db, habit)
+        rebuilt += 1
+        if rebuilt % 1000 == 0:
+            logger.info("Rebuilt %d habit calendars", rebuilt)
+    return rebuilt
+
+
+def main() -> None:
+    from dotenv import load_dotenv
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    load_dotenv(Path(__file__).parent / '.env')
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+    try:
+        rebuilt = asyncio.run(rebuild_all_calendars(client[os.environ['DB_NAME']]))
+    finally:
+        client.close()
+    print(f"Rebuilt {rebuilt} habit calendars")
+
+
+if __name__ == "__main__":
+    main()
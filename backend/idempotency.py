@@ -0,0 +1,113 @@
+"""Client-supplied ``Idempotency-Key`` support for POST routes.
+
+The first request with a key inserts an ``in_progress`` record (the unique
+``_id`` makes this the lock, so there is no read before the write), runs the
+operation and stores its response. A retry with the same key hits the
+duplicate key error and gets the stored response back instead of writing
+again. Records expire through a TTL index.
+
+``operation`` should be the request's primary write and nothing more: if it
+fails, the key is released so the client can retry. Follow-up work (counters,
+cache invalidation) goes in ``then``, which runs once the response is stored;
+a failure there no longer releases the key, since a retry would repeat the
+write.
+"""
+import hashlib
+import json
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from fastapi import HTTPException
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+IN_PROGRESS = "in_progress"
+COMPLETED = "completed"
+MAX_KEY_LENGTH = 255
+REPLAY_HEADER = "Idempotent-Replayed"
+
+
+def fingerprint(route: str, params: Dict[str, Any]) -> str:
+    body = json.dumps(jsonable_encoder(params), sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(f"{route}:{body}".encode("utf-8")).hexdigest()
+
+
+class IdempotencyStore:
+    def __init__(self, db, collection: str = "idempotency_keys", ttl: timedelta = timedelta(hours=24),
+                 lock_timeout: timedelta = timedelta(seconds=60)):
+        self.db = db
+        self.collection_name = collection
+        self.ttl = ttl
+        self.lock_timeout = lock_timeout
+
+    @property
+    def collection(self):
+        return self.db[self.collection_name]
+
+    async def ensure_indexes(self) -> None:
+        await self.collection.create_index("expire_at", expireAfterSeconds=0)
+
+    async def run(self, user_id: str, key: Optional[str], route: str, params: Dict[str, Any],
+                  operation: Callable[[], Awaitable[Any]],
+                  then: Optional[Callable[[], Awaitable[Any]]] = None) -> Any:
+        """Run ``operation``, then ``then``, once per (user, key); replays return the first response."""
+        if key is None:
+            result = await operation()
+            if then is not None:
+                await then()
+            return result
+        if not key or len(key) > MAX_KEY_LENGTH:
+            raise HTTPException(status_code=400, detail="Invalid Idempotency-Key")
+
+        from pymongo.errors import DuplicateKeyError
+
+        record_id = f"{user_id}:{key}"
+        request_fingerprint = fingerprint(route, params)
+        now = datetime.utcnow()
+        try:
+            await self.collection.insert_one({
+                "_id": record_id,
+                "status": IN_PROGRESS,
+                "fingerprint": request_fingerprint,
+                "started_at": now,
+                "expire_at": now + self.ttl,
+            })
+        except DuplicateKeyError:
+            replay = await self._existing(record_id, request_fingerprint)
+            if replay is not None:
+                return replay
+
+        try:
+            result = await operation()
+        except BaseException:
+            # Let the client retry with the same key
+            await self.collection.delete_one({"_id": record_id, "status": IN_PROGRESS})
+            raise
+
+        await self.collection.update_one(
+            {"_id": record_id},
+            {"$set": {"status": COMPLETED, "response": jsonable_encoder(result), "completed_at": datetime.utcnow()}},
+        )
+        if then is not None:
+            await then()
+        return result
+
+    async def _existing(self, record_id: str, request_fingerprint: str) -> Optional[JSONResponse]:
+        """Replay a stored response, or return None if we took over an abandoned in-progress key."""
+        record = await self.collection.find_one({"_id": record_id})
+        if record is None:
+            raise HTTPException(status_code=409, detail="Idempotency-Key was just released, retry the request")
+        if record["fingerprint"] != request_fingerprint:
+            raise HTTPException(status_code=422, detail="Idempotency-Key was already used for a different request")
+        if record["status"] == COMPLETED:
+            return JSONResponse(content=record["response"], headers={REPLAY_HEADER: "true"})
+
+        # The original request may have died mid-flight; take the key over once its lock is stale
+        now = datetime.utcnow()
+        taken = await self.collection.update_one(
+            {"_id": record_id, "status": IN_PROGRESS, "started_at": {"$lt": now - self.lock_timeout}},
+            {"$set": {"started_at": now, "expire_at": now + self.ttl}},
+        )
+        if taken.modified_count:
+            return None
+        raise HTTPException(status_code=409, detail="A request with this Idempotency-Key is still in progress")
@@ -0,0 +1,424 @@
+"""Bulk import of wellness history exported from other trackers.
+
+Uploads are CSV with a header row, or JSON (an array, or one object per
+line), with one entry per row:
+
+    type,date,mood_level,stress_level,productivity_score,habit,habit_category,notes
+    mood,2023-04-02T08:15:00,4,,,,,Slept well
+    habit_checkin,2023-04-02,,,,Morning run,exercise,
+
+``type`` is ``mood``, ``stress``, ``productivity`` or ``habit_checkin`` and the
+other columns are the entry's fields. Check-ins name their habit with
+``habit_id`` or ``habit`` (created, with ``habit_category``, if the user has no
+habit of that name). In CSV, ``triggers`` and ``coping_strategies`` are
+``;``-separated.
+
+Rows are parsed straight off the upload stream and validated ``batch_size`` at
+a time, and each batch is written with unordered inserts. Entry ids are
+derived from the row content, so re-running an interrupted import skips the
+rows it already wrote. Progress is saved on the ``imports`` document after
+every batch. Once all rows are in, the calendars and streaks of habits that
+received check-ins are rebuilt.
+
+The API does not import inside the request: ``queue`` stores the upload in
+GridFS next to a ``queued`` report, and a background job on any instance
+runs it with ``run_queued``.
+
+Import a file from the command line with:
+
+    python importer.py user@example.com history.csv
+"""
+import asyncio
+import csv
+import io
+import json
+import logging
+import re
+import tempfile
+import time
+import uuid
+from datetime import datetime
+from itertools import islice
+from typing import Any, Dict, IO, Iterator, List, Optional, Tuple, Type
+
+from fastapi.encoders import jsonable_encoder
+from pydantic import BaseModel, ValidationError
+
+from habit_calendar import BITS_FIELD, overall_streaks, rebuild_habit_calendar
+
+logger = logging.getLogger(__name__)
+
+CSV_LIST_FIELDS = {"triggers", "coping_strategies"}
+CSV_LIST_SEPARATOR = ";"
+MAX_REPORTED_ERRORS = 100
+UPLOAD_BUCKET = "import_uploads"
+ENTRY_ID_NAMESPACE = uuid.UUID("8b0f4e52-7d5c-4a8e-9f3b-2c6d1e0a9b47")
+
+QUEUED = "queued"
+RUNNING = "running"
+COMPLETED = "completed"
+FAILED = "failed"
+
+
+class ImportFormatError(ValueError):
+    pass
+
+
+def detect_format(filename: Optional[str], content_type: Optional[str] = None) -> str:
+    name = (filename or "").lower()
+    if name.endswith(".csv") or content_type == "text/csv":
+        return "csv"
+    if name.endswith((".json", ".ndjson", ".jsonl")) or content_type in ("application/json", "application/x-ndjson"):
+        return "json"
+    raise ImportFormatError("Upload a .csv, .json or .ndjson file")
+
+
+def iter_csv_rows(stream: IO[str]) -> Iterator[Dict[str, Any]]:
+    for row in csv.DictReader(stream):
+        record: Dict[str, Any] = {}
+        for key, value in row.items():
+            # Short rows give None values, long ones a None key
+            if key is None or value is None or not value.strip():
+                continue
+            key = key.strip()
+            value = value.strip()
+            if key in CSV_LIST_FIELDS:
+                record[key] = [item.strip() for item in value.split(CSV_LIST_SEPARATOR) if item.strip()]
+            else:
+                record[key] = value
+        yield record
+
+
+_WHITESPACE = re.compile(r"\s*")
+_ARRAY_SEPARATOR = re.compile(r"[\s,]*")
+# A value cut off at the end of the buffer fails to decode at most this many characters before the end
+# (a partial literal such as ``-Infinit``), or decodes as a shorter number; errors further back are in the data itself
+_CUT_OFF_MARGIN = 16
+
+
+def iter_json_rows(stream: IO[str], chunk_size: int = 1 << 16) -> Iterator[Any]:
+    """Yield the values of a top-level JSON array, or of NDJSON, reading ``chunk_size`` characters at a time."""
+    decoder = json.JSONDecoder()
+    buffer, position, eof = "", 0, False
+    in_array: Optional[bool] = None
+    closed = False
+
+    def read_more():
+        nonlocal buffer, position, eof
+        chunk = stream.read(chunk_size)
+        eof = not chunk
+        buffer, position = buffer[position:] + chunk, 0
+
+    while True:
+        position = (_ARRAY_SEPARATOR if in_array else _WHITESPACE).match(buffer, position).end()
+        if position == len(buffer):
+            if eof:
+                if in_array:
+                    raise ImportFormatError("Invalid JSON: the file ends before the array's closing ']'")
+                return
+            read_more()
+            continue
+        if closed:
+            raise ImportFormatError("Invalid JSON: unexpected data after the array's closing ']'")
+        if in_array is None:
+            in_array = buffer[position] == "["
+            position += in_array
+            continue
+        if in_array and buffer[position] == "]":
+            # Only whitespace may follow
+            in_array, closed = False, True
+            position += 1
+            continue
+        try:
+            value, end = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError as e:
+            # An unterminated string always runs to the end of the buffer
+            cut_off = e.pos >= len(buffer) - _CUT_OFF_MARGIN or e.msg.startswith("Unterminated string")
+            if eof or not cut_off:
+                raise ImportFormatError(f"Invalid JSON: {e}") from None
+            read_more()
+            continue
+        if not eof and end > len(buffer) - _CUT_OFF_MARGIN:
+            # A number close to the end of the buffer may go on in the next chunk ("12" of "12.5e3")
+            read_more()
+            continue
+        position = end
+        yield value
+
+
+def iter_rows(binary: IO[bytes], fmt: str) -> Iterator[Any]:
+    # utf-8-sig drops the BOM spreadsheet exports like to start with
+    text = io.TextIOWrapper(binary, encoding="utf-8-sig", newline="")
+    return iter_csv_rows(text) if fmt == "csv" else iter_json_rows(text)
+
+
+def entry_id(user_id: str, entry_type: str, document: Dict[str, Any]) -> str:
+    """Stable id for an imported row, so importing the same row twice is a no-op."""
+    content = json.dumps(jsonable_encoder({k: v for k, v in document.items() if k != "id"}), sort_keys=True)
+    return str(uuid.uuid5(ENTRY_ID_NAMESPACE, f"{user_id}:{entry_type}:{content}"))
+
+
+class Importer:
+    def __init__(self, db, models: Dict[str, Tuple[Type[BaseModel], str]], habit_model: Type[BaseModel],
+                 batch_size: int = 1000, collection: str = "imports"):
+        """``models`` maps each row type to its entry model and collection."""
+        self.db = db
+        self.models = models
+        self.habit_model = habit_model
+        self.batch_size = batch_size
+        self.collection_name = collection
+
+    @property
+    def collection(self):
+        return self.db[self.collection_name]
+
+    @property
+    def uploads(self):
+        from motor.motor_asyncio import AsyncIOMotorGridFSBucket
+
+        # The collection's database is the Motor database, also when ``db`` is a lazy stand-in
+        return AsyncIOMotorGridFSBucket(self.collection.database, bucket_name=UPLOAD_BUCKET)
+
+    async def ensure_indexes(self) -> None:
+        await self.collection.create_index([("user_id", 1), ("started_at", -1)])
+
+    def _new_report(self, user_id: str, fmt: str, source: str, status: str,
+                    report_id: Optional[str] = None) -> Dict[str, Any]:
+        return {
+            "_id": report_id or str(uuid.uuid4()),
+            "user_id": user_id,
+            "source": source,
+            "format": fmt,
+            "status": status,
+            "started_at": datetime.utcnow(),
+            "rows_read": 0,
+            "inserted": {entry_type: 0 for entry_type in self.models},
+            "duplicates": 0,
+            "invalid": 0,
+            "habits_created": 0,
+            "errors": [],
+        }
+
+    async def queue(self, user_id: str, binary: IO[bytes], fmt: str, source: str) -> Dict[str, Any]:
+        """Store the upload and a ``queued`` report for ``run_queued`` to pick up later."""
+        report = self._new_report(user_id, fmt, source, QUEUED)
+        await self.uploads.upload_from_stream_with_id(report["_id"], source, binary)
+        await self.collection.insert_one(report)
+        return report
+
+    async def run_queued(self, report_id: str) -> Dict[str, Any]:
+        """Import the upload stored by ``queue``; the upload is kept until ``delete_upload``."""
+        queued = await self.collection.find_one({"_id": report_id}, {"user_id": 1, "format": 1, "source": 1})
+        if queued is None:
+            raise LookupError(f"No import {report_id}")
+        with tempfile.TemporaryFile() as binary:
+            await self.uploads.download_to_stream(report_id, binary)
+            binary.seek(0)
+            return await self.run(queued["user_id"], binary, queued["format"], queued["source"], report_id=report_id)
+
+    async def delete_upload(self, report_id: str) -> None:
+        from gridfs.errors import NoFile
+
+        try:
+            await self.uploads.delete(report_id)
+        except NoFile:
+            pass
+
+    async def run(self, user_id: str, binary: IO[bytes], fmt: str, source: str,
+                  report_id: Optional[str] = None) -> Dict[str, Any]:
+        """Import every row of ``binary`` for ``user_id`` and return the final report.
+
+        With ``report_id`` the existing report is reset and reused, so a retried import reports one run.
+        """
+        report = self._new_report(user_id, fmt, source, RUNNING, report_id)
+        await self.collection.replace_one({"_id": report["_id"]}, report, upsert=True)
+        run = _ImportRun(self, user_id, report)
+        rows = iter_rows(binary, fmt)
+        started = time.perf_counter()
+        try:
+            report["status"] = COMPLETED
+            try:
+                while True:
+                    # Parsing is CPU-bound; keep it off the event loop
+                    batch = await asyncio.to_thread(list, islice(rows, self.batch_size))
+                    if not batch:
+                        break
+                    await run.write_batch(batch)
+                    report["rows_per_second"] = round(report["rows_read"] / max(time.perf_counter() - started, 1e-6), 1)
+                    await self._save(report)
+                    logger.info("Import %s: %d rows (%.0f rows/s)", report["_id"], report["rows_read"], report["rows_per_second"])
+            except (ImportFormatError, csv.Error, UnicodeDecodeError) as e:
+                # Rows before the damage are already written; keep their habits consistent too
+                report.update(status=FAILED, error=f"Unreadable file after row {report['rows_read']}: {e}")
+            await run.rebuild_habits()
+        except BaseException as e:
+            report.update(status=FAILED, error=repr(e))
+            await self._save(report)
+            raise
+        report["finished_at"] = datetime.utcnow()
+        report["duration_seconds"] = round(time.perf_counter() - started, 3)
+        await self._save(report)
+        return report
+
+    async def _save(self, report: Dict[str, Any]) -> None:
+        await self.collection.update_one(
+            {"_id": report["_id"]}, {"$set": {k: v for k, v in report.items() if k != "_id"}}
+        )
+
+
+class _ImportRun:
+    """State carried between the batches of one import."""
+
+    def __init__(self, importer: Importer, user_id: str, report: Dict[str, Any]):
+        self.importer = importer
+        self.db = importer.db
+        self.user_id = user_id
+        self.report = report
+        self.habits_by_name: Dict[str, Dict[str, Any]] = {}
+        self.habits_by_id: Dict[str, Dict[str, Any]] = {}
+        self.touched_habits: set = set()
+
+    def _reject(self, row_number: int, message: str) -> None:
+        self.report["invalid"] += 1
+        if len(self.report["errors"]) < MAX_REPORTED_ERRORS:
+            self.report["errors"].append({"row": row_number, "error": message})
+
+    async def write_batch(self, rows: List[Any]) -> None:
+        first_row = self.report["rows_read"] + 1
+        self.report["rows_read"] += len(rows)
+        await self._load_habits(rows)
+
+        documents: Dict[str, List[Dict[str, Any]]] = {}
+        for row_number, row in enumerate(rows, start=first_row):
+            if not isinstance(row, dict):
+                self._reject(row_number, "Row is not an object")
+                continue
+            entry_type = row.get("type")
+            if entry_type not in self.importer.models:
+                self._reject(row_number, f"Unknown type {entry_type!r}")
+                continue
+            if not row.get("date"):
+                self._reject(row_number, "Missing date")
+                continue
+            fields = {k: v for k, v in row.items() if k not in ("type", "id", "user_id", "habit", "habit_category")}
+            fields["user_id"] = self.user_id
+            if entry_type == "habit_checkin":
+                habit = await self._habit_for(row)
+                if habit is None:
+                    self._reject(row_number, "Unknown habit; give habit_id, or habit and habit_category to create it")
+                    continue
+                fields["habit_id"] = habit["id"]
+
+            model, collection = self.importer.models[entry_type]
+            try:
+                entry = model(**fields).dict()
+            except ValidationError as e:
+                self._reject(row_number, "; ".join(f"{'.'.join(map(str, err['loc']))}: {err['msg']}" for err in e.errors()))
+                continue
+            entry["id"] = entry["_id"] = entry_id(self.user_id, entry_type, entry)
+            documents.setdefault(entry_type, []).append(entry)
+            if entry_type == "habit_checkin" and entry["completed"]:
+                self.touched_habits.add(entry["habit_id"])
+
+        for entry_type, entries in documents.items():
+            await self._insert(entry_type, entries)
+
+    async def _insert(self, entry_type: str, entries: List[Dict[str, Any]]) -> None:
+        from pymongo.errors import BulkWriteError
+
+        collection = self.importer.models[entry_type][1]
+        try:
+            result = await self.db[collection].insert_many(entries, ordered=False)
+            self.report["inserted"][entry_type] += len(result.inserted_ids)
+        except BulkWriteError as e:
+            details = e.details
+            duplicates = sum(1 for error in details["writeErrors"] if error["code"] == 11000)
+            if duplicates != len(details["writeErrors"]):
+                raise
+            self.report["inserted"][entry_type] += details["nInserted"]
+            self.report["duplicates"] += duplicates
+
+    async def _load_habits(self, rows: List[Any]) -> None:
+        """Fetch the batch's habits in one query instead of one per row."""
+        names = {row["habit"] for row in rows if isinstance(row, dict) and row.get("habit")} - set(self.habits_by_name)
+        ids = {row["habit_id"] for row in rows if isinstance(row, dict) and row.get("habit_id")} - set(self.habits_by_id)
+        if not names and not ids:
+            return
+        query = {"user_id": self.user_id, "$or": [{"name": {"$in": list(names)}}, {"id": {"$in": list(ids)}}]}
+        async for habit in self.db.habits.find(query, {"_id": 0, "id": 1, "name": 1, "target_frequency": 1}):
+            self.habits_by_name.setdefault(habit["name"], habit)
+            self.habits_by_id[habit["id"]] = habit
+
+    async def _habit_for(self, row: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        if row.get("habit_id"):
+            return self.habits_by_id.get(row["habit_id"])
+        name = row.get("habit")
+        if not name:
+            return None
+        if name not in self.habits_by_name:
+            try:
+                habit = self.importer.habit_model(user_id=self.user_id, name=name, category=row.get("habit_category")).dict()
+            except ValidationError:
+                return None
+            await self.db.habits.insert_one(habit)
+            self.habits_by_name[name] = self.habits_by_id[habit["id"]] = habit
+            self.report["habits_created"] += 1
+        return self.habits_by_name[name]
+
+    async def rebuild_habits(self) -> None:
+        """Bring the calendars and streaks of habits that got check-ins in line with the imported history."""
+        for habit_id in self.touched_habits:
+            habit = self.habits_by_id[habit_id]
+            await rebuild_habit_calendar(self.db, habit)
+            calendar_doc = await self.db.habits.find_one({"id": habit_id}, {"_id": 0, BITS_FIELD: 1, "best_streak": 1})
+            current, longest = overall_streaks(calendar_doc or {})
+            await self.db.habits.update_one(
+                {"id": habit_id},
+                {"$set": {"current_streak": current, "best_streak": max(longest, (calendar_doc or {}).get("best_streak", 0))}}
+            )
+
+
+def main() -> None:
+    import argparse
+    import os
+    from pathlib import Path
+
+    from dotenv import load_dotenv
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    parser = argparse.ArgumentParser(description="Import a CSV/JSON history file for one user")
+    parser.add_argument("email")
+    parser.add_argument("path", type=Path)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    load_dotenv(Path(__file__).parent / '.env')
+    from server import IMPORT_MODELS, Habit
+
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+    db = client[os.environ['DB_NAME']]
+    importer = Importer(db, IMPORT_MODELS, Habit, batch_size=args.batch_size)
+
+    async def run():
+        user = await db.users.find_one({"email": args.email}, {"_id": 0, "id": 1})
+        if user is None:
+            raise SystemExit(f"No user with email {args.email}")
+        await importer.ensure_indexes()
+        with open(args.path, "rb") as binary:
+            report = await importer.run(user["id"], binary, detect_format(args.path.name), args.path.name)
+        # Running API instances check this stamp before serving a cached dashboard
+        await db.users.update_one({"id": user["id"]}, {"$inc": {"dashboard_version": 1}})
+        return report
+
+    try:
+        report = asyncio.run(run())
+    finally:
+        client.close()
+    print(json.dumps(jsonable_encoder({k: v for k, v in report.items() if k != "errors"}), indent=2))
+    for error in report["errors"]:
+        print(f"row {error['row']}: {error['error']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,320 @@
+"""Persistent background jobs for deferred and periodic work.
+
+Jobs live in a Mongo collection so they survive restarts and can be picked up
+by any instance. A worker claims a due job by atomically flipping it to
+``running`` with a lease; if the worker dies, the lease expires and another
+worker retries it. Failures are retried with exponential backoff up to
+``max_attempts``.
+
+Periodic schedules enqueue one job per time slot with a unique ``dedupe_key``,
+so every instance can run the scheduler without a job running twice.
+"""
+import asyncio
+import logging
+import random
+import socket
+import time
+import uuid
+from collections import deque
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+Handler = Callable[[Dict[str, Any]], Awaitable[Any]]
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+COMPLETED_JOB_RETENTION = timedelta(days=7)
+THROUGHPUT_WINDOW_SECONDS = 300
+# How long ``stop`` waits for cancelled jobs to hand themselves back to the queue
+RELEASE_TIMEOUT_SECONDS = 1.0
+
+
+@dataclass
+class JobHandler:
+    func: Handler
+    max_attempts: int
+    lease_seconds: float
+
+
+@dataclass
+class Schedule:
+    job_name: str
+    interval: Optional[timedelta] = None
+    daily_at: Optional[tuple] = None  # (hour, minute) UTC
+    payload: Optional[Dict[str, Any]] = None
+
+    def latest_slot(self, now: datetime) -> datetime:
+        if self.interval is not None:
+            step = self.interval.total_seconds()
+            epoch = (now - datetime(1970, 1, 1)).total_seconds()
+            return datetime(1970, 1, 1) + timedelta(seconds=(epoch // step) * step)
+        hour, minute = self.daily_at
+        slot = datetime(now.year, now.month, now.day, hour, minute)
+        return slot if slot <= now else slot - timedelta(days=1)
+
+
+def retry_delay(attempts: int, base_seconds: float = 5.0, max_seconds: float = 3600.0) -> float:
+    delay = min(base_seconds * 2 ** (attempts - 1), max_seconds)
+    return delay * random.uniform(0.8, 1.2)
+
+
+class JobRunner:
+    def __init__(self, db, collection: str = "jobs", concurrency: int = 4,
+                 poll_interval: float = 1.0, scheduler_interval: float = 30.0):
+        self.db = db
+        self.collection_name = collection
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.scheduler_interval = scheduler_interval
+        self.worker_id = f"{socket.gethostname()}:{uuid.uuid4().hex[:8]}"
+        self.handlers: Dict[str, JobHandler] = {}
+        self.schedules: List[Schedule] = []
+        self._active: set = set()
+        self._worker: Optional[asyncio.Task] = None
+        self._scheduler: Optional[asyncio.Task] = None
+        self._wake: Optional[asyncio.Event] = None
+        self._stopping = False
+        self._completions: deque = deque()
+        self.stats = {"completed": 0, "failed": 0, "retried": 0}
+
+    @property
+    def collection(self):
+        return self.db[self.collection_name]
+
+    def handler(self, name: str, max_attempts: int = 5, lease_seconds: float = 300.0):
+        """Register ``func(payload)`` as the handler for jobs called ``name``."""
+        def register(func: Handler) -> Handler:
+            self.handlers[name] = JobHandler(func, max_attempts, lease_seconds)
+            return func
+        return register
+
+    def schedule(self, job_name: str, every: Optional[timedelta] = None, daily_at: Optional[tuple] = None,
+                 payload: Optional[Dict[str, Any]] = None) -> None:
+        if (every is None) == (daily_at is None):
+            raise ValueError("Pass exactly one of every= or daily_at=")
+        self.schedules.append(Schedule(job_name, every, daily_at, payload))
+
+    async def ensure_indexes(self) -> None:
+        from pymongo import ASCENDING
+
+        await self.collection.create_index([("status", ASCENDING), ("run_at", ASCENDING)])
+        await self.collection.create_index(
+            "dedupe_key", unique=True, partialFilterExpression={"dedupe_key": {"$type": "string"}}
+        )
+        await self.collection.create_index("expire_at", expireAfterSeconds=0)
+
+    async def enqueue(self, name: str, payload: Optional[Dict[str, Any]] = None, run_at: Optional[datetime] = None,
+                      dedupe_key: Optional[str] = None) -> Optional[str]:
+        """Queue a job and return its id, or None if ``dedupe_key`` was already queued."""
+        from pymongo.errors import DuplicateKeyError
+
+        if name not in self.handlers:
+            raise ValueError(f"No handler registered for job '{name}'")
+        now = datetime.utcnow()
+        job = {
+            "_id": str(uuid.uuid4()),
+            "name": name,
+            "payload": payload or {},
+            "status": PENDING,
+            "run_at": run_at or now,
+            "attempts": 0,
+            "max_attempts": self.handlers[name].max_attempts,
+            "created_at": now,
+        }
+        if dedupe_key is not None:
+            job["dedupe_key"] = dedupe_key
+        try:
+            await self.collection.insert_one(job)
+        except DuplicateKeyError:
+            return None
+        if self._wake is not None and job["run_at"] <= now:
+            self._wake.set()
+        return job["_id"]
+
+    async def start(self) -> None:
+        self._stopping = False
+        self._wake = asyncio.Event()
+        self._slots = asyncio.Semaphore(self.concurrency)
+        self._worker = asyncio.create_task(self._worker_loop())
+        if self.schedules:
+            self._scheduler = asyncio.create_task(self._scheduler_loop())
+
+    def stop_claiming(self) -> None:
+        """Stop claiming and scheduling jobs; running ones carry on. Called as soon as shutdown begins."""
+        self._stopping = True
+        if self._wake is not None:
+            self._wake.set()
+        if self._scheduler is not None:
+            # Enqueueing is idempotent, so the scheduler can be cut off anywhere
+            self._scheduler.cancel()
+            self._scheduler = None
+
+    async def stop(self, timeout: float = 30.0) -> None:
+        """Stop claiming jobs and give running ones ``timeout`` seconds to finish.
+
+        Jobs still running after that are cancelled and put back in the queue
+        for another worker, rather than waiting out their lease.
+        """
+        self.stop_claiming()
+        if self._active:
+            done, pending = await asyncio.wait(self._active, timeout=timeout)
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.wait(pending, timeout=RELEASE_TIMEOUT_SECONDS)
+        if self._worker is not None:
+            # Let a claim already sent to Mongo come back and be released; only a wait for a slot is cut off
+            await asyncio.wait({self._worker}, timeout=RELEASE_TIMEOUT_SECONDS)
+            self._worker.cancel()
+            self._worker = None
+
+    async def _claim(self) -> Optional[Dict[str, Any]]:
+        from pymongo import ReturnDocument
+
+        now = datetime.utcnow()
+        # Provisional lease so a worker dying right after the claim can't strand the job
+        lease_seconds = max((h.lease_seconds for h in self.handlers.values()), default=300.0)
+        return await self.collection.find_one_and_update(
+            {
+                "name": {"$in": list(self.handlers)},
+                "$or": [
+                    {"status": PENDING, "run_at": {"$lte": now}},
+                    {"status": RUNNING, "locked_until": {"$lt": now}},
+                ],
+            },
+            {"$set": {"status": RUNNING, "worker_id": self.worker_id, "started_at": now,
+                      "locked_until": now + timedelta(seconds=lease_seconds)},
+             "$inc": {"attempts": 1}},
+            sort=[("run_at", 1)],
+            return_document=ReturnDocument.AFTER,
+        )
+
+    async def _worker_loop(self) -> None:
+        while not self._stopping:
+            await self._slots.acquire()
+            if self._stopping:
+                self._slots.release()
+                break
+            try:
+                job = await self._claim()
+            except Exception:
+                self._slots.release()
+                logger.exception("Failed to claim job")
+                await asyncio.sleep(self.poll_interval)
+                continue
+            if job is None:
+                self._slots.release()
+                self._wake.clear()
+                try:
+                    await asyncio.wait_for(self._wake.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            if self._stopping:
+                # Claimed just as shutdown began
+                self._slots.release()
+                await self._release(job)
+                break
+            task = asyncio.create_task(self._run(job))
+            self._active.add(task)
+            task.add_done_callback(self._finished)
+
+    def _finished(self, task: asyncio.Task) -> None:
+        self._active.discard(task)
+        self._slots.release()
+
+    async def _run(self, job: Dict[str, Any]) -> None:
+        handler = self.handlers[job["name"]]
+        lease = datetime.utcnow() + timedelta(seconds=handler.lease_seconds)
+        await self.collection.update_one({"_id": job["_id"]}, {"$set": {"locked_until": lease}})
+        started = time.perf_counter()
+        try:
+            await handler.func(job["payload"])
+        except asyncio.CancelledError:
+            # Shutting down: hand the job back now instead of leaving it leased
+            await asyncio.shield(self._release(job))
+            raise
+        except Exception as e:
+            await self._failed(job, e)
+            return
+        now = datetime.utcnow()
+        await self.collection.update_one(
+            {"_id": job["_id"]},
+            {"$set": {"status": DONE, "completed_at": now, "duration_ms": round((time.perf_counter() - started) * 1000, 1),
+                      "expire_at": now + COMPLETED_JOB_RETENTION},
+             "$unset": {"locked_until": ""}},
+        )
+        self.stats["completed"] += 1
+        self._completions.append(time.monotonic())
+
+    async def _release(self, job: Dict[str, Any]) -> None:
+        """Return a claimed job to the queue without counting the attempt."""
+        now = datetime.utcnow()
+        try:
+            await self.collection.update_one(
+                {"_id": job["_id"], "status": RUNNING, "worker_id": self.worker_id},
+                {"$set": {"status": PENDING, "run_at": now, "locked_until": now}, "$inc": {"attempts": -1}},
+            )
+        except Exception:
+            logger.exception("Failed to release job %s (%s); its lease will expire instead", job["_id"], job["name"])
+
+    async def _failed(self, job: Dict[str, Any], error: Exception) -> None:
+        now = datetime.utcnow()
+        update: Dict[str, Any] = {"last_error": repr(error)}
+        if job["attempts"] < job["max_attempts"]:
+            update.update({"status": PENDING, "run_at": now + timedelta(seconds=retry_delay(job["attempts"]))})
+            self.stats["retried"] += 1
+            logger.warning("Job %s (%s) failed on attempt %d, retrying: %r", job["_id"], job["name"], job["attempts"], error)
+        else:
+            update.update({"status": FAILED, "expire_at": now + COMPLETED_JOB_RETENTION})
+            self.stats["failed"] += 1
+            logger.error("Job %s (%s) failed permanently after %d attempts: %r", job["_id"], job["name"], job["attempts"], error)
+        await self.collection.update_one({"_id": job["_id"]}, {"$set": update, "$unset": {"locked_until": ""}})
+
+    async def _scheduler_loop(self) -> None:
+        # The unique dedupe_key index is what keeps two instances from enqueueing the same slot
+        while not self._stopping:
+            try:
+                await self.ensure_indexes()
+                break
+            except Exception:
+                logger.exception("Failed to create job indexes; periodic jobs wait until they exist")
+                await asyncio.sleep(self.scheduler_interval)
+        while not self._stopping:
+            now = datetime.utcnow()
+            for schedule in self.schedules:
+                slot = schedule.latest_slot(now)
+                try:
+                    await self.enqueue(schedule.job_name, {**(schedule.payload or {}), "slot": slot.isoformat()},
+                                       run_at=slot, dedupe_key=f"periodic:{schedule.job_name}:{slot.isoformat()}")
+                except Exception:
+                    logger.exception("Failed to enqueue periodic job %s", schedule.job_name)
+            await asyncio.sleep(self.scheduler_interval)
+
+    async def metrics(self) -> Dict[str, Any]:
+        now = datetime.utcnow()
+        counts = {row["_id"]: row["count"] for row in await self.collection.aggregate([
+            {"$group": {"_id": "$status", "count": {"$sum": 1}}}
+        ]).to_list(None)}
+        oldest_due = await self.collection.find_one(
+            {"status": PENDING, "run_at": {"$lte": now}}, {"_id": 0, "run_at": 1}, sort=[("run_at", 1)]
+        )
+
+        cutoff = time.monotonic() - THROUGHPUT_WINDOW_SECONDS
+        while self._completions and self._completions[0] < cutoff:
+            self._completions.popleft()
+        return {
+            "worker_id": self.worker_id,
+            "queue": {status: counts.get(status, 0) for status in (PENDING, RUNNING, DONE, FAILED)},
+            "queue_lag_seconds": round((now - oldest_due["run_at"]).total_seconds(), 3) if oldest_due else 0.0,
+            "running_here": len(self._active),
+            "concurrency": self.concurrency,
+            "throughput_per_minute": round(len(self._completions) / (THROUGHPUT_WINDOW_SECONDS / 60), 2),
+            **self.stats,
+        }
@@ -0,0 +1,167 @@
+"""Process lifecycle: readiness, liveness and graceful shutdown.
+
+The process moves through ``starting -> ready -> draining -> stopped``.
+Readiness is true only while ``ready``, so a load balancer stops routing here
+as soon as draining begins. Liveness stays true until the process has
+stopped, because restarting a draining process would cut off the requests it
+is finishing.
+
+On SIGTERM (or Ctrl-C), ``run_server`` does not hand the signal to uvicorn
+straight away. It first marks the process as draining, which also runs the
+``on_drain`` callbacks (the job runner stops claiming work), and keeps
+serving for ``drain_delay`` seconds, long enough for the load balancer to see
+readiness fail. It then waits for in-flight requests to finish, and only then
+lets uvicorn close the listener and run the lifespan shutdown, which flushes
+background work. Responses sent while draining carry ``Connection: close``,
+so keep-alive clients reconnect to another instance. A second signal stops
+at once.
+
+All of this shares one budget, ``shutdown_timeout`` seconds from the moment
+draining begins; ``time_left`` tells each step how much of it remains. Keep
+it below the grace period the orchestrator allows before SIGKILL.
+"""
+import asyncio
+import logging
+import time
+from typing import Callable, List, Optional
+
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+logger = logging.getLogger(__name__)
+
+STARTING = "starting"
+READY = "ready"
+DRAINING = "draining"
+STOPPED = "stopped"
+
+# After the drain, uvicorn gives requests that slipped in meanwhile at most this long before cancelling them
+STRAGGLER_GRACE_SECONDS = 5
+# Part of the shutdown budget the drain leaves for the lifespan shutdown (handing back jobs, flushing writes)
+SHUTDOWN_TAIL_SECONDS = 3
+
+
+class Lifecycle:
+    def __init__(self, shutdown_timeout: float = 25.0):
+        self.state = STARTING
+        self.in_flight = 0
+        self.started_at = time.monotonic()
+        self.shutdown_timeout = shutdown_timeout
+        self.deadline: Optional[float] = None
+        self._drain_callbacks: List[Callable[[], None]] = []
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+    @property
+    def ready(self) -> bool:
+        return self.state == READY
+
+    @property
+    def alive(self) -> bool:
+        return self.state != STOPPED
+
+    @property
+    def draining(self) -> bool:
+        return self.state in (DRAINING, STOPPED)
+
+    def mark_ready(self) -> None:
+        if self.state == STARTING:
+            self.state = READY
+
+    def on_drain(self, callback: Callable[[], None]) -> None:
+        """Call ``callback()`` as soon as draining begins."""
+        self._drain_callbacks.append(callback)
+
+    def begin_drain(self) -> None:
+        if self.state in (STARTING, READY):
+            logger.info("Draining: readiness now fails; %d request(s) in flight", self.in_flight)
+            self.state = DRAINING
+            self.deadline = time.monotonic() + self.shutdown_timeout
+            for callback in self._drain_callbacks:
+                try:
+                    callback()
+                except Exception:
+                    logger.exception("Drain callback %r failed", callback)
+
+    def time_left(self, reserve: float = 0.0) -> float:
+        """Seconds of the shutdown budget left, less ``reserve``; the whole budget until draining begins."""
+        deadline = self.deadline if self.deadline is not None else time.monotonic() + self.shutdown_timeout
+        return max(deadline - time.monotonic() - reserve, 0.0)
+
+    def mark_stopped(self) -> None:
+        self.state = STOPPED
+
+    def request_started(self) -> None:
+        self.in_flight += 1
+        self._idle.clear()
+
+    def request_finished(self) -> None:
+        self.in_flight -= 1
+        if self.in_flight == 0:
+            self._idle.set()
+
+    async def wait_idle(self, timeout: float) -> bool:
+        """Wait until no requests are in flight; False if ``timeout`` passed first."""
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def status(self) -> dict:
+        return {
+            "state": self.state,
+            "in_flight": self.in_flight,
+            "uptime_seconds": round(time.monotonic() - self.started_at, 1),
+        }
+
+
+class LifecycleMiddleware:
+    """Counts in-flight HTTP requests and asks clients to reconnect elsewhere while draining."""
+
+    def __init__(self, app: ASGIApp, lifecycle: Lifecycle):
+        self.app = app
+        self.lifecycle = lifecycle
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        async def send_draining(message: Message) -> None:
+            if message["type"] == "http.response.start" and self.lifecycle.draining:
+                MutableHeaders(scope=message)["Connection"] = "close"
+            await send(message)
+
+        self.lifecycle.request_started()
+        try:
+            await self.app(scope, receive, send_draining)
+        finally:
+            self.lifecycle.request_finished()
+
+
+def run_server(app: str, host: str, port: int, lifecycle: Lifecycle, drain_delay: float) -> None:
+    """``uvicorn.run`` with a drain phase between the shutdown signal and uvicorn's own shutdown."""
+    import uvicorn
+
+    class GracefulServer(uvicorn.Server):
+        draining: Optional[asyncio.Task] = None
+
+        def handle_exit(self, sig, frame) -> None:
+            if self.draining is not None:
+                # Second signal: stop waiting
+                super().handle_exit(sig, frame)
+                return
+            lifecycle.begin_drain()
+            self.draining = asyncio.get_event_loop().create_task(self.drain_then_exit(sig, frame))
+
+        async def drain_then_exit(self, sig, frame) -> None:
+            await asyncio.sleep(min(drain_delay, lifecycle.time_left(SHUTDOWN_TAIL_SECONDS)))
+            if not await lifecycle.wait_idle(lifecycle.time_left(SHUTDOWN_TAIL_SECONDS)):
+                logger.warning("Drain timeout: stopping with %d request(s) still in flight", lifecycle.in_flight)
+            # Uvicorn reads this when it shuts down; its grace comes out of the same budget
+            self.config.timeout_graceful_shutdown = min(STRAGGLER_GRACE_SECONDS, lifecycle.time_left(SHUTDOWN_TAIL_SECONDS))
+            super().handle_exit(sig, frame)
+
+    config = uvicorn.Config(app, host=host, port=port, timeout_graceful_shutdown=STRAGGLER_GRACE_SECONDS)
+    GracefulServer(config).run()
@@ -0,0 +1,214 @@
+"""Opt-in per-request profiling.
+
+A request is profiled when an admin sends ``X-Profile: 1`` or when it is
+picked by ``sample_rate``. While it runs, a sampler thread looks at the event
+loop thread every ``interval`` seconds:
+
+* if the request's task is running, the sample is its Python stack;
+* if it is suspended, the sample is the chain of coroutines it is awaiting,
+  ending in an ``[awaiting ...]`` frame, so time spent waiting on Mongo shows
+  up next to CPU time spent in validation or the averaging code.
+
+Samples are weighted by the microseconds since the previous one and stored
+as collapsed stacks (``frame;frame;frame weight`` per line), the input format
+of flamegraph.pl, speedscope and similar viewers. Profiled responses carry an
+``X-Profile-Id`` header naming the stored profile.
+
+Requests that are not profiled cost one scan of the request headers, plus a
+random draw when ``sample_rate`` is set.
+"""
+import asyncio
+import logging
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+logger = logging.getLogger(__name__)
+
+PROFILE_HEADER = b"x-profile"
+PROFILE_ID_HEADER = "X-Profile-Id"
+
+
+def _frame_label(frame) -> str:
+    return f"{frame.f_globals.get('__name__', '?')}.{frame.f_code.co_qualname}"
+
+
+def _awaited_labels(coro) -> List[str]:
+    """Labels for a suspended coroutine and everything it is awaiting, outermost first."""
+    labels = []
+    while coro is not None:
+        frame = getattr(coro, "cr_frame", None) or getattr(coro, "gi_frame", None)
+        if frame is None:
+            break
+        labels.append(_frame_label(frame))
+        awaited = getattr(coro, "cr_await", None) or getattr(coro, "gi_yieldfrom", None)
+        if awaited is not None and not hasattr(awaited, "cr_frame") and not hasattr(awaited, "gi_frame"):
+            # A future: I/O, a thread pool (Motor) or another task
+            labels.append(f"[awaiting {type(awaited).__name__.removesuffix('Iter')}]")
+            return labels
+        coro = awaited
+    labels.append("[awaiting]")
+    return labels
+
+
+class RequestSampler:
+    """Samples one asyncio task from a background thread."""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, task: asyncio.Task, interval: float):
+        self.loop = loop
+        self.task = task
+        self.interval = interval
+        self.loop_thread_id = threading.get_ident()
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self.running_us = 0
+        self.awaiting_us = 0
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self._thread.join()
+
+    def _run(self) -> None:
+        last = time.perf_counter()
+        while not self._stopped.wait(self.interval):
+            now = time.perf_counter()
+            weight = int((now - last) * 1_000_000)
+            last = now
+            running = asyncio.current_task(self.loop) is self.task
+            labels = self._running_labels() if running else _awaited_labels(self.task.get_coro())
+            if not labels:
+                continue
+            self.stacks[";".join(labels)] += weight
+            self.samples += 1
+            if running:
+                self.running_us += weight
+            else:
+                self.awaiting_us += weight
+
+    def _running_labels(self) -> List[str]:
+        frame = sys._current_frames().get(self.loop_thread_id)
+        root = self.task.get_coro().cr_frame
+        frames = []
+        # Stop at the task's own coroutine; the event loop frames below it are the same for every sample
+        while frame is not None:
+            frames.append(frame)
+            if frame is root:
+                break
+            frame = frame.f_back
+        return [_frame_label(frame) for frame in reversed(frames)]
+
+    def collapsed(self) -> str:
+        return "\n".join(f"{stack} {weight}" for stack, weight in self.stacks.most_common())
+
+
+class ProfileStore:
+    def __init__(self, db, collection: str = "request_profiles", ttl: timedelta = timedelta(days=7)):
+        self.db = db
+        self.collection_name = collection
+        self.ttl = ttl
+        self._pending: set = set()
+
+    @property
+    def collection(self):
+        return self.db[self.collection_name]
+
+    async def ensure_indexes(self) -> None:
+        await self.collection.create_index("expire_at", expireAfterSeconds=0)
+        await self.collection.create_index("started_at")
+
+    async def save(self, profile: Dict[str, Any]) -> None:
+        try:
+            await self.collection.insert_one({**profile, "expire_at": profile["started_at"] + self.ttl})
+        except Exception:
+            logger.exception("Failed to store request profile %s", profile["_id"])
+
+    def save_later(self, profile: Dict[str, Any]) -> None:
+        """Save without holding up the response; ``flush`` waits for outstanding saves."""
+        task = asyncio.create_task(self.save(profile))
+        self._pending.add(task)
+        task.add_done_callback(self._pending.discard)
+
+    async def flush(self, timeout: float) -> None:
+        if self._pending:
+            await asyncio.wait(set(self._pending), timeout=timeout)
+
+    async def recent(self, limit: int = 50) -> List[Dict[str, Any]]:
+        return await self.collection.find({}, {"collapsed": 0, "expire_at": 0}).sort("started_at", -1).to_list(limit)
+
+    async def get(self, profile_id: str) -> Optional[Dict[str, Any]]:
+        return await self.collection.find_one({"_id": profile_id})
+
+
+class ProfilingMiddleware:
+    def __init__(self, app: ASGIApp, store: ProfileStore, authorize: Callable[[Headers], bool],
+                 sample_rate: float = 0.0, interval: float = 0.005):
+        """``authorize(headers)`` decides whether a request may ask to be profiled."""
+        self.app = app
+        self.store = store
+        self.authorize = authorize
+        self.sample_rate = sample_rate
+        self.interval = interval
+
+    def _trigger(self, scope: Scope) -> Optional[str]:
+        for name, value in scope["headers"]:
+            if name == PROFILE_HEADER:
+                if value not in (b"0", b"false") and self.authorize(Headers(scope=scope)):
+                    return "header"
+                break
+        if self.sample_rate and random.random() < self.sample_rate:
+            return "sampled"
+        return None
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        trigger = self._trigger(scope) if scope["type"] == "http" else None
+        if trigger is None:
+            await self.app(scope, receive, send)
+            return
+
+        profile_id = uuid.uuid4().hex
+        status_code = None
+
+        async def send_with_profile_id(message: Message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                MutableHeaders(scope=message).append(PROFILE_ID_HEADER, profile_id)
+            await send(message)
+
+        sampler = RequestSampler(asyncio.get_running_loop(), asyncio.current_task(), self.interval)
+        started_at = datetime.utcnow()
+        started = time.perf_counter()
+        sampler.start()
+        try:
+            await self.app(scope, receive, send_with_profile_id)
+        finally:
+            sampler.stop()
+            profile = {
+                "_id": profile_id,
+                "method": scope["method"],
+                "path": scope["path"],
+                "query_string": scope.get("query_string", b"").decode("latin-1"),
+                "status_code": status_code,
+                "trigger": trigger,
+                "started_at": started_at,
+                "duration_ms": round((time.perf_counter() - started) * 1000, 2),
+                "samples": sampler.samples,
+                "interval_ms": self.interval * 1000,
+                "running_ms": round(sampler.running_us / 1000, 2),
+                "awaiting_ms": round(sampler.awaiting_us / 1000, 2),
+                "collapsed": sampler.collapsed(),
+            }
+            self.store.save_later(profile)
@@ -0,0 +1,384 @@
+"""Retention tiers for raw wellness entries.
+
+Entries older than a collection's retention window are handled one calendar
+month at a time. Each pass over a month is a batch recorded in ``archives``:
+
+1. the month's not-yet-archived entries are tagged with the batch id,
+2. the tagged entries are written to a compressed NDJSON archive
+   (``<collection>/<YYYY-MM>-<batch>.ndjson.zst``; gzip when the optional
+   ``zstandard`` package is missing), one compressed frame per user, with
+   each frame's offset recorded in ``archive_segments``,
+3. they are folded into ``monthly_summaries`` (one document per user,
+   collection and month, plus habit for check-ins),
+4. they are stamped with ``expire_at`` so the TTL index removes them.
+
+Every step is flagged on the batch, so an interrupted run resumes without
+double counting, and entries imported into an archived month later simply
+form another batch.
+
+Retention is off unless ``RETENTION_DAYS`` enables it. Archives are the only
+copy of expired entries, and any instance may run the archival job or serve
+an export, so the archive directory must be storage that every instance
+mounts and that outlives deploys (a network volume, not a container's disk).
+
+``iter_archived_entries`` reads one user's frames back for exports, without
+decompressing anyone else's. The concatenated frames are still a valid
+``.zst``/``.gz`` file, so standard tools can read a whole archive. Run an
+archival pass manually with:
+
+    python retention.py
+"""
+import asyncio
+import gzip
+import hashlib
+import json
+import logging
+import os
+import uuid
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from bson import json_util
+
+try:
+    import zstandard
+except ImportError:  # optional dependency
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_RETENTION_DAYS = 0
+
+# collection -> value averaged in the summary, plus extra per-group keys and summed counters
+RETAINED_COLLECTIONS: Dict[str, Dict[str, Any]] = {
+    "mood_entries": {"value": "mood_level", "group": [], "sums": []},
+    "stress_entries": {"value": "stress_level", "group": [], "sums": []},
+    "productivity_entries": {"value": "productivity_score", "group": [], "sums": ["tasks_completed", "focus_time_minutes"]},
+    "habit_checkins": {"value": None, "group": ["habit_id"], "sums": []},
+}
+
+
+class ArchiveUnavailable(RuntimeError):
+    """An archive file recorded in ``archives`` is missing from the archive directory."""
+
+
+def parse_retention(raw: Optional[str]) -> Dict[str, int]:
+    """``RETENTION_DAYS`` is a JSON object of collection -> days (0, the default, keeps forever)."""
+    configured = json.loads(raw) if raw else {}
+    unknown = set(configured) - set(RETAINED_COLLECTIONS)
+    if unknown:
+        raise ValueError(f"Retention configured for unknown collections: {', '.join(sorted(unknown))}")
+    return {name: int(configured.get(name, DEFAULT_RETENTION_DAYS)) for name in RETAINED_COLLECTIONS}
+
+
+def _month_start(value: datetime) -> datetime:
+    return datetime(value.year, value.month, 1)
+
+
+def _next_month(month: datetime) -> datetime:
+    return datetime(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+
+def _archive_suffix() -> str:
+    return ".ndjson.zst" if zstandard is not None else ".ndjson.gz"
+
+
+def _compress(data: bytes) -> bytes:
+    if zstandard is not None:
+        return zstandard.ZstdCompressor(level=10).compress(data)
+    return gzip.compress(data, compresslevel=9)
+
+
+def _decompress(path: Path, data: bytes) -> bytes:
+    if path.name.endswith(".zst"):
+        if zstandard is None:
+            raise RuntimeError("zstandard is required to read " + str(path))
+        return zstandard.ZstdDecompressor().decompress(data)
+    return gzip.decompress(data)
+
+
+def _naive_utc(value: Optional[datetime]) -> Optional[datetime]:
+    # Entries are stored as naive UTC; query parameters may carry an offset
+    if value is not None and value.tzinfo is not None:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+async def ensure_indexes(db) -> None:
+    for name in RETAINED_COLLECTIONS:
+        await db[name].create_index("expire_at", expireAfterSeconds=0)
+        await db[name].create_index("archive_batch", sparse=True)
+    await db.archives.create_index([("collection", 1), ("month", 1)])
+    await db.archive_segments.create_index([("user_id", 1), ("collection", 1), ("month", 1)])
+    await db.archive_segments.create_index("batch")
+    await db.monthly_summaries.create_index([("user_id", 1), ("collection", 1), ("month", 1)])
+
+
+def summary_pipeline(collection: str, month: datetime, batch_id: str) -> List[Dict[str, Any]]:
+    """Fold one batch into ``monthly_summaries``, combining with earlier batches of the month."""
+    spec = RETAINED_COLLECTIONS[collection]
+    group: Dict[str, Any] = {
+        "_id": {"user_id": "$user_id", **{key: f"${key}" for key in spec["group"]}},
+        "count": {"$sum": 1},
+    }
+    combine: Dict[str, Any] = {"count": {"$add": ["$count", "$$new.count"]}}
+    if spec["value"]:
+        value = f"${spec['value']}"
+        group.update({"average": {"$avg": value}, "min": {"$min": value}, "max": {"$max": value}})
+        combine.update({
+            "average": {"$divide": [
+                {"$add": [{"$multiply": ["$average", "$count"]}, {"$multiply": ["$$new.average", "$$new.count"]}]},
+                {"$add": ["$count", "$$new.count"]},
+            ]},
+            "min": {"$min": ["$min", "$$new.min"]},
+            "max": {"$max": ["$max", "$$new.max"]},
+        })
+    counters = spec["sums"] + (["completed"] if collection == "habit_checkins" else [])
+    for field in spec["sums"]:
+        group[field] = {"$sum": f"${field}"}
+    if collection == "habit_checkins":
+        group["completed"] = {"$sum": {"$cond": ["$completed", 1, 0]}}
+    for field in counters:
+        combine[field] = {"$add": [f"${field}", f"$$new.{field}"]}
+
+    summary_id: List[Any] = [collection, ":", "$_id.user_id", ":", month.strftime("%Y-%m")]
+    for key in spec["group"]:
+        summary_id += [":", f"$_id.{key}"]
+    return [
+        {"$match": {"date": {"$gte": month, "$lt": _next_month(month)}, "archive_batch": batch_id}},
+        {"$group": group},
+        {"$set": {
+            "user_id": "$_id.user_id",
+            **{key: f"$_id.{key}" for key in spec["group"]},
+            "collection": collection,
+            "month": month,
+            "_id": {"$concat": summary_id},
+        }},
+        {"$merge": {
+            "into": "monthly_summaries",
+            "on": "_id",
+            "whenMatched": [{"$set": combine}],
+            "whenNotMatched": "insert",
+        }},
+    ]
+
+
+async def _lines_by_user(cursor) -> AsyncIterator[Tuple[str, List[bytes]]]:
+    """Group a cursor sorted by user into each user's encoded NDJSON lines."""
+    user_id, lines = None, []
+    async for entry in cursor:
+        if lines and entry.get("user_id") != user_id:
+            yield user_id, lines
+            lines = []
+        user_id = entry.get("user_id")
+        lines.append((json_util.dumps(entry, json_options=json_util.RELAXED_JSON_OPTIONS) + "\n").encode("utf-8"))
+    if lines:
+        yield user_id, lines
+
+
+async def _write_archive(db, collection: str, batch: Dict[str, Any], path: Path) -> Dict[str, Any]:
+    """Write the batch as one compressed frame per user, recording each frame in ``archive_segments``."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(path.name + ".tmp")
+    digest = hashlib.sha256()
+    count = 0
+    segments: List[Dict[str, Any]] = []
+    # A resumed batch is rewritten from scratch
+    await db.archive_segments.delete_many({"batch": batch["_id"]})
+
+    batch_filter = {"date": {"$gte": batch["month"], "$lt": _next_month(batch["month"])}, "archive_batch": batch["_id"]}
+    cursor = db[collection].find(batch_filter, {"_id": 0, "archive_batch": 0}, allow_disk_use=True)
+    with open(tmp_path, "wb") as out:
+        async for user_id, lines in _lines_by_user(cursor.sort([("user_id", 1), ("date", 1)]).batch_size(5000)):
+            data = b"".join(lines)
+            frame = _compress(data)
+            segments.append({
+                "_id": f"{batch['_id']}:{user_id}",
+                "batch": batch["_id"],
+                "collection": collection,
+                "month": batch["month"],
+                "user_id": user_id,
+                "path": batch["path"],
+                "offset": out.tell(),
+                "length": len(frame),
+                "count": len(lines),
+            })
+            out.write(frame)
+            digest.update(data)
+            count += len(lines)
+            if len(segments) >= 1000:
+                await db.archive_segments.insert_many(segments)
+                segments.clear()
+        out.flush()
+        os.fsync(out.fileno())
+    os.replace(tmp_path, path)
+    if segments:
+        await db.archive_segments.insert_many(segments)
+    return {"count": count, "sha256": digest.hexdigest(), "bytes": path.stat().st_size}
+
+
+async def archive_month(db, collection: str, month: datetime, archive_dir: Path) -> Optional[Dict[str, Any]]:
+    """Archive and expire a month's remaining entries; returns the batch, or None if nothing was left."""
+    month_range = {"$gte": month, "$lt": _next_month(month)}
+    batch = await db.archives.find_one({"collection": collection, "month": month, "expired": False})
+    if batch is None:
+        batch_id = f"{collection}:{month.strftime('%Y-%m')}:{uuid.uuid4().hex[:8]}"
+        batch = {
+            "_id": batch_id,
+            "collection": collection,
+            "month": month,
+            "path": f"{collection}/{month.strftime('%Y-%m')}-{batch_id.rsplit(':', 1)[1]}{_archive_suffix()}",
+            "created_at": datetime.utcnow(),
+            "archived": False,
+            "summarized": False,
+            "expired": False,
+        }
+        await db.archives.insert_one(batch)
+    batch_filter = {"date": month_range, "archive_batch": batch["_id"]}
+
+    if not batch["archived"]:
+        # Tag (or, when resuming, top up) the batch, then write exactly the tagged entries
+        await db[collection].update_many(
+            {"date": month_range, "archive_batch": {"$exists": False}},
+            {"$set": {"archive_batch": batch["_id"]}}
+        )
+        stats = await _write_archive(db, collection, batch, archive_dir / batch["path"])
+        if stats["count"] == 0:
+            await db.archives.delete_one({"_id": batch["_id"]})
+            await db.archive_segments.delete_many({"batch": batch["_id"]})
+            (archive_dir / batch["path"]).unlink(missing_ok=True)
+            return None
+        batch.update(stats, archived=True, archived_at=datetime.utcnow())
+        await db.archives.update_one({"_id": batch["_id"]}, {"$set": {**stats, "archived": True, "archived_at": batch["archived_at"]}})
+
+    if not batch["summarized"]:
+        await db[collection].aggregate(summary_pipeline(collection, month, batch["_id"])).to_list(None)
+        await db.archives.update_one({"_id": batch["_id"]}, {"$set": {"summarized": True}})
+
+    # Only now is it safe to let the TTL monitor drop the raw entries, provided the archive is really there
+    archive_path = archive_dir / batch["path"]
+    if not archive_path.is_file() or archive_path.stat().st_size != batch["bytes"]:
+        raise ArchiveUnavailable(f"{archive_path} is missing or incomplete; not expiring {batch['_id']}")
+    await db[collection].update_many(batch_filter, {"$set": {"expire_at": datetime.utcnow()}})
+    await db.archives.update_one({"_id": batch["_id"]}, {"$set": {"expired": True}})
+    batch.update(summarized=True, expired=True)
+    logger.info("Archived %d %s entries for %s (%d bytes)", batch["count"], collection, month.strftime("%Y-%m"), batch["bytes"])
+    return batch
+
+
+async def run_retention(db, retention_days: Dict[str, int], archive_dir: Optional[Path],
+                        now: Optional[datetime] = None) -> List[Dict[str, Any]]:
+    """Archive and expire every month that has fallen out of its collection's window."""
+    now = now or datetime.utcnow()
+    if archive_dir is None and any(days > 0 for days in retention_days.values()):
+        raise ArchiveUnavailable("Retention is enabled but no archive directory is configured")
+    archived = []
+    for collection, days in retention_days.items():
+        if days <= 0:
+            continue
+        cutoff = _month_start(now - timedelta(days=days))
+
+        # Finish batches an earlier run left half done
+        async for batch in db.archives.find({"collection": collection, "expired": False}, {"month": 1}):
+            archived.append(await archive_month(db, collection, batch["month"], archive_dir))
+
+        while True:
+            oldest = await db[collection].find_one(
+                {"archive_batch": {"$exists": False}, "date": {"$lt": cutoff}}, {"_id": 0, "date": 1}, sort=[("date", 1)]
+            )
+            if oldest is None:
+                break
+            batch = await archive_month(db, collection, _month_start(oldest["date"]), archive_dir)
+            if batch is None:
+                break
+            archived.append(batch)
+    return [batch for batch in archived if batch is not None]
+
+
+def _read_segment(path: Path, offset: int, length: int,
+                  since: Optional[datetime], until: Optional[datetime]) -> List[Dict[str, Any]]:
+    try:
+        with open(path, "rb") as archive:
+            archive.seek(offset)
+            frame = archive.read(length)
+    except FileNotFoundError:
+        raise ArchiveUnavailable(f"{path} is missing") from None
+    entries = []
+    for line in _decompress(path, frame).decode("utf-8").splitlines():
+        entry = json_util.loads(line)
+        date = entry.get("date")
+        if date is not None:
+            date = date.replace(tzinfo=None)
+            entry["date"] = date
+            if (since and date < since) or (until and date >= until):
+                continue
+        entries.append(entry)
+    return entries
+
+
+async def _archived_batch_ids(db, collections: List[str]) -> List[str]:
+    return await db.archives.distinct("_id", {"collection": {"$in": collections}, "archived": True})
+
+
+async def missing_archives(db, user_id: str, collections: List[str], archive_dir: Optional[Path]) -> List[str]:
+    """Archive files holding some of the user's entries that the archive directory lacks."""
+    paths = await db.archive_segments.distinct("path", {
+        "user_id": user_id, "batch": {"$in": await _archived_batch_ids(db, collections)}
+    })
+    if archive_dir is None:
+        return paths
+    return [path for path in paths if not await asyncio.to_thread((archive_dir / path).is_file)]
+
+
+async def iter_archived_entries(db, collection: str, user_id: str, archive_dir: Optional[Path],
+                                since: Optional[datetime] = None, until: Optional[datetime] = None) -> AsyncIterator[Dict[str, Any]]:
+    """Rehydrate one user's archived entries of ``collection``, month by month.
+
+    Raises ``ArchiveUnavailable`` if an archive file is missing; call
+    ``missing_archives`` first to fail before a response has started.
+    """
+    since, until = _naive_utc(since), _naive_utc(until)
+    query: Dict[str, Any] = {
+        "user_id": user_id, "collection": collection, "batch": {"$in": await _archived_batch_ids(db, [collection])}
+    }
+    if since or until:
+        query["month"] = {}
+        if since:
+            query["month"]["$gte"] = _month_start(since)
+        if until:
+            query["month"]["$lt"] = until
+    async for segment in db.archive_segments.find(query).sort("month", 1):
+        if archive_dir is None:
+            raise ArchiveUnavailable("No archive directory is configured")
+        # Decompression and parsing are CPU-bound; keep them off the event loop
+        entries = await asyncio.to_thread(
+            _read_segment, archive_dir / segment["path"], segment["offset"], segment["length"], since, until
+        )
+        for entry in entries:
+            yield entry
+
+
+def main() -> None:
+    from dotenv import load_dotenv
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    load_dotenv(Path(__file__).parent / '.env')
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+    db = client[os.environ['DB_NAME']]
+    archive_dir = Path(os.environ['ARCHIVE_DIR']) if os.environ.get('ARCHIVE_DIR') else None
+
+    async def run():
+        await ensure_indexes(db)
+        return await run_retention(db, parse_retention(os.environ.get('RETENTION_DAYS')), archive_dir)
+
+    try:
+        archived = asyncio.run(run())
+    finally:
+        client.close()
+    print(f"Archived {len(archived)} collection-months")
+
+
+if __name__ == "__main__":
+    main()
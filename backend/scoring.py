@@ -0,0 +1,213 @@
+"""Wellness score calculation and the nightly batch scoring job.
+
+The API schedules it as the ``wellness_scoring`` job shortly after every UTC
+midnight. Run it manually with:
+
+    python scoring.py --date 2025-07-21 --chunk-size 500
+
+The job walks the users collection in ``id`` order, scores each chunk of users
+with a single aggregation across the entry collections and upserts one
+``wellness_scores`` document per user per day. Progress is checkpointed after
+every chunk so an interrupted run resumes where it stopped.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+SCORE_WINDOW_DAYS = 30
+DEFAULT_CHUNK_SIZE = 500
+CHECKPOINT_COLLECTION = "job_checkpoints"
+
+# Neutral values used when a user logged nothing in the window
+DEFAULT_MOOD_AVERAGE = 3
+DEFAULT_STRESS_AVERAGE = 3
+DEFAULT_PRODUCTIVITY_AVERAGE = 5
+
+
+def calculate_wellness_score(habit_completion_rate: float, mood_avg: float, stress_avg: float, productivity_avg: float) -> float:
+    return (
+        (habit_completion_rate / 100) * 0.3 +  # 30% weight for habits
+        (mood_avg / 5) * 0.3 +  # 30% weight for mood
+        ((6 - stress_avg) / 5) * 0.2 +  # 20% weight for stress (inverted)
+        (productivity_avg / 10) * 0.2  # 20% weight for productivity
+    ) * 100
+
+
+async def ensure_indexes(db) -> None:
+    from pymongo import ASCENDING, DESCENDING
+
+    await db.wellness_scores.create_index([("user_id", ASCENDING), ("date", DESCENDING)], unique=True)
+
+
+def _window_match(user_ids: List[str], start: datetime, end: datetime) -> Dict[str, Any]:
+    return {"user_id": {"$in": user_ids}, "date": {"$gte": start, "$lt": end}}
+
+
+def build_chunk_pipeline(user_ids: List[str], start: datetime, end: datetime) -> List[Dict[str, Any]]:
+    """One pipeline that averages every score input for a chunk of users.
+
+    Each entry collection is projected to ``{user_id, kind, value}`` and unioned
+    so a single ``$group`` yields one row per (user, kind).
+    """
+    match = {"$match": _window_match(user_ids, start, end)}
+
+    def branch(kind: str, value: Any) -> List[Dict[str, Any]]:
+        return [match, {"$project": {"_id": 0, "user_id": 1, "kind": {"$literal": kind}, "value": value}}]
+
+    return [
+        *branch("habit", {"$cond": [{"$eq": ["$completed", True]}, 100, 0]}),
+        {"$unionWith": {"coll": "mood_entries", "pipeline": branch("mood", "$mood_level")}},
+        {"$unionWith": {"coll": "stress_entries", "pipeline": branch("stress", "$stress_level")}},
+        {"$unionWith": {"coll": "productivity_entries", "pipeline": branch("productivity", "$productivity_score")}},
+        {"$group": {"_id": {"user_id": "$user_id", "kind": "$kind"}, "average": {"$avg": "$value"}, "count": {"$sum": 1}}},
+    ]
+
+
+def scores_from_rows(user_ids: List[str], rows: List[Dict[str, Any]]) -> Dict[str, Dict[str, float]]:
+    averages: Dict[str, Dict[str, float]] = {user_id: {} for user_id in user_ids}
+    for row in rows:
+        averages[row["_id"]["user_id"]][row["_id"]["kind"]] = row["average"]
+
+    scores = {}
+    for user_id, values in averages.items():
+        habit_completion_rate = values.get("habit", 0.0)
+        mood_avg = values.get("mood", DEFAULT_MOOD_AVERAGE)
+        stress_avg = values.get("stress", DEFAULT_STRESS_AVERAGE)
+        productivity_avg = values.get("productivity", DEFAULT_PRODUCTIVITY_AVERAGE)
+        scores[user_id] = {
+            "wellness_score": round(calculate_wellness_score(habit_completion_rate, mood_avg, stress_avg, productivity_avg), 1),
+            "habit_completion_rate": round(habit_completion_rate, 1),
+            "mood_average": round(mood_avg, 1),
+            "stress_average": round(stress_avg, 1),
+            "productivity_average": round(productivity_avg, 1),
+        }
+    return scores
+
+
+async def _score_chunk(db, user_ids: List[str], day: datetime, computed_at: datetime) -> None:
+    from pymongo import UpdateOne
+
+    end = day + timedelta(days=1)
+    start = end - timedelta(days=SCORE_WINDOW_DAYS)
+    rows = await db.habit_checkins.aggregate(build_chunk_pipeline(user_ids, start, end)).to_list(None)
+    scores = scores_from_rows(user_ids, rows)
+
+    await db.wellness_scores.bulk_write([
+        UpdateOne(
+            {"user_id": user_id, "date": day},
+            {"$set": {**score, "computed_at": computed_at}},
+            upsert=True,
+        )
+        for user_id, score in scores.items()
+    ], ordered=False)
+    await db.users.bulk_write([
+        UpdateOne({"id": user_id}, {"$set": {"total_wellness_score": score["wellness_score"]}})
+        for user_id, score in scores.items()
+    ], ordered=False)
+
+
+async def run_daily_scoring(db, day: Optional[datetime] = None, chunk_size: int = DEFAULT_CHUNK_SIZE, resume: bool = True) -> Dict[str, Any]:
+    """Score every user for ``day`` (UTC midnight; defaults to yesterday).
+
+    Returns a summary with the number of users scored, elapsed time and throughput.
+    """
+    if day is None:
+        day = datetime.utcnow() - timedelta(days=1)
+    day = datetime(day.year, day.month, day.day)
+    checkpoint_id = f"wellness_scoring:{day.date().isoformat()}"
+    checkpoints = db[CHECKPOINT_COLLECTION]
+
+    checkpoint = await checkpoints.find_one({"_id": checkpoint_id}) if resume else None
+    if checkpoint and checkpoint.get("completed"):
+        logger.info("Wellness scoring for %s already completed, skipping", day.date())
+        return {"date": day, "users": 0, "seconds": 0.0, "users_per_second": 0.0, "skipped": True}
+
+    last_user_id = checkpoint.get("last_user_id") if checkpoint else None
+    processed = checkpoint.get("processed", 0) if checkpoint else 0
+    if last_user_id:
+        logger.info("Resuming wellness scoring for %s after user %s (%d done)", day.date(), last_user_id, processed)
+
+    query = {"id": {"$gt": last_user_id}} if last_user_id else {}
+    cursor = db.users.find(query, {"_id": 0, "id": 1}).sort("id", 1).batch_size(chunk_size)
+
+    computed_at = datetime.utcnow()
+    started = time.perf_counter()
+    scored = 0
+    chunk: List[str] = []
+
+    async def flush() -> None:
+        nonlocal scored, processed
+        await _score_chunk(db, chunk, day, computed_at)
+        scored += len(chunk)
+        processed += len(chunk)
+        await checkpoints.update_one(
+            {"_id": checkpoint_id},
+            {"$set": {"last_user_id": chunk[-1], "processed": processed, "completed": False, "updated_at": datetime.utcnow()}},
+            upsert=True,
+        )
+        elapsed = time.perf_counter() - started
+        logger.info("Scored %d users for %s (%.1f users/s)", processed, day.date(), scored / max(elapsed, 1e-9))
+        chunk.clear()
+
+    async for user in cursor:
+        chunk.append(user["id"])
+        if len(chunk) >= chunk_size:
+            await flush()
+    if chunk:
+        await flush()
+
+    await checkpoints.update_one(
+        {"_id": checkpoint_id},
+        {"$set": {"completed": True, "processed": processed, "updated_at": datetime.utcnow()}},
+        upsert=True,
+    )
+
+    elapsed = time.perf_counter() - started
+    summary = {
+        "date": day,
+        "users": scored,
+        "seconds": round(elapsed, 3),
+        "users_per_second": round(scored / max(elapsed, 1e-9), 1),
+        "skipped": False,
+    }
+    logger.info("Wellness scoring for %s finished: %d users in %.1fs (%.1f users/s)",
+                day.date(), scored, elapsed, summary["users_per_second"])
+    return summary
+
+
+def main() -> None:
+    from dotenv import load_dotenv
+    from motor.motor_asyncio import AsyncIOMotorClient
+    from pathlib import Path
+
+    parser = argparse.ArgumentParser(description="Compute daily wellness scores for all users")
+    parser.add_argument("--date", help="Day to score (YYYY-MM-DD, UTC). Defaults to yesterday.")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument("--no-resume", action="store_true", help="Ignore any existing checkpoint for this day")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    load_dotenv(Path(__file__).parent / '.env')
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+    db = client[os.environ['DB_NAME']]
+    day = datetime.strptime(args.date, "%Y-%m-%d") if args.date else None
+
+    async def run() -> Dict[str, Any]:
+        await ensure_indexes(db)
+        return await run_daily_scoring(db, day=day, chunk_size=args.chunk_size, resume=not args.no_resume)
+
+    try:
+        summary = asyncio.run(run())
+    finally:
+        client.close()
+    print(f"Scored {summary['users']} users in {summary['seconds']}s ({summary['users_per_second']} users/s)")
+
+
+if __name__ == "__main__":
+    main()
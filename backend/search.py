@@ -0,0 +1,50 @@
+"""Full-text search over a user's journal notes.
+
+Each entry collection has a compound text index ``(user_id, notes)``. The
+equality prefix on ``user_id`` means a search only walks the caller's index
+keys, not every user's notes. Results from the collections are merged by
+text score, newest first on ties.
+"""
+import heapq
+from itertools import islice
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+# entry type -> collection holding free-text notes
+NOTE_COLLECTIONS = {
+    "mood": "mood_entries",
+    "stress": "stress_entries",
+    "productivity": "productivity_entries",
+    "habit_checkin": "habit_checkins",
+}
+MAX_RESULT_WINDOW = 500
+
+
+async def ensure_indexes(db) -> None:
+    for collection in NOTE_COLLECTIONS.values():
+        await db[collection].create_index([("user_id", 1), ("notes", "text")], name="user_notes_text")
+
+
+async def search_notes(db, user_id: str, query: str, since: Optional[datetime] = None, until: Optional[datetime] = None,
+                       types: Optional[List[str]] = None, offset: int = 0, limit: int = 20) -> Tuple[List[Dict[str, Any]], bool]:
+    """Return one page of ranked matches and whether more results exist."""
+    if offset + limit > MAX_RESULT_WINDOW:
+        raise ValueError(f"Results beyond the first {MAX_RESULT_WINDOW} are not available; refine the query")
+
+    mongo_query: Dict[str, Any] = {"user_id": user_id, "$text": {"$search": query}}
+    if since or until:
+        mongo_query["date"] = {**({"$gte": since} if since else {}), **({"$lt": until} if until else {})}
+    projection = {"_id": 0, "id": 1, "date": 1, "notes": 1, "habit_id": 1, "score": {"$meta": "textScore"}}
+
+    # Each collection can contribute at most offset + limit + 1 results to this page
+    window = offset + limit + 1
+    per_collection = []
+    for entry_type in types or NOTE_COLLECTIONS:
+        cursor = db[NOTE_COLLECTIONS[entry_type]].find(mongo_query, projection).sort(
+            [("score", {"$meta": "textScore"}), ("date", -1)]
+        ).limit(window)
+        per_collection.append([{"type": entry_type, **entry} for entry in await cursor.to_list(window)])
+
+    ranked = heapq.merge(*per_collection, key=lambda entry: (-entry["score"], -entry["date"].timestamp()))
+    page = list(islice(ranked, offset, offset + limit + 1))
+    return page[:limit], len(page) > limit
@@ -1,35 +1,133 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, status
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, File, Header, Query, UploadFile, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from dotenv import load_dotenv
+from starlette.datastructures import Headers
 from starlette.middleware.cors import CORSMiddleware
-from motor.motor_asyncio import AsyncIOMotorClient
 import os
+import sys
+import json
+import asyncio
 import logging
+import time
 import bcrypt
 import jwt
 from pathlib import Path
 from pydantic import BaseModel, Field, EmailStr
 from typing import List, Optional, Dict, Any
 import uuid
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from enum import Enum
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+from contextlib import asynccontextmanager
+
+from auth_tokens import TokenManager
+from cache import AsyncResultCache
+from compression import CompressionMiddleware
+from database import LazyDatabase
+from idempotency import IdempotencyStore
+from importer import ImportFormatError, Importer, detect_format
+from habit_calendar import (
+    CALENDAR_FIELDS, calendar_bit, calendar_checkin_stage, calendar_increment,
+    summarize as summarize_calendar, year_projection
+)
+from jobs import JobRunner
+from lifecycle import Lifecycle, LifecycleMiddleware, run_server
+from profiling import ProfileStore, ProfilingMiddleware
+from retention import (
+    ensure_indexes as ensure_retention_indexes, iter_archived_entries, missing_archives, parse_retention, run_retention
+)
+from search import NOTE_COLLECTIONS, ensure_indexes as ensure_search_indexes, search_notes
+from scoring import calculate_wellness_score, ensure_indexes as ensure_scoring_indexes, run_daily_scoring
 
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-# MongoDB connection
+# MongoDB connection (the client is created on first use)
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
+db = LazyDatabase(mongo_url, os.environ['DB_NAME'])
 
 # JWT settings
 JWT_SECRET = os.environ.get('JWT_SECRET', 'mindmate-secret-key-change-in-production')
-JWT_ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_HOURS = 24
+token_manager = TokenManager.from_env(os.environ, default_secret=JWT_SECRET)
+
+# Dashboard cache settings
+DASHBOARD_CACHE_TTL_SECONDS = float(os.environ.get('DASHBOARD_CACHE_TTL_SECONDS', '60'))
+DASHBOARD_CACHE_STALE_SECONDS = float(os.environ.get('DASHBOARD_CACHE_STALE_SECONDS', '300'))
+dashboard_cache = AsyncResultCache(ttl=DASHBOARD_CACHE_TTL_SECONDS, stale_ttl=DASHBOARD_CACHE_STALE_SECONDS)
+
+# Background jobs: concurrent jobs this process runs (0 = enqueue only, e.g. API-only instances)
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', '4'))
+job_runner = JobRunner(db, concurrency=max(JOB_WORKERS, 1))
+
+# Raw entry retention: RETENTION_DAYS is a JSON object of collection -> days (0, the default, keeps forever).
+# Archives are the only copy of expired entries, so ARCHIVE_DIR must be a volume every instance mounts and
+# that survives redeploys; it is required once any retention is configured.
+RETENTION_DAYS = parse_retention(os.environ.get('RETENTION_DAYS'))
+ARCHIVE_DIR = Path(os.environ['ARCHIVE_DIR']) if os.environ.get('ARCHIVE_DIR') else None
+if ARCHIVE_DIR is None and any(RETENTION_DAYS.values()):
+    raise RuntimeError("RETENTION_DAYS is set, so ARCHIVE_DIR must point at shared, durable storage")
+
+# Replays of POSTs carrying the same Idempotency-Key within this window return the first response
+IDEMPOTENCY_KEY_TTL_HOURS = float(os.environ.get('IDEMPOTENCY_KEY_TTL_HOURS', '24'))
+idempotency_store = IdempotencyStore(db, ttl=timedelta(hours=IDEMPOTENCY_KEY_TTL_HOURS))
+
+# Rows validated and written per bulk insert during history imports
+IMPORT_BATCH_SIZE = int(os.environ.get('IMPORT_BATCH_SIZE', '1000'))
+
+# Admin analytics settings
+ADMIN_EMAILS = {email.strip().lower() for email in os.environ.get('ADMIN_EMAILS', '').split(',') if email.strip()}
+ANALYTICS_SNAPSHOT_DIR = Path(os.environ.get('ANALYTICS_SNAPSHOT_DIR', ROOT_DIR / 'analytics_snapshots'))
+# One instance exports per interval, as a scheduled job, and every instance serves the admin routes from the
+# result, so ANALYTICS_SNAPSHOT_DIR must be a volume every instance mounts once exports are scheduled
+ANALYTICS_EXPORT_INTERVAL_MINUTES = float(os.environ.get('ANALYTICS_EXPORT_INTERVAL_MINUTES', '0'))  # 0 disables
+if ANALYTICS_EXPORT_INTERVAL_MINUTES > 0 and not os.environ.get('ANALYTICS_SNAPSHOT_DIR'):
+    raise RuntimeError("ANALYTICS_EXPORT_INTERVAL_MINUTES is set, so ANALYTICS_SNAPSHOT_DIR must point at shared storage")
+analytics_store = None  # created on first analytics request; importing numpy is slow
+
+# Request profiling: admins send "X-Profile: 1"; PROFILE_SAMPLE_RATE also profiles that share of all requests
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', '0'))
+PROFILE_SAMPLE_INTERVAL_MS = float(os.environ.get('PROFILE_SAMPLE_INTERVAL_MS', '5'))
+PROFILE_TTL_DAYS = float(os.environ.get('PROFILE_TTL_DAYS', '7'))
+profile_store = ProfileStore(db, ttl=timedelta(days=PROFILE_TTL_DAYS))
+
+# Graceful shutdown: SHUTDOWN_TIMEOUT_SECONDS is the whole budget from SIGTERM to exit; keep it under the
+# orchestrator's kill grace period. The first SHUTDOWN_DRAIN_DELAY_SECONDS keep serving, with readiness failing,
+# so load balancers move traffic away; the rest goes to in-flight requests, then running jobs and buffered writes
+SHUTDOWN_DRAIN_DELAY_SECONDS = float(os.environ.get('SHUTDOWN_DRAIN_DELAY_SECONDS', '5'))
+SHUTDOWN_TIMEOUT_SECONDS = float(os.environ.get('SHUTDOWN_TIMEOUT_SECONDS', '25'))
+lifecycle = Lifecycle(shutdown_timeout=SHUTDOWN_TIMEOUT_SECONDS)
+# Jobs already running get the rest of the budget; new ones are left for instances that are staying up
+lifecycle.on_drain(job_runner.stop_claiming)
+
+# Responses smaller than this many bytes are sent uncompressed
+COMPRESSION_MINIMUM_SIZE = int(os.environ.get('COMPRESSION_MINIMUM_SIZE', '500'))
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Nothing here may block on Mongo: the process reports ready as soon as routes can be served
+    tasks = [asyncio.create_task(ensure_startup_indexes())]
+    if JOB_WORKERS > 0:
+        await job_runner.start()
+    app.state.background_tasks = tasks
+    lifecycle.mark_ready()
+    yield
+    # Uvicorn has stopped accepting connections and waited for in-flight requests by now
+    lifecycle.begin_drain()
+    if JOB_WORKERS > 0:
+        # Leave a second or two for cancelled jobs to hand themselves back and for the profile flush
+        await job_runner.stop(timeout=lifecycle.time_left(reserve=2))
+    await profile_store.flush(timeout=lifecycle.time_left())
+    for task in tasks:
+        task.cancel()
+    lifecycle.mark_stopped()
+    db.close()
 
 # Create the main app without a prefix
-app = FastAPI(title="MindMate API", description="Comprehensive Wellness & Mental Health Platform")
+app = FastAPI(title="MindMate API", description="Comprehensive Wellness & Mental Health Platform", lifespan=lifespan)
 
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
@@ -67,6 +165,7 @@ class UserCreate(BaseModel):
     password: str
     full_name: str
     age: Optional[int] = None
+    timezone: Optional[str] = None  # IANA name, e.g. "Europe/Berlin"; defaults to UTC
 
 class UserLogin(BaseModel):
     email: EmailStr
@@ -83,6 +182,8 @@ class User(BaseModel):
     bio: Optional[str] = None
     friends: List[str] = Field(default_factory=list)
     total_wellness_score: float = 0.0
+    timezone: Optional[str] = None
+    dashboard_version: int = 0  # bumped by every write the dashboard depends on
 
 class UserResponse(BaseModel):
     id: str
@@ -93,6 +194,12 @@ class UserResponse(BaseModel):
     profile_picture: Optional[str] = None
     bio: Optional[str] = None
     total_wellness_score: float
+    timezone: Optional[str] = None
+
+class UserSummary(BaseModel):
+    id: str
+    full_name: str
+    profile_picture: Optional[str] = None
 
 class TokenResponse(BaseModel):
     access_token: str
@@ -126,6 +233,49 @@ class HabitCheckIn(BaseModel):
     completed: bool = True
     notes: Optional[str] = None
 
+class HabitCalendar(BaseModel):
+    habit_id: str
+    year: int
+    target_frequency: int
+    counts: List[int]  # completed check-ins per day of year
+    bitmap: str  # hex, bit n set when day n (0-based) reached target_frequency
+    completed_days: int
+    completion_rate: float
+    current_streak: int
+    longest_streak: int
+
+class SearchResult(BaseModel):
+    type: str
+    id: str
+    date: datetime
+    notes: str
+    score: float
+    habit_id: Optional[str] = None
+
+class SearchResponse(BaseModel):
+    query: str
+    results: List[SearchResult]
+    offset: int
+    limit: int
+    has_more: bool
+
+class ImportReport(BaseModel):
+    id: str
+    source: str
+    format: str
+    status: str
+    started_at: datetime
+    finished_at: Optional[datetime] = None
+    rows_read: int
+    inserted: Dict[str, int]
+    duplicates: int
+    invalid: int
+    habits_created: int
+    rows_per_second: Optional[float] = None
+    duration_seconds: Optional[float] = None
+    error: Optional[str] = None
+    errors: List[Dict[str, Any]] = []
+
 class MoodEntry(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     user_id: str
@@ -162,6 +312,14 @@ class Challenge(BaseModel):
     created_at: datetime = Field(default_factory=datetime.utcnow)
     is_active: bool = True
 
+class ChallengeSummary(BaseModel):
+    id: str
+    name: str
+    category: HabitCategory
+    duration_days: int
+    participant_count: int
+    is_active: bool
+
 class WellnessDashboard(BaseModel):
     user_id: str
     date_range: str
@@ -173,6 +331,15 @@ class WellnessDashboard(BaseModel):
     streak_count: int
     active_challenges: int
 
+class WellnessScore(BaseModel):
+    user_id: str
+    date: datetime
+    wellness_score: float
+    habit_completion_rate: float
+    mood_average: float
+    stress_average: float
+    productivity_average: float
+
 # Utility Functions
 def hash_password(password: str) -> str:
     return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
@@ -184,25 +351,94 @@ def create_access_token(data: dict):
     to_encode = data.copy()
     expire = datetime.utcnow() + timedelta(hours=ACCESS_TOKEN_EXPIRE_HOURS)
     to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(to_encode, JWT_SECRET, algorithm=JWT_ALGORITHM)
+    encoded_jwt = token_manager.encode(to_encode)
     return encoded_jwt
 
+async def invalidate_dashboard(*user_ids: str):
+    """Drop cached dashboards here, and on every other instance through the users' version stamps."""
+    for user_id in user_ids:
+        dashboard_cache.invalidate(user_id)
+    await db.users.update_many({"id": {"$in": list(user_ids)}}, {"$inc": {"dashboard_version": 1}})
+
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
     try:
-        payload = jwt.decode(credentials.credentials, JWT_SECRET, algorithms=[JWT_ALGORITHM])
-        user_id: str = payload.get("sub")
-        if user_id is None:
-            raise HTTPException(status_code=401, detail="Invalid token")
-        
-        user = await db.users.find_one({"id": user_id})
-        if user is None:
-            raise HTTPException(status_code=401, detail="User not found")
-        
-        return User(**user)
+        payload = token_manager.decode(credentials.credentials)
     except jwt.ExpiredSignatureError:
         raise HTTPException(status_code=401, detail="Token expired")
-    except jwt.JWTError:
+    except jwt.PyJWTError:
+        raise HTTPException(status_code=401, detail="Invalid token")
+    
+    user_id: str = payload.get("sub")
+    if user_id is None:
         raise HTTPException(status_code=401, detail="Invalid token")
+    
+    user = await db.users.find_one({"id": user_id})
+    if user is None:
+        raise HTTPException(status_code=401, detail="User not found")
+    
+    return User(**user)
+
+async def get_admin_user(current_user: User = Depends(get_current_user)):
+    if current_user.email.lower() not in ADMIN_EMAILS:
+        raise HTTPException(status_code=403, detail="Admin access required")
+    return current_user
+
+def is_admin_request(headers: Headers) -> bool:
+    """Admin check for middleware, which runs before dependencies; relies on the token's email claim."""
+    scheme, _, token = headers.get("authorization", "").partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        return False
+    try:
+        payload = token_manager.decode(token)
+    except jwt.PyJWTError:
+        return False
+    return str(payload.get("email", "")).lower() in ADMIN_EMAILS
+
+# Calendars can hold hundreds of keys per year; only the calendar route reads them
+HABIT_PROJECTION = {"_id": 0, **{field: 0 for field in CALENDAR_FIELDS}}
+
+# Projections for list endpoints: never ship password hashes or friend lists
+USER_RESPONSE_PROJECTION = {"_id": 0, **{field: 1 for field in UserResponse.model_fields}}
+USER_SUMMARY_PROJECTION = {"_id": 0, **{field: 1 for field in UserSummary.model_fields}}
+CHALLENGE_COMPUTED_FIELDS = {"participant_count": {"$size": "$participants"}}
+CHALLENGE_SUMMARY_PROJECTION = {
+    "_id": 0,
+    **{field: 1 for field in ChallengeSummary.model_fields if field not in CHALLENGE_COMPUTED_FIELDS},
+    **CHALLENGE_COMPUTED_FIELDS
+}
+
+def build_field_projection(fields: str, allowed: set, computed: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Turn a ``?fields=a,b`` query parameter into a Mongo projection."""
+    requested = {field.strip() for field in fields.split(",") if field.strip()}
+    unknown = requested - allowed
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(sorted(unknown))}")
+    projection: Dict[str, Any] = {"_id": 0, "id": 1}
+    for field in requested:
+        projection[field] = (computed or {}).get(field, 1)
+    return projection
+
+def selected_fields_response(documents: List[Dict[str, Any]]) -> JSONResponse:
+    # Partial documents don't fit the route's response model, so serialize them directly
+    return JSONResponse(content=jsonable_encoder(documents))
+
+# Health Routes
+@api_router.get("/health/live")
+async def liveness():
+    """Process is up and its event loop responds; stays 200 while draining."""
+    status_code = 200 if lifecycle.alive else 503
+    return JSONResponse(status_code=status_code, content=lifecycle.status())
+
+@api_router.get("/health/ready")
+async def readiness():
+    """Whether a load balancer should route requests here."""
+    if not lifecycle.ready:
+        return JSONResponse(status_code=503, content=lifecycle.status())
+    try:
+        await asyncio.wait_for(db.command("ping"), 2)
+    except Exception as e:
+        return JSONResponse(status_code=503, content={**lifecycle.status(), "database": repr(e)})
+    return {**lifecycle.status(), "database": "ok"}
 
 # Authentication Routes
 @api_router.post("/auth/register", response_model=TokenResponse)
@@ -212,6 +448,12 @@ async def register(user_data: UserCreate):
     if existing_user:
         raise HTTPException(status_code=400, detail="Email already registered")
     
+    if user_data.timezone:
+        try:
+            ZoneInfo(user_data.timezone)
+        except (ZoneInfoNotFoundError, ValueError):
+            raise HTTPException(status_code=400, detail="Unknown timezone")
+    
     # Create new user
     user_dict = user_data.dict()
     user_dict['password'] = hash_password(user_data.password)
@@ -242,6 +484,10 @@ async def login(login_data: UserLogin):
         user=UserResponse(**user)
     )
 
+@api_router.get("/auth/jwks")
+async def get_jwks():
+    return token_manager.jwks()
+
 @api_router.get("/auth/me", response_model=UserResponse)
 async def get_current_user_info(current_user: User = Depends(get_current_user)):
     return UserResponse(**current_user.dict())
@@ -254,17 +500,24 @@ async def create_habit(habit_data: HabitCreate, current_user: User = Depends(get
     habit = Habit(**habit_dict)
     
     await db.habits.insert_one(habit.dict())
+    await invalidate_dashboard(current_user.id)
     return habit
 
 @api_router.get("/habits", response_model=List[Habit])
 async def get_user_habits(current_user: User = Depends(get_current_user)):
-    habits = await db.habits.find({"user_id": current_user.id, "is_active": True}).to_list(100)
+    habits = await db.habits.find({"user_id": current_user.id, "is_active": True}, HABIT_PROJECTION).to_list(100)
     return [Habit(**habit) for habit in habits]
 
 @api_router.post("/habits/{habit_id}/checkin", response_model=HabitCheckIn)
-async def check_in_habit(habit_id: str, completed: bool = True, notes: Optional[str] = None, current_user: User = Depends(get_current_user)):
+async def check_in_habit(
+    habit_id: str,
+    completed: bool = True,
+    notes: Optional[str] = None,
+    idempotency_key: Optional[str] = Header(None),
+    current_user: User = Depends(get_current_user)
+):
     # Verify habit belongs to user
-    habit = await db.habits.find_one({"id": habit_id, "user_id": current_user.id})
+    habit = await db.habits.find_one({"id": habit_id, "user_id": current_user.id}, {"_id": 0, "id": 1, "target_frequency": 1})
     if not habit:
         raise HTTPException(status_code=404, detail="Habit not found")
     
@@ -276,50 +529,172 @@ async def check_in_habit(habit_id: str, completed: bool = True, notes: Optional[
         notes=notes
     )
     
-    await db.habit_checkins.insert_one(checkin.dict())
+    async def record():
+        await db.habit_checkins.insert_one(checkin.dict())
+        return checkin
     
-    # Update habit streak (simplified logic)
-    if completed:
-        await db.habits.update_one(
-            {"id": habit_id},
-            {"$inc": {"current_streak": 1}}
-        )
+    params = {"habit_id": habit_id, "completed": completed, "notes": notes}
+    return await idempotency_store.run(
+        current_user.id, idempotency_key, "check_in_habit", params, record,
+        then=lambda: apply_habit_checkin(habit, checkin)
+    )
+
+async def apply_habit_checkin(habit: Dict[str, Any], checkin: HabitCheckIn):
+    """Update the habit's streak and completion calendar for a stored check-in."""
+    habit_id = habit["id"]
+    # Update habit streak (simplified logic) and completion calendar
+    if checkin.completed:
+        day = checkin.date.date()
+        target_frequency = habit.get('target_frequency', 1)
+        if target_frequency <= 1:
+            update = {"$inc": {"current_streak": 1, **calendar_increment(day)}, "$bit": calendar_bit(day)}
+            await db.habits.update_one({"id": habit_id}, update)
+        else:
+            # One write counts the check-in and marks the day complete once the count reaches the target
+            stage = calendar_checkin_stage(day, target_frequency)
+            stage["current_streak"] = {"$add": [{"$ifNull": ["$current_streak", 0]}, 1]}
+            await db.habits.update_one({"id": habit_id}, [{"$set": stage}])
     
-    return checkin
+    await invalidate_dashboard(checkin.user_id)
+
+@api_router.get("/habits/{habit_id}/calendar", response_model=HabitCalendar)
+async def get_habit_calendar(habit_id: str, year: Optional[int] = Query(None, ge=1, le=9999), current_user: User = Depends(get_current_user)):
+    year = year or datetime.utcnow().year
+    habit = await db.habits.find_one(
+        {"id": habit_id, "user_id": current_user.id},
+        {"_id": 0, "id": 1, "created_at": 1, "target_frequency": 1, **year_projection(year)}
+    )
+    if not habit:
+        raise HTTPException(status_code=404, detail="Habit not found")
+    return HabitCalendar(**summarize_calendar(habit, year))
 
 # Wellness Tracking Routes
 @api_router.post("/wellness/mood", response_model=MoodEntry)
-async def log_mood(mood_level: MoodLevel, notes: Optional[str] = None, current_user: User = Depends(get_current_user)):
+async def log_mood(
+    mood_level: MoodLevel,
+    notes: Optional[str] = None,
+    idempotency_key: Optional[str] = Header(None),
+    current_user: User = Depends(get_current_user)
+):
     mood_entry = MoodEntry(
         user_id=current_user.id,
         mood_level=mood_level,
         notes=notes
     )
     
-    await db.mood_entries.insert_one(mood_entry.dict())
-    return mood_entry
+    async def record():
+        await db.mood_entries.insert_one(mood_entry.dict())
+        return mood_entry
+    
+    params = {"mood_level": mood_level, "notes": notes}
+    return await idempotency_store.run(current_user.id, idempotency_key, "log_mood", params, record,
+                                       then=lambda: invalidate_dashboard(current_user.id))
 
 @api_router.post("/wellness/stress", response_model=StressEntry)
-async def log_stress(stress_data: StressEntry, current_user: User = Depends(get_current_user)):
+async def log_stress(
+    stress_data: StressEntry,
+    idempotency_key: Optional[str] = Header(None),
+    current_user: User = Depends(get_current_user)
+):
+    # Only client-sent fields identify the request; generated ids and timestamps differ per retry
+    params = stress_data.dict(exclude_unset=True, exclude={"user_id"})
     stress_data.user_id = current_user.id
-    await db.stress_entries.insert_one(stress_data.dict())
-    return stress_data
+    
+    async def record():
+        await db.stress_entries.insert_one(stress_data.dict())
+        return stress_data
+    
+    return await idempotency_store.run(current_user.id, idempotency_key, "log_stress", params, record,
+                                       then=lambda: invalidate_dashboard(current_user.id))
 
 @api_router.post("/wellness/productivity", response_model=ProductivityEntry)
-async def log_productivity(productivity_data: ProductivityEntry, current_user: User = Depends(get_current_user)):
+async def log_productivity(
+    productivity_data: ProductivityEntry,
+    idempotency_key: Optional[str] = Header(None),
+    current_user: User = Depends(get_current_user)
+):
+    params = productivity_data.dict(exclude_unset=True, exclude={"user_id"})
     productivity_data.user_id = current_user.id
-    await db.productivity_entries.insert_one(productivity_data.dict())
-    return productivity_data
+    
+    async def record():
+        await db.productivity_entries.insert_one(productivity_data.dict())
+        return productivity_data
+    
+    return await idempotency_store.run(current_user.id, idempotency_key, "log_productivity", params, record,
+                                       then=lambda: invalidate_dashboard(current_user.id))
 
-@api_router.get("/wellness/dashboard")
-async def get_wellness_dashboard(current_user: User = Depends(get_current_user)):
+EXPORT_COLLECTIONS = {
+    "mood": "mood_entries",
+    "stress": "stress_entries",
+    "productivity": "productivity_entries",
+    "habit_checkin": "habit_checkins"
+}
+
+@api_router.get("/wellness/export")
+async def export_wellness_history(
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    current_user: User = Depends(get_current_user)
+):
+    """Stream the caller's full entry history as NDJSON, rehydrating archived months."""
+    # Check up front: once streaming has started, a missing archive can only cut the response short
+    missing = await missing_archives(db, current_user.id, list(EXPORT_COLLECTIONS.values()), ARCHIVE_DIR)
+    if missing:
+        logger.error("Export for %s needs archives missing from %s: %s", current_user.id, ARCHIVE_DIR, ", ".join(missing))
+        raise HTTPException(status_code=503, detail="Archived history is unavailable; try again later")
+    
+    async def lines():
+        for entry_type, collection in EXPORT_COLLECTIONS.items():
+            async for entry in iter_archived_entries(db, collection, current_user.id, ARCHIVE_DIR, since, until):
+                yield json.dumps(jsonable_encoder({"type": entry_type, **entry})) + "\n"
+            
+            # Entries already in an archive file may linger until the TTL monitor removes them
+            archived_batches = await db.archives.distinct("_id", {"collection": collection, "archived": True})
+            query: Dict[str, Any] = {"user_id": current_user.id, "archive_batch": {"$nin": archived_batches}}
+            if since or until:
+                query["date"] = {**({"$gte": since} if since else {}), **({"$lt": until} if until else {})}
+            async for entry in db[collection].find(query, {"_id": 0, "archive_batch": 0, "expire_at": 0}).sort("date", 1):
+                yield json.dumps(jsonable_encoder({"type": entry_type, **entry})) + "\n"
+    
+    return StreamingResponse(
+        lines(),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": 'attachment; filename="mindmate-export.ndjson"'}
+    )
+
+IMPORT_MODELS = {
+    "mood": (MoodEntry, "mood_entries"),
+    "stress": (StressEntry, "stress_entries"),
+    "productivity": (ProductivityEntry, "productivity_entries"),
+    "habit_checkin": (HabitCheckIn, "habit_checkins")
+}
+importer = Importer(db, IMPORT_MODELS, Habit, batch_size=IMPORT_BATCH_SIZE)
+
+@api_router.post("/imports", response_model=ImportReport, status_code=status.HTTP_202_ACCEPTED)
+async def import_history(file: UploadFile = File(...), current_user: User = Depends(get_current_user)):
+    """Queue a bulk import of entries from another tracker; poll GET /imports for progress and the final report."""
+    try:
+        fmt = detect_format(file.filename, file.content_type)
+    except ImportFormatError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    report = await importer.queue(current_user.id, file.file, fmt, file.filename or "upload")
+    await job_runner.enqueue("import_history", {"report_id": report["_id"]})
+    return ImportReport(id=report["_id"], **report)
+
+@api_router.get("/imports", response_model=List[ImportReport])
+async def get_imports(current_user: User = Depends(get_current_user)):
+    reports = await importer.collection.find({"user_id": current_user.id}).sort("started_at", -1).to_list(20)
+    return [ImportReport(id=report["_id"], **report) for report in reports]
+
+async def compute_wellness_dashboard(user_id: str) -> WellnessDashboard:
     # Get recent data (last 30 days)
     thirty_days_ago = datetime.utcnow() - timedelta(days=30)
     
     # Get habit completion rate
-    habits = await db.habits.find({"user_id": current_user.id, "is_active": True}).to_list(100)
+    habits = await db.habits.find({"user_id": user_id, "is_active": True}, {"_id": 0, "current_streak": 1}).to_list(100)
     checkins = await db.habit_checkins.find({
-        "user_id": current_user.id,
+        "user_id": user_id,
         "date": {"$gte": thirty_days_ago}
     }).to_list(1000)
     
@@ -327,35 +702,33 @@ async def get_wellness_dashboard(current_user: User = Depends(get_current_user))
     
     # Get mood average
     mood_entries = await db.mood_entries.find({
-        "user_id": current_user.id,
+        "user_id": user_id,
         "date": {"$gte": thirty_days_ago}
     }).to_list(100)
     mood_avg = sum([m['mood_level'] for m in mood_entries]) / max(len(mood_entries), 1) if mood_entries else 3
     
     # Get stress average
     stress_entries = await db.stress_entries.find({
-        "user_id": current_user.id,
+        "user_id": user_id,
         "date": {"$gte": thirty_days_ago}
     }).to_list(100)
     stress_avg = sum([s['stress_level'] for s in stress_entries]) / max(len(stress_entries), 1) if stress_entries else 3
     
     # Get productivity average
     productivity_entries = await db.productivity_entries.find({
-        "user_id": current_user.id,
+        "user_id": user_id,
         "date": {"$gte": thirty_days_ago}
     }).to_list(100)
     productivity_avg = sum([p['productivity_score'] for p in productivity_entries]) / max(len(productivity_entries), 1) if productivity_entries else 5
     
+    # Get joined challenges
+    active_challenges = await db.challenges.count_documents({"participants": user_id, "is_active": True})
+    
     # Calculate overall wellness score
-    wellness_score = (
-        (habit_completion_rate / 100) * 0.3 +  # 30% weight for habits
-        (mood_avg / 5) * 0.3 +  # 30% weight for mood
-        ((6 - stress_avg) / 5) * 0.2 +  # 20% weight for stress (inverted)
-        (productivity_avg / 10) * 0.2  # 20% weight for productivity
-    ) * 100
+    wellness_score = calculate_wellness_score(habit_completion_rate, mood_avg, stress_avg, productivity_avg)
     
     return WellnessDashboard(
-        user_id=current_user.id,
+        user_id=user_id,
         date_range="Last 30 days",
         wellness_score=round(wellness_score, 1),
         habit_completion_rate=round(habit_completion_rate, 1),
@@ -363,13 +736,66 @@ async def get_wellness_dashboard(current_user: User = Depends(get_current_user))
         stress_average=round(stress_avg, 1),
         productivity_average=round(productivity_avg, 1),
         streak_count=max([h.get('current_streak', 0) for h in habits], default=0),
-        active_challenges=0  # TODO: implement challenges
+        active_challenges=active_challenges
+    )
+
+@api_router.get("/wellness/dashboard")
+async def get_wellness_dashboard(current_user: User = Depends(get_current_user)):
+    return await dashboard_cache.get(
+        current_user.id, lambda: compute_wellness_dashboard(current_user.id), version=current_user.dashboard_version
+    )
+
+@api_router.get("/wellness/scores", response_model=List[WellnessScore])
+async def get_wellness_score_history(days: int = 90, current_user: User = Depends(get_current_user)):
+    since = datetime.utcnow() - timedelta(days=min(max(days, 1), 366))
+    scores = await db.wellness_scores.find(
+        {"user_id": current_user.id, "date": {"$gte": since}},
+        {"_id": 0}
+    ).sort("date", 1).to_list(366)
+    return [WellnessScore(**score) for score in scores]
+
+# Search Routes
+@api_router.get("/search", response_model=SearchResponse)
+async def search_journal(
+    q: str,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    types: Optional[str] = None,
+    offset: int = 0,
+    limit: int = 20,
+    current_user: User = Depends(get_current_user)
+):
+    if not q.strip():
+        raise HTTPException(status_code=400, detail="Search query is empty")
+    if offset < 0 or not 1 <= limit <= 100:
+        raise HTTPException(status_code=400, detail="offset must be >= 0 and limit between 1 and 100")
+    entry_types = [t.strip() for t in types.split(",") if t.strip()] if types else None
+    if entry_types and not set(entry_types) <= set(NOTE_COLLECTIONS):
+        raise HTTPException(status_code=400, detail=f"types must be among: {', '.join(NOTE_COLLECTIONS)}")
+    
+    try:
+        results, has_more = await search_notes(db, current_user.id, q, since, until, entry_types, offset, limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return SearchResponse(
+        query=q,
+        results=[SearchResult(**result) for result in results],
+        offset=offset,
+        limit=limit,
+        has_more=has_more
     )
 
 # Social Features Routes
 @api_router.get("/social/users", response_model=List[UserResponse])
-async def get_users(current_user: User = Depends(get_current_user)):
-    users = await db.users.find({"id": {"$ne": current_user.id}}).to_list(50)
+async def get_users(fields: Optional[str] = None, compact: bool = False, current_user: User = Depends(get_current_user)):
+    query = {"id": {"$ne": current_user.id}}
+    if fields:
+        projection = build_field_projection(fields, set(UserResponse.model_fields))
+        return selected_fields_response(await db.users.find(query, projection).to_list(50))
+    if compact:
+        users = await db.users.find(query, USER_SUMMARY_PROJECTION).to_list(50)
+        return selected_fields_response([UserSummary(**user).dict() for user in users])
+    users = await db.users.find(query, USER_RESPONSE_PROJECTION).to_list(50)
     return [UserResponse(**user) for user in users]
 
 @api_router.post("/social/friends/{friend_id}")
@@ -380,17 +806,21 @@ async def add_friend(friend_id: str, current_user: User = Depends(get_current_us
         {"$addToSet": {"friends": friend_id}}
     )
     
-    # Add current user to friend's friend list (mutual friendship)
-    await db.users.update_one(
-        {"id": friend_id},
-        {"$addToSet": {"friends": current_user.id}}
-    )
+    # Add current user to friend's friend list (mutual friendship) in the background
+    await job_runner.enqueue("mirror_friendship", {"user_id": current_user.id, "friend_id": friend_id})
     
     return {"message": "Friend added successfully"}
 
 @api_router.get("/social/friends", response_model=List[UserResponse])
-async def get_friends(current_user: User = Depends(get_current_user)):
-    friends = await db.users.find({"id": {"$in": current_user.friends}}).to_list(100)
+async def get_friends(fields: Optional[str] = None, compact: bool = False, current_user: User = Depends(get_current_user)):
+    query = {"id": {"$in": current_user.friends}}
+    if fields:
+        projection = build_field_projection(fields, set(UserResponse.model_fields))
+        return selected_fields_response(await db.users.find(query, projection).to_list(100))
+    if compact:
+        friends = await db.users.find(query, USER_SUMMARY_PROJECTION).to_list(100)
+        return selected_fields_response([UserSummary(**friend).dict() for friend in friends])
+    friends = await db.users.find(query, USER_RESPONSE_PROJECTION).to_list(100)
     return [UserResponse(**friend) for friend in friends]
 
 # Challenge Routes
@@ -401,8 +831,16 @@ async def create_challenge(challenge_data: Challenge, current_user: User = Depen
     return challenge_data
 
 @api_router.get("/challenges", response_model=List[Challenge])
-async def get_challenges():
-    challenges = await db.challenges.find({"is_active": True}).to_list(50)
+async def get_challenges(fields: Optional[str] = None, compact: bool = False):
+    query = {"is_active": True}
+    if fields:
+        allowed = set(Challenge.model_fields) | set(CHALLENGE_COMPUTED_FIELDS)
+        projection = build_field_projection(fields, allowed, CHALLENGE_COMPUTED_FIELDS)
+        return selected_fields_response(await db.challenges.find(query, projection).to_list(50))
+    if compact:
+        challenges = await db.challenges.find(query, CHALLENGE_SUMMARY_PROJECTION).to_list(50)
+        return selected_fields_response([ChallengeSummary(**challenge).dict() for challenge in challenges])
+    challenges = await db.challenges.find(query).to_list(50)
     return [Challenge(**challenge) for challenge in challenges]
 
 @api_router.post("/challenges/{challenge_id}/join")
@@ -411,11 +849,169 @@ async def join_challenge(challenge_id: str, current_user: User = Depends(get_cur
         {"id": challenge_id},
         {"$addToSet": {"participants": current_user.id}}
     )
+    await invalidate_dashboard(current_user.id)
     return {"message": "Joined challenge successfully"}
 
+# Admin Analytics Routes
+def get_analytics_store():
+    global analytics_store
+    if analytics_store is None:
+        from analytics import SnapshotStore
+        analytics_store = SnapshotStore(ANALYTICS_SNAPSHOT_DIR)
+    return analytics_store
+
+@api_router.get("/admin/analytics/group-by")
+async def analytics_group_by(
+    dataset: str,
+    metric: str,
+    group_by: str = "all",
+    agg: str = "mean",
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    age_bucket_size: int = 10,
+    admin: User = Depends(get_admin_user)
+):
+    from analytics import AnalyticsError
+    started = time.perf_counter()
+    try:
+        snapshot = get_analytics_store().current()
+        rows = snapshot.group_by(dataset, metric, group_by, agg, since, until, age_bucket_size)
+    except AnalyticsError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {
+        "snapshot_generated_at": snapshot.generated_at,
+        "took_ms": round((time.perf_counter() - started) * 1000, 2),
+        "rows": rows
+    }
+
+@api_router.get("/admin/analytics/stress-triggers")
+async def analytics_stress_triggers(
+    limit: int = 20,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    admin: User = Depends(get_admin_user)
+):
+    from analytics import AnalyticsError
+    started = time.perf_counter()
+    try:
+        snapshot = get_analytics_store().current()
+        rows = snapshot.trigger_frequencies(limit, since, until)
+    except AnalyticsError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {
+        "snapshot_generated_at": snapshot.generated_at,
+        "took_ms": round((time.perf_counter() - started) * 1000, 2),
+        "rows": rows
+    }
+
+@api_router.get("/admin/jobs/metrics")
+async def get_job_metrics(admin: User = Depends(get_admin_user)):
+    return await job_runner.metrics()
+
+@api_router.get("/admin/profiles")
+async def get_request_profiles(limit: int = 50, admin: User = Depends(get_admin_user)):
+    return jsonable_encoder(await profile_store.recent(min(max(limit, 1), 200)))
+
+@api_router.get("/admin/profiles/{profile_id}")
+async def download_request_profile(profile_id: str, admin: User = Depends(get_admin_user)):
+    """Collapsed stacks, ready for flamegraph.pl or speedscope."""
+    profile = await profile_store.get(profile_id)
+    if not profile:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return PlainTextResponse(
+        profile["collapsed"] + "\n",
+        headers={"Content-Disposition": f'attachment; filename="profile-{profile_id}.folded"'}
+    )
+
+# Background Jobs
+@job_runner.handler("mirror_friendship")
+async def mirror_friendship(payload: Dict[str, Any]):
+    await db.users.update_one(
+        {"id": payload["friend_id"]},
+        {"$addToSet": {"friends": payload["user_id"]}}
+    )
+
+@job_runner.handler("wellness_scoring", lease_seconds=3600)
+async def wellness_scoring_job(payload: Dict[str, Any]):
+    # Score the day before the slot, not before now, so a job that runs late still scores its own day;
+    # resumes from its own checkpoint if a previous attempt was interrupted
+    day = datetime.fromisoformat(payload["slot"]) - timedelta(days=1) if "slot" in payload else None
+    await run_daily_scoring(db, day=day)
+
+@job_runner.handler("reset_missed_streaks", lease_seconds=1800)
+async def reset_missed_streaks(payload: Dict[str, Any]):
+    """Zero the streak of habits not completed yesterday, for users whose local midnight is this hour."""
+    slot = datetime.fromisoformat(payload["slot"]).replace(tzinfo=timezone.utc)
+    for tz_name in set(await db.users.distinct("timezone")) | {None}:
+        try:
+            local_now = slot.astimezone(ZoneInfo(tz_name or "UTC"))
+        except (ZoneInfoNotFoundError, ValueError):
+            logger.warning("Skipping streak reset for unknown timezone %r", tz_name)
+            continue
+        if local_now.hour != 0:
+            continue
+        local_midnight = local_now.replace(hour=0, minute=0, second=0, microsecond=0)
+        day_end = local_midnight.astimezone(timezone.utc).replace(tzinfo=None)
+        day_start = (local_midnight - timedelta(days=1)).astimezone(timezone.utc).replace(tzinfo=None)
+
+        user_ids: List[str] = []
+        async for user in db.users.find({"timezone": tz_name}, {"_id": 0, "id": 1}):
+            user_ids.append(user["id"])
+            if len(user_ids) >= 1000:
+                await reset_streaks_for_users(user_ids, day_start, day_end)
+                user_ids = []
+        if user_ids:
+            await reset_streaks_for_users(user_ids, day_start, day_end)
+
+async def reset_streaks_for_users(user_ids: List[str], day_start: datetime, day_end: datetime):
+    completed = await db.habit_checkins.distinct("habit_id", {
+        "user_id": {"$in": user_ids},
+        "completed": True,
+        "date": {"$gte": day_start, "$lt": day_end}
+    })
+    await db.habits.update_many(
+        {"user_id": {"$in": user_ids}, "current_streak": {"$gt": 0}, "id": {"$nin": completed}},
+        [{"$set": {"best_streak": {"$max": ["$best_streak", "$current_streak"]}, "current_streak": 0}}]
+    )
+    await invalidate_dashboard(*user_ids)
+
+@job_runner.handler("retention_archive", lease_seconds=3 * 3600)
+async def retention_archive_job(payload: Dict[str, Any]):
+    # Batches are flagged step by step, so a retried run picks up where it stopped
+    await run_retention(db, RETENTION_DAYS, ARCHIVE_DIR)
+
+@job_runner.handler("import_history", lease_seconds=3600)
+async def import_history_job(payload: Dict[str, Any]):
+    # Entry ids come from the row content, so a retried import skips the rows it already wrote
+    report = await importer.run_queued(payload["report_id"])
+    await invalidate_dashboard(report["user_id"])
+    await importer.delete_upload(payload["report_id"])
+
+@job_runner.handler("analytics_export", max_attempts=2, lease_seconds=3600)
+async def analytics_export_job(payload: Dict[str, Any]):
+    from analytics import export_snapshot
+
+    await export_snapshot(db, ANALYTICS_SNAPSHOT_DIR)
+
+job_runner.schedule("wellness_scoring", daily_at=(0, 5))
+job_runner.schedule("retention_archive", daily_at=(2, 0))
+job_runner.schedule("reset_missed_streaks", every=timedelta(hours=1))
+if ANALYTICS_EXPORT_INTERVAL_MINUTES > 0:
+    job_runner.schedule("analytics_export", every=timedelta(minutes=ANALYTICS_EXPORT_INTERVAL_MINUTES))
+
 # Include the router in the main app
 app.include_router(api_router)
 
+app.add_middleware(CompressionMiddleware, minimum_size=COMPRESSION_MINIMUM_SIZE)
+
+app.add_middleware(
+    ProfilingMiddleware,
+    store=profile_store,
+    authorize=is_admin_request,
+    sample_rate=PROFILE_SAMPLE_RATE,
+    interval=PROFILE_SAMPLE_INTERVAL_MS / 1000
+)
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
@@ -424,6 +1020,9 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Outermost, so the in-flight count covers the whole request
+app.add_middleware(LifecycleMiddleware, lifecycle=lifecycle)
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -431,6 +1030,106 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-@app.on_event("shutdown")
-async def shutdown_db_client():
-    client.close()
+# Indexes behind the routes' own queries; tests/test_query_plans.py fails if a route stops using them
+CORE_INDEXES = [
+    ("users", "id", {"unique": True}),
+    ("users", "email", {"unique": True}),
+    ("users", "timezone", {}),  # hourly reset_missed_streaks
+    ("habits", "id", {"unique": True}),
+    ("habits", [("user_id", 1), ("is_active", 1)], {}),
+    *((collection, [("user_id", 1), ("date", -1)], {})
+      for collection in ("mood_entries", "stress_entries", "productivity_entries", "habit_checkins")),
+    ("habit_checkins", [("habit_id", 1), ("date", 1)], {}),
+    ("challenges", "id", {"unique": True}),
+    ("challenges", "is_active", {}),
+    ("challenges", [("participants", 1), ("is_active", 1)], {}),
+]
+
+async def ensure_core_indexes():
+    # One by one: a unique index over data that predates it may fail on duplicates without taking the rest down
+    for collection, keys, options in CORE_INDEXES:
+        try:
+            await db[collection].create_index(keys, **options)
+        except Exception:
+            logger.exception("Creating index %s on %s failed", keys, collection)
+
+async def ensure_startup_indexes():
+    for name, ensure_indexes in (
+        ("core", ensure_core_indexes),
+        ("job", job_runner.ensure_indexes),
+        ("scoring", lambda: ensure_scoring_indexes(db)),
+        ("idempotency", idempotency_store.ensure_indexes),
+        ("retention", lambda: ensure_retention_indexes(db)),
+        ("search", lambda: ensure_search_indexes(db)),
+        ("import", importer.ensure_indexes),
+        ("profile", profile_store.ensure_indexes),
+    ):
+        try:
+            await ensure_indexes()
+        except Exception:
+            logger.exception("Creating %s indexes failed", name)
+
+# Runs in a fresh interpreter so nothing is imported before the clock starts
+STARTUP_PROBE = '''
+import asyncio, json, time
+started = time.perf_counter()
+import server
+imported = time.perf_counter()
+
+async def first_ready():
+    async with server.app.router.lifespan_context(server.app):
+        ready = time.perf_counter()
+        try:
+            await asyncio.wait_for(server.db.command("ping"), 5)
+            ping_error = None
+        except Exception as e:
+            ping_error = repr(e)
+        return ready, time.perf_counter(), ping_error
+
+ready, pinged, ping_error = asyncio.run(first_ready())
+print(json.dumps({"import": imported - started, "ready": ready - started, "db_ready": pinged - started, "ping_error": ping_error}))
+'''
+
+def profile_startup(top: int = 20):
+    """Print per-module import time and time-to-first-ready for a cold interpreter."""
+    import subprocess
+
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", STARTUP_PROBE],
+        cwd=ROOT_DIR, capture_output=True, text=True
+    )
+    timings = json.loads(result.stdout.strip().splitlines()[-1])
+
+    # -X importtime lines: "import time: self [us] | cumulative | <indent>package"
+    direct_imports = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip())) // 2
+        if depth <= 1:
+            direct_imports.append((int(cumulative), name.strip()))
+
+    print(f"{'module':<40} {'cumulative ms':>14}")
+    for cumulative, name in sorted(direct_imports, reverse=True)[:top]:
+        print(f"{name:<40} {cumulative / 1000:>14.1f}")
+    print()
+    print(f"import server:             {timings['import'] * 1000:8.1f} ms")
+    print(f"time to ready (lifespan):  {timings['ready'] * 1000:8.1f} ms")
+    print(f"time to first db ping:     {timings['db_ready'] * 1000:8.1f} ms" +
+          (f"  (failed: {timings['ping_error']})" if timings['ping_error'] else ""))
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="MindMate API")
+    parser.add_argument("--profile-startup", action="store_true", help="Report import and start-up timings, then exit")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8001)
+    args = parser.parse_args()
+    if args.profile_startup:
+        profile_startup()
+    else:
+        # This file runs as __main__; serve the importable module so the app and lifecycle are the same objects
+        import server
+        run_server(server.app, args.host, args.port, server.lifecycle, drain_delay=SHUTDOWN_DRAIN_DELAY_SECONDS)
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""
+MindMate Backend Benchmark Suite
+Measures per-request overheads of the backend building blocks.
+
+Usage: python backend_benchmark.py [benchmark ...]
+"""
+
+import os
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'backend'))
+
+
+def timed(func, iterations):
+    """Run func `iterations` times and return per-call timings in microseconds"""
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1_000_000)
+    return samples
+
+
+def report(label, samples):
+    ordered = sorted(samples)
+    p95 = ordered[int(len(ordered) * 0.95) - 1]
+    print(f"{label:<40} mean {statistics.mean(samples):9.1f}µs   p50 {statistics.median(samples):9.1f}µs   p95 {p95:9.1f}µs")
+
+
+class MindMateBenchmark:
+    def __init__(self, iterations=2000):
+        self.iterations = iterations
+
+    def bench_auth(self):
+        """Token verification cost per authenticated request"""
+        print("\n=== Auth Overhead Per Request ===")
+        from auth_tokens import TokenManager
+
+        manager = TokenManager('HS256', {'default': 'x' * 32}, 'default')
+        token = manager.encode({"sub": "benchmark-user", "exp": datetime.utcnow() + timedelta(hours=1)})
+
+        def cold():
+            manager.clear_cache()
+            manager.decode(token)
+
+        report("jwt decode (uncached)", timed(cold, self.iterations))
+        manager.decode(token)
+        report("jwt decode (cached)", timed(lambda: manager.decode(token), self.iterations))
+
+    def bench_payloads(self):
+        """Response bytes for list endpoints before/after slimming and compression"""
+        print("\n=== List Endpoint Payload Sizes ===")
+        import json
+        import uuid
+        from compression import brotli, compress
+        from fastapi.encoders import jsonable_encoder
+        from server import Challenge, ChallengeSummary, User, UserResponse, UserSummary
+
+        users = [
+            User(email=f"user{i}@mindmate.com", password="x" * 60, full_name=f"User Number {i}", age=30,
+                 bio="Working on better sleep and more exercise", friends=[str(uuid.uuid4()) for _ in range(20)])
+            for i in range(50)
+        ]
+        challenges = [
+            Challenge(name=f"Challenge {i}", description="Walk 10k steps every day for a month", category="exercise",
+                      duration_days=30, created_by=str(uuid.uuid4()), participants=[str(uuid.uuid4()) for _ in range(500)])
+            for i in range(50)
+        ]
+        payloads = {
+            "users: Mongo read without projection": [u.dict() for u in users],
+            "users: default response": [UserResponse(**u.dict()).dict() for u in users],
+            "users: ?compact=true": [UserSummary(**u.dict()).dict() for u in users],
+            "users: ?fields=id,full_name": [{"id": u.id, "full_name": u.full_name} for u in users],
+            "challenges: default response": [c.dict() for c in challenges],
+            "challenges: ?compact=true": [
+                ChallengeSummary(**c.dict(), participant_count=len(c.participants)).dict() for c in challenges
+            ],
+        }
+        encodings = ["gzip"] + (["br"] if brotli is not None else [])
+        print(f"{'payload':<40} {'raw':>10} " + " ".join(f"{e:>10}" for e in encodings))
+        for label, documents in payloads.items():
+            body = json.dumps(jsonable_encoder(documents)).encode()
+            sizes = " ".join(f"{len(compress(body, e)):>10}" for e in encodings)
+            print(f"{label:<40} {len(body):>10} {sizes}")
+
+    def bench_profiling(self):
+        """Cost of the request profiler on requests it does not profile"""
+        print("\n=== Request Profiler Overhead ===")
+        import asyncio
+        from profiling import ProfilingMiddleware
+        from server import app
+
+        async def noop_app(scope, receive, send):
+            await send({"type": "http.response.start", "status": 200, "headers": []})
+            await send({"type": "http.response.body", "body": b"{}"})
+
+        def scope_for(path):
+            return {"type": "http", "method": "GET", "path": path, "raw_path": path.encode(), "query_string": b"",
+                    "root_path": "", "scheme": "http", "http_version": "1.1", "server": ("bench", 80), "client": ("bench", 1),
+                    "headers": [(b"host", b"bench"), (b"accept", b"application/json"), (b"accept-encoding", b"gzip, br"),
+                                (b"authorization", b"Bearer x"), (b"user-agent", b"benchmark")]}
+
+        async def receive():
+            return {"type": "http.request", "body": b"", "more_body": False}
+
+        async def send(message):
+            pass
+
+        async def per_call(asgi, path, iterations):
+            samples = []
+            for _ in range(iterations):
+                start = time.perf_counter()
+                await asgi(scope_for(path), receive, send)
+                samples.append((time.perf_counter() - start) * 1_000_000)
+            return samples
+
+        class DiscardingStore:
+            def save_later(self, profile):
+                pass
+
+        idle = ProfilingMiddleware(noop_app, store=DiscardingStore(), authorize=lambda headers: False)
+        sampling = ProfilingMiddleware(noop_app, store=DiscardingStore(), authorize=lambda headers: False, sample_rate=0.01)
+        loop = asyncio.new_event_loop()
+        bare = loop.run_until_complete(per_call(noop_app, "/", self.iterations))
+        disabled = loop.run_until_complete(per_call(idle, "/", self.iterations))
+        sampled = loop.run_until_complete(per_call(sampling, "/", self.iterations))
+        full = loop.run_until_complete(per_call(app, "/api/auth/jwks", self.iterations))
+        loop.close()
+
+        report("bare ASGI app", bare)
+        report("profiler, not triggered", disabled)
+        report("profiler, 1% sampling", sampled)
+        report("full app: GET /api/auth/jwks", full)
+        overhead = statistics.median(disabled) - statistics.median(bare)
+        print(f"idle profiler overhead: {overhead:.2f}µs = {overhead / statistics.median(full) * 100:.2f}% of the cheapest real route")
+
+    def bench_search(self):
+        """Journal search latency against a running backend (BACKEND_URL)"""
+        print("\n=== Journal Search Latency ===")
+        import uuid
+        import requests
+
+        api = os.environ.get('BACKEND_URL', 'http://localhost:8001') + '/api'
+        session = requests.Session()
+        try:
+            response = session.post(f"{api}/auth/register", json={
+                "email": f"bench_{uuid.uuid4().hex[:8]}@mindmate.com", "password": "BenchPass123!", "full_name": "Search Bench"
+            }, timeout=5)
+        except requests.ConnectionError:
+            print(f"⚠️  Skipped: no backend reachable at {api}")
+            return
+        account = response.json()
+        session.headers['Authorization'] = f"Bearer {account['access_token']}"
+
+        words = ["slept", "badly", "meeting", "deadline", "walk", "meditation", "family", "coffee", "anxious", "calm"]
+        for i in range(200):
+            notes = " ".join(words[(i * 7 + j) % len(words)] for j in range(6))
+            session.post(f"{api}/wellness/mood", params={"mood_level": i % 5 + 1, "notes": notes})
+            session.post(f"{api}/wellness/stress", json={"user_id": account['user']['id'], "stress_level": i % 5 + 1, "notes": notes})
+
+        iterations = min(self.iterations, 200)
+        queries = {
+            "search: single term": {"q": "meditation"},
+            "search: two terms, page 2": {"q": "deadline anxious", "offset": 20},
+            "search: mood only": {"q": "coffee", "types": "mood"},
+        }
+        for label, params in queries.items():
+            report(label, timed(lambda: session.get(f"{api}/search", params=params).raise_for_status(), iterations))
+
+    def run_all(self, names=None):
+        benchmarks = {name[len('bench_'):]: getattr(self, name) for name in dir(self) if name.startswith('bench_')}
+        selected = names or list(benchmarks)
+        print("🚀 Starting MindMate Backend Benchmarks")
+        print("=" * 50)
+        for name in selected:
+            if name not in benchmarks:
+                print(f"❌ Unknown benchmark: {name} (available: {', '.join(benchmarks)})")
+                return False
+            benchmarks[name]()
+        return True
+
+
+if __name__ == "__main__":
+    benchmark = MindMateBenchmark()
+    success = benchmark.run_all(sys.argv[1:])
+    sys.exit(0 if success else 1)
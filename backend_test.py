@@ -5,8 +5,10 @@ Tests all backend endpoints for the wellness application
 """
 
 import requests
+import base64
 import json
 import sys
+import time
 from datetime import datetime
 import os
 from dotenv import load_dotenv
@@ -36,6 +38,26 @@ class MindMateAPITester:
         self.auth_token = token
         self.session.headers.update({'Authorization': f'Bearer {token}'})
         
+    def test_health_endpoints(self):
+        """Test liveness and readiness probes"""
+        print("\n=== Testing Health Endpoints ===")
+        
+        try:
+            live = self.session.get(f"{API_BASE}/health/live")
+            ready = self.session.get(f"{API_BASE}/health/ready")
+            print(f"Status Codes: live {live.status_code}, ready {ready.status_code}")
+            
+            if live.status_code == 200 and ready.status_code == 200:
+                print(f"✅ Health endpoints OK (state: {ready.json()['state']}, database: {ready.json()['database']})")
+                return True
+            else:
+                print(f"❌ Health check failed: {live.text} {ready.text}")
+                return False
+                
+        except Exception as e:
+            print(f"❌ Health check error: {str(e)}")
+            return False
+    
     def test_user_registration(self):
         """Test user registration endpoint"""
         print("\n=== Testing User Registration ===")
@@ -131,7 +153,38 @@ class MindMateAPITester:
         except Exception as e:
             print(f"❌ Get current user error: {str(e)}")
             return False
-    
+
+    def test_invalid_tokens_rejected(self):
+        """Test that malformed tokens and tokens signed with an unknown key id get 401"""
+        print("\n=== Testing Invalid Token Rejection ===")
+
+        try:
+            # Same claims and signature as the real token, but the header names a key the server doesn't have
+            header_segment, payload_segment, signature_segment = self.auth_token.split('.')
+            header = json.loads(base64.urlsafe_b64decode(header_segment + '=' * (-len(header_segment) % 4)))
+            header['kid'] = 'unknown-kid'
+            unknown_kid_header = base64.urlsafe_b64encode(json.dumps(header).encode()).rstrip(b'=').decode()
+            tokens = {
+                'garbage': 'not-a-jwt',
+                'unknown kid': f"{unknown_kid_header}.{payload_segment}.{signature_segment}",
+            }
+
+            ok = True
+            for name, token in tokens.items():
+                response = requests.get(f"{API_BASE}/auth/me", headers={'Authorization': f'Bearer {token}'})
+                print(f"{name}: Status Code {response.status_code}")
+                if response.status_code != 401:
+                    print(f"❌ {name} token not rejected with 401: {response.text}")
+                    ok = False
+
+            if ok:
+                print("✅ Invalid tokens rejected with 401")
+            return ok
+
+        except Exception as e:
+            print(f"❌ Invalid token test error: {str(e)}")
+            return False
+
     def test_create_habit(self):
         """Test habit creation endpoint"""
         print("\n=== Testing Habit Creation ===")
@@ -223,6 +276,33 @@ class MindMateAPITester:
             print(f"❌ Habit check-in error: {str(e)}")
             return False
     
+    def test_habit_calendar(self):
+        """Test habit completion calendar endpoint"""
+        print("\n=== Testing Habit Calendar ===")
+        
+        if not self.habit_id:
+            print("❌ No habit ID available for calendar")
+            return False
+        
+        try:
+            response = self.session.get(f"{API_BASE}/habits/{self.habit_id}/calendar")
+            print(f"Status Code: {response.status_code}")
+            
+            if response.status_code == 200:
+                data = response.json()
+                print("✅ Habit calendar successful")
+                print(f"Year: {data['year']}")
+                print(f"Completed Days: {data['completed_days']}")
+                print(f"Current Streak: {data['current_streak']}")
+                return data['completed_days'] >= 1 and sum(data['counts']) >= 1
+            else:
+                print(f"❌ Habit calendar failed: {response.text}")
+                return False
+                
+        except Exception as e:
+            print(f"❌ Habit calendar error: {str(e)}")
+            return False
+    
     def test_log_mood(self):
         """Test mood logging endpoint"""
         print("\n=== Testing Mood Logging ===")
@@ -251,6 +331,35 @@ class MindMateAPITester:
             print(f"❌ Mood logging error: {str(e)}")
             return False
     
+    def test_idempotent_mood_retry(self):
+        """Test that retrying a mood log with the same Idempotency-Key doesn't duplicate it"""
+        print("\n=== Testing Idempotent Mood Retry ===")
+        
+        import uuid
+        mood_data = {"mood_level": 3, "notes": "Retried on a flaky connection"}
+        headers = {"Idempotency-Key": str(uuid.uuid4())}
+        
+        try:
+            first = self.session.post(f"{API_BASE}/wellness/mood", params=mood_data, headers=headers)
+            retry = self.session.post(f"{API_BASE}/wellness/mood", params=mood_data, headers=headers)
+            print(f"Status Codes: {first.status_code}, {retry.status_code}")
+            
+            if first.status_code == 200 and retry.status_code == 200:
+                same_entry = first.json()['id'] == retry.json()['id']
+                print(f"Replayed: {retry.headers.get('Idempotent-Replayed')}")
+                if same_entry:
+                    print("✅ Retry returned the original entry")
+                    return True
+                print("❌ Retry created a duplicate entry")
+                return False
+            else:
+                print(f"❌ Idempotent mood retry failed: {retry.text}")
+                return False
+                
+        except Exception as e:
+            print(f"❌ Idempotent mood retry error: {str(e)}")
+            return False
+    
     def test_log_stress(self):
         """Test stress logging endpoint"""
         print("\n=== Testing Stress Logging ===")
@@ -343,6 +452,73 @@ class MindMateAPITester:
             print(f"❌ Wellness dashboard error: {str(e)}")
             return False
     
+    def test_search_notes(self):
+        """Test full-text search over journal notes"""
+        print("\n=== Testing Journal Search ===")
+        
+        try:
+            response = self.session.get(f"{API_BASE}/search", params={"q": "meditation", "limit": 10})
+            print(f"Status Code: {response.status_code}")
+            
+            if response.status_code == 200:
+                data = response.json()
+                print(f"✅ Search returned {len(data['results'])} results (has_more: {data['has_more']})")
+                for result in data['results'][:3]:
+                    print(f"  - [{result['type']}] {result['notes']} (score {result['score']:.2f})")
+                if not any('meditation' in result['notes'].lower() for result in data['results']):
+                    print("❌ Logged mood note was not found")
+                    return False
+                return True
+            else:
+                print(f"❌ Search failed: {response.text}")
+                return False
+                
+        except Exception as e:
+            print(f"❌ Search error: {str(e)}")
+            return False
+    
+    def test_import_history(self):
+        """Test bulk import of history from another tracker"""
+        print("\n=== Testing History Import ===")
+        
+        csv_data = (
+            "type,date,mood_level,stress_level,habit,habit_category,notes,triggers\n"
+            "mood,2024-03-01T08:00:00,4,,,,Imported from another app,\n"
+            "stress,2024-03-01T18:00:00,,3,,,,work;commute\n"
+            "habit_checkin,2024-03-01,,,Evening walk,exercise,,\n"
+            "mood,2024-03-02,9,,,,Out of range,\n"
+        )
+        files = {"file": ("history.csv", csv_data, "text/csv")}
+        
+        try:
+            response = self.session.post(f"{API_BASE}/imports", files=files)
+            print(f"Status Code: {response.status_code}")
+            
+            if response.status_code == 202:
+                # The import runs as a background job; poll its report until it finishes
+                import_id = response.json()['id']
+                data = response.json()
+                for _ in range(30):
+                    if data['status'] in ('completed', 'failed'):
+                        break
+                    time.sleep(1)
+                    reports = self.session.get(f"{API_BASE}/imports").json()
+                    data = next(report for report in reports if report['id'] == import_id)
+                print(f"Status: {data['status']}, rows: {data['rows_read']}, inserted: {data['inserted']}")
+                print(f"Invalid: {data['invalid']} {data['errors']}")
+                if data['status'] == 'completed' and data['invalid'] == 1 and sum(data['inserted'].values()) + data['duplicates'] == 3:
+                    print("✅ History import successful")
+                    return True
+                print("❌ Unexpected import report")
+                return False
+            else:
+                print(f"❌ History import failed: {response.text}")
+                return False
+                
+        except Exception as e:
+            print(f"❌ History import error: {str(e)}")
+            return False
+    
     def test_get_users(self):
         """Test get all users endpoint"""
         print("\n=== Testing Get All Users ===")
@@ -497,7 +673,50 @@ class MindMateAPITester:
         except Exception as e:
             print(f"❌ Get challenges error: {str(e)}")
             return False
-    
+
+    def test_list_response_shapes(self):
+        """Test ?fields= and ?compact=true list shapes and response compression"""
+        print("\n=== Testing List Response Shapes ===")
+
+        expected_keys = {
+            "/social/users?fields=id,full_name": {"id", "full_name"},
+            "/social/users?compact=true": {"id", "full_name", "profile_picture"},
+            "/challenges?fields=name,participant_count": {"name", "participant_count"},
+            "/challenges?compact=true": {"id", "name", "category", "duration_days", "participant_count", "is_active"},
+        }
+
+        try:
+            ok = True
+            for path, keys in expected_keys.items():
+                response = self.session.get(f"{API_BASE}{path}")
+                print(f"{path}: Status Code {response.status_code}")
+                if response.status_code != 200:
+                    print(f"❌ {path} failed: {response.text}")
+                    ok = False
+                    continue
+                wrong = [sorted(item) for item in response.json() if set(item) != keys]
+                if wrong:
+                    print(f"❌ {path} returned keys {wrong[0]}, expected {sorted(keys)}")
+                    ok = False
+
+            # The server compresses bodies of at least COMPRESSION_MINIMUM_SIZE bytes, and never with a refused coding
+            minimum_size = int(os.getenv('COMPRESSION_MINIMUM_SIZE', '500'))
+            for accept_encoding, expected in (("gzip", "gzip"), ("gzip;q=0", None)):
+                response = self.session.get(f"{API_BASE}/social/users", headers={'Accept-Encoding': accept_encoding})
+                encoding = response.headers.get('Content-Encoding')
+                print(f"Accept-Encoding {accept_encoding}: Content-Encoding {encoding}, {len(response.content)} bytes")
+                if encoding != (expected if len(response.content) >= minimum_size else None):
+                    print(f"❌ Unexpected Content-Encoding {encoding} for Accept-Encoding {accept_encoding}")
+                    ok = False
+
+            if ok:
+                print("✅ List response shapes and compression OK")
+            return ok
+
+        except Exception as e:
+            print(f"❌ List response shapes error: {str(e)}")
+            return False
+
     def test_join_challenge(self):
         """Test join challenge endpoint"""
         print("\n=== Testing Join Challenge ===")
@@ -530,21 +749,28 @@ class MindMateAPITester:
         
         test_results = {}
         
+        test_results['health'] = self.test_health_endpoints()
+        
         # Authentication Tests
         test_results['register'] = self.test_user_registration()
         test_results['login'] = self.test_user_login()
         test_results['get_current_user'] = self.test_get_current_user()
+        test_results['invalid_tokens_rejected'] = self.test_invalid_tokens_rejected()
         
         # Habit Management Tests
         test_results['create_habit'] = self.test_create_habit()
         test_results['get_habits'] = self.test_get_habits()
         test_results['habit_checkin'] = self.test_habit_checkin()
+        test_results['habit_calendar'] = self.test_habit_calendar()
         
         # Wellness Tracking Tests
         test_results['log_mood'] = self.test_log_mood()
+        test_results['idempotent_mood_retry'] = self.test_idempotent_mood_retry()
         test_results['log_stress'] = self.test_log_stress()
         test_results['log_productivity'] = self.test_log_productivity()
         test_results['wellness_dashboard'] = self.test_wellness_dashboard()
+        test_results['search_notes'] = self.test_search_notes()
+        test_results['import_history'] = self.test_import_history()
         
         # Social Features Tests
         test_results['get_users'] = self.test_get_users()
@@ -554,6 +780,7 @@ class MindMateAPITester:
         # Challenge Tests
         test_results['create_challenge'] = self.test_create_challenge()
         test_results['get_challenges'] = self.test_get_challenges()
+        test_results['list_response_shapes'] = self.test_list_response_shapes()
         test_results['join_challenge'] = self.test_join_challenge()
         
         # Summary
@@ -0,0 +1,175 @@
+"""Unit tests for AsyncResultCache: single-flight loads, stale-while-revalidate and invalidation."""
+import asyncio
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "backend"))
+
+from cache import AsyncResultCache  # noqa: E402
+
+
+class Loader:
+    """Counts calls and returns call numbers; each call waits for ``release`` when one is given."""
+
+    def __init__(self, release: asyncio.Event = None):
+        self.calls = 0
+        self.release = release
+
+    async def __call__(self):
+        self.calls += 1
+        call = self.calls
+        if self.release is not None:
+            await self.release.wait()
+        return call
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_concurrent_misses_share_one_load():
+    async def scenario():
+        cache = AsyncResultCache(ttl=60)
+        release = asyncio.Event()
+        loader = Loader(release)
+        waiters = [asyncio.create_task(cache.get("user", loader)) for _ in range(10)]
+        await asyncio.sleep(0)
+        release.set()
+        return cache, loader, await asyncio.gather(*waiters)
+
+    cache, loader, results = run(scenario())
+    assert loader.calls == 1
+    assert results == [1] * 10
+    assert cache.stats["misses"] == 1
+    assert cache.stats["coalesced"] == 9
+
+
+def test_fresh_entry_is_served_without_loading():
+    async def scenario():
+        cache = AsyncResultCache(ttl=60)
+        loader = Loader()
+        return cache, loader, [await cache.get("user", loader) for _ in range(3)]
+
+    cache, loader, results = run(scenario())
+    assert results == [1, 1, 1]
+    assert loader.calls == 1
+    assert cache.stats["hits"] == 2
+
+
+def test_stale_entry_is_served_while_one_refresh_runs():
+    async def scenario():
+        cache = AsyncResultCache(ttl=0.05, stale_ttl=60)
+        loader = Loader()
+        first = await cache.get("user", loader)
+        await asyncio.sleep(0.1)
+        loader.release = asyncio.Event()
+        stale = []
+        for _ in range(3):
+            stale.append(await cache.get("user", loader))
+            await asyncio.sleep(0)  # let the refresh start
+        calls_during_refresh = loader.calls
+        loader.release.set()
+        await asyncio.sleep(0.01)
+        return cache, first, stale, calls_during_refresh, cache.peek("user")
+
+    cache, first, stale, calls_during_refresh, refreshed = run(scenario())
+    assert first == 1
+    assert stale == [1, 1, 1]
+    assert calls_during_refresh == 2  # the first load and a single background refresh
+    assert refreshed == 2
+    assert cache.stats["stale_hits"] == 3
+
+
+def test_expired_entry_is_reloaded():
+    async def scenario():
+        cache = AsyncResultCache(ttl=0.05, stale_ttl=0.05)
+        loader = Loader()
+        await cache.get("user", loader)
+        await asyncio.sleep(0.15)
+        return await cache.get("user", loader)
+
+    assert run(scenario()) == 2
+
+
+def test_invalidate_during_load_discards_the_result():
+    async def scenario():
+        cache = AsyncResultCache(ttl=60)
+        release = asyncio.Event()
+        loader = Loader(release)
+        before_write = asyncio.create_task(cache.get("user", loader))
+        await asyncio.sleep(0)
+        cache.invalidate("user")
+        # A read after the write must not join the load that started before it
+        after_write = asyncio.create_task(cache.get("user", loader))
+        await asyncio.sleep(0)
+        release.set()
+        return cache, loader, await before_write, await after_write
+
+    cache, loader, before_write, after_write = run(scenario())
+    assert loader.calls == 2
+    assert (before_write, after_write) == (1, 2)
+    assert cache.peek("user") == 2
+
+
+def test_other_version_is_a_miss():
+    async def scenario():
+        cache = AsyncResultCache(ttl=60, stale_ttl=60)
+        loader = Loader()
+        results = [
+            await cache.get("user", loader, version=1),
+            await cache.get("user", loader, version=1),
+            await cache.get("user", loader, version=2),
+            await cache.get("user", loader, version=2),
+        ]
+        return loader, results
+
+    loader, results = run(scenario())
+    assert results == [1, 1, 2, 2]
+    assert loader.calls == 2
+
+
+def test_load_for_other_version_is_not_joined():
+    async def scenario():
+        cache = AsyncResultCache(ttl=60)
+        release = asyncio.Event()
+        loader = Loader(release)
+        old = asyncio.create_task(cache.get("user", loader, version=1))
+        await asyncio.sleep(0)
+        new = asyncio.create_task(cache.get("user", loader, version=2))
+        await asyncio.sleep(0)
+        release.set()
+        return cache, await old, await new
+
+    cache, old, new = run(scenario())
+    assert (old, new) == (1, 2)
+    assert cache.stats["coalesced"] == 0
+    # Only the newer load may store its result
+    assert cache.peek("user") == 2
+
+
+def test_failed_load_is_not_cached():
+    async def scenario():
+        cache = AsyncResultCache(ttl=60)
+
+        async def failing():
+            raise RuntimeError("database down")
+
+        with pytest.raises(RuntimeError):
+            await cache.get("user", failing)
+        return await cache.get("user", Loader())
+
+    assert run(scenario()) == 1
+
+
+def test_oldest_entries_are_evicted():
+    async def scenario():
+        cache = AsyncResultCache(ttl=60, max_entries=2)
+        for key in ("a", "b", "c"):
+            await cache.get(key, Loader())
+        return cache
+
+    cache = run(scenario())
+    assert cache.peek("a") is None
+    assert cache.peek("b") == 1 and cache.peek("c") == 1
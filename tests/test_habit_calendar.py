@@ -0,0 +1,210 @@
+"""Unit tests for the habit calendar bit arithmetic and calendar rebuilds."""
+import asyncio
+import math
+import sys
+from datetime import date, datetime
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "backend"))
+
+from habit_calendar import (  # noqa: E402
+    BITS_FIELD, COUNTS_FIELD, calendar_checkin_stage, longest_run, overall_streaks, rebuild_habit_calendar,
+    run_ending_at, summarize, year_bitmap, year_counts,
+)
+
+
+def bits(*indexes):
+    value = 0
+    for index in indexes:
+        value |= 1 << index
+    return value
+
+
+def words_for(*days):
+    """Month words with the given days set, as stored on the habit document."""
+    words = {}
+    for day in days:
+        key = f"m{day.month:02d}"
+        words[key] = words.get(key, 0) | 1 << (day.day - 1)
+    return words
+
+
+def calendar_for(*days):
+    calendar = {}
+    for day in days:
+        calendar.setdefault(str(day.year), [])
+        calendar[str(day.year)].append(day)
+    return {BITS_FIELD: {year: words_for(*year_days) for year, year_days in calendar.items()}}
+
+
+def test_run_ending_at():
+    assert run_ending_at(bits(0, 1, 2), 2) == 3
+    assert run_ending_at(bits(0, 1, 2), 1) == 2
+    assert run_ending_at(bits(0, 1, 2), 3) == 0
+    assert run_ending_at(bits(0, 2, 3, 4), 4) == 3
+    assert run_ending_at(bits(5), 5) == 1
+    assert run_ending_at(bits(0, 1), -1) == 0
+    assert run_ending_at(0, 10) == 0
+
+
+def test_longest_run():
+    assert longest_run(0) == 0
+    assert longest_run(bits(7)) == 1
+    assert longest_run(bits(0, 1, 3, 4, 5, 9, 10)) == 3
+    assert longest_run((1 << 366) - 1) == 366
+
+
+def test_month_words_fold_onto_day_of_year():
+    # 1 March is day-of-year index 59, or 60 in a leap year
+    assert year_bitmap(words_for(date(2025, 3, 1)), 2025) == bits(59)
+    assert year_bitmap(words_for(date(2024, 3, 1)), 2024) == bits(60)
+    assert year_bitmap(words_for(date(2024, 12, 31)), 2024) == bits(365)
+    assert year_bitmap(words_for(date(2025, 1, 31), date(2025, 2, 1)), 2025) == bits(30, 31)
+    assert year_bitmap({}, 2025) == 0
+
+
+def test_day_counts_land_on_day_of_year():
+    counts = year_counts({"0101": 2, "0301": 1, "1231": 3}, 2024)
+    assert len(counts) == 366
+    assert (counts[0], counts[60], counts[365]) == (2, 1, 3)
+    assert len(year_counts({}, 2025)) == 365
+
+
+def test_streak_runs_across_new_year():
+    habit = calendar_for(date(2024, 12, 30), date(2024, 12, 31), date(2025, 1, 1), date(2025, 1, 2))
+    assert overall_streaks(habit, today=date(2025, 1, 2)) == (4, 4)
+    # Today isn't finished yet, so a run through yesterday is still current
+    assert overall_streaks(habit, today=date(2025, 1, 3)) == (4, 4)
+    assert overall_streaks(habit, today=date(2025, 1, 4)) == (0, 4)
+
+
+def test_streaks_span_years_missing_from_the_calendar():
+    habit = calendar_for(date(2023, 12, 31), date(2024, 1, 1), date(2024, 1, 2), date(2026, 5, 1))
+    assert overall_streaks(habit, today=date(2026, 5, 1)) == (1, 3)
+    assert overall_streaks({}, today=date(2026, 5, 1)) == (0, 0)
+
+
+def test_summarize_year():
+    habit = {
+        "id": "h1",
+        "created_at": datetime(2025, 3, 1, 9, 30),
+        "target_frequency": 2,
+        **calendar_for(date(2025, 3, 1), date(2025, 3, 2), date(2025, 3, 4), date(2025, 3, 5), date(2025, 3, 6)),
+        COUNTS_FIELD: {"2025": {"0301": 2, "0302": 3, "0303": 1}},
+    }
+    summary = summarize(habit, 2025, today=date(2025, 3, 7))
+    assert summary["completed_days"] == 5
+    assert summary["completion_rate"] == round(5 / 7 * 100, 1)
+    assert summary["current_streak"] == 3
+    assert summary["longest_streak"] == 3
+    assert summary["counts"][59:62] == [2, 3, 1]
+    assert summary["bitmap"] == format(bits(59, 60, 62, 63, 64), "x")
+
+
+def evaluate(expression, document):
+    """Evaluate the aggregation operators calendar_checkin_stage uses against a plain document."""
+    if isinstance(expression, str) and expression.startswith("$"):
+        value = document
+        for part in expression[1:].split("."):
+            value = value.get(part) if isinstance(value, dict) else None
+        return value
+    if not isinstance(expression, dict):
+        return expression
+    (operator, args), = expression.items()
+    if operator == "$divide":
+        return evaluate(args[0], document) / evaluate(args[1], document)
+    if operator == "$floor":
+        return math.floor(evaluate(args, document))
+    values = [evaluate(arg, document) for arg in args]
+    operations = {
+        "$add": lambda a, b: a + b,
+        "$ifNull": lambda a, b: b if a is None else a,
+        "$eq": lambda a, b: a == b,
+        "$gte": lambda a, b: a >= b,
+        "$mod": lambda a, b: a % b,
+        "$and": lambda *a: all(a),
+        "$cond": lambda test, then, otherwise: then if test else otherwise,
+    }
+    return operations[operator](*values)
+
+
+def apply_stage(stage, document):
+    updated = {path: evaluate(expression, document) for path, expression in stage.items()}
+    for path, value in updated.items():
+        target = document
+        *parents, leaf = path.split(".")
+        for part in parents:
+            target = target.setdefault(part, {})
+        target[leaf] = value
+    return document
+
+
+def test_checkin_stage_sets_the_bit_when_the_target_is_reached():
+    day = date(2025, 3, 31)
+    habit = {BITS_FIELD: {"2025": {"m03": bits(0)}}}
+    counts, words = [], []
+    for _ in range(4):
+        apply_stage(calendar_checkin_stage(day, target_frequency=2), habit)
+        counts.append(habit[COUNTS_FIELD]["2025"]["0331"])
+        words.append(habit[BITS_FIELD]["2025"]["m03"])
+    assert counts == [1, 2, 3, 4]
+    # Set once by the second check-in and left alone by later ones; day 1's bit is kept
+    assert words == [bits(0), bits(0, 30), bits(0, 30), bits(0, 30)]
+
+
+def test_checkin_stage_starts_an_empty_calendar():
+    habit = apply_stage(calendar_checkin_stage(date(2025, 7, 4), target_frequency=3), {})
+    assert habit == {COUNTS_FIELD: {"2025": {"0704": 1}}, BITS_FIELD: {"2025": {"m07": 0}}}
+
+
+class Cursor:
+    def __init__(self, rows):
+        self.rows = rows
+
+    async def to_list(self, length):
+        return self.rows
+
+
+class CalendarDB:
+    """The three queries rebuild_habit_calendar makes, with the update it sends recorded."""
+
+    def __init__(self, rows, archived_months):
+        self.habit_checkins = type("Checkins", (), {"aggregate": lambda _, pipeline: Cursor(rows)})()
+        self.archives = type("Archives", (), {"distinct": self._distinct})()
+        self.habits = type("Habits", (), {"update_one": self._update_one})()
+        self.archived_months = archived_months
+        self.updates = []
+
+    async def _distinct(self, field, query):
+        return self.archived_months
+
+    async def _update_one(self, query, update):
+        self.updates.append(update)
+
+
+def test_rebuild_rewrites_live_months_and_merges_archived_ones():
+    rows = [
+        {"_id": "20250102", "count": 2},
+        {"_id": "20250103", "count": 1},
+        {"_id": "20250301", "count": 2},
+    ]
+    db = CalendarDB(rows, archived_months=[datetime(2025, 1, 1)])
+    asyncio.run(rebuild_habit_calendar(db, {"id": "h1", "target_frequency": 2}))
+
+    update, = db.updates
+    # January is partly archived: counts only grow and bits are only added
+    assert update["$max"] == {f"{COUNTS_FIELD}.2025.0102": 2, f"{COUNTS_FIELD}.2025.0103": 1}
+    assert update["$bit"] == {f"{BITS_FIELD}.2025.m01": {"or": bits(1)}}
+    # March is fully live, so it is rewritten
+    assert update["$set"] == {f"{COUNTS_FIELD}.2025.0301": 2, f"{BITS_FIELD}.2025.m03": bits(0)}
+
+
+def test_rebuild_skips_empty_operators():
+    db = CalendarDB([{"_id": "20250105", "count": 1}], archived_months=[datetime(2025, 1, 1)])
+    asyncio.run(rebuild_habit_calendar(db, {"id": "h1", "target_frequency": 2}))
+    # Below target in an archived month: nothing to OR in, so no empty $bit
+    assert db.updates == [{"$max": {f"{COUNTS_FIELD}.2025.0105": 1}}]
+
+    db = CalendarDB([], archived_months=[])
+    asyncio.run(rebuild_habit_calendar(db, {"id": "h1"}))
+    assert db.updates == []
@@ -0,0 +1,142 @@
+"""Unit tests for IdempotencyStore: replays, released keys and failing follow-up work."""
+import asyncio
+import sys
+from pathlib import Path
+
+import pytest
+from fastapi import HTTPException
+from pymongo.errors import DuplicateKeyError
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "backend"))
+
+from idempotency import COMPLETED, REPLAY_HEADER, IdempotencyStore  # noqa: E402
+
+
+class KeyCollection:
+    """Just enough of a Motor collection for the queries IdempotencyStore makes."""
+
+    def __init__(self):
+        self.records = {}
+
+    async def insert_one(self, document):
+        if document["_id"] in self.records:
+            raise DuplicateKeyError("duplicate key")
+        self.records[document["_id"]] = dict(document)
+
+    async def find_one(self, query):
+        record = self.records.get(query["_id"])
+        return dict(record) if record is not None else None
+
+    async def update_one(self, query, update):
+        self.records[query["_id"]].update(update["$set"])
+
+    async def delete_one(self, query):
+        record = self.records.get(query["_id"])
+        if record is not None and record["status"] == query["status"]:
+            del self.records[query["_id"]]
+
+
+class Route:
+    """Stands in for a logging route: one insert, then follow-up work that may fail."""
+
+    def __init__(self, fail_insert: bool = False, fail_then: bool = False):
+        self.entries = []
+        self.follow_ups = 0
+        self.fail_insert = fail_insert
+        self.fail_then = fail_then
+
+    async def insert(self):
+        if self.fail_insert:
+            raise RuntimeError("insert failed")
+        self.entries.append({"id": len(self.entries) + 1})
+        return self.entries[-1]
+
+    async def then(self):
+        self.follow_ups += 1
+        if self.fail_then:
+            raise RuntimeError("invalidation failed")
+
+
+def make_store():
+    collection = KeyCollection()
+    return IdempotencyStore({"idempotency_keys": collection}), collection
+
+
+def call(store, route, key="key-1", params=None):
+    return store.run("user", key, "log_mood", params or {"mood_level": 4}, route.insert, then=route.then)
+
+
+def test_retry_replays_without_writing_again():
+    async def scenario():
+        store, _ = make_store()
+        route = Route()
+        first = await call(store, route)
+        replay = await call(store, route)
+        return route, first, replay
+
+    route, first, replay = asyncio.run(scenario())
+    assert first == {"id": 1}
+    assert replay.headers[REPLAY_HEADER] == "true"
+    assert replay.body == b'{"id":1}'
+    assert len(route.entries) == 1
+    assert route.follow_ups == 1
+
+
+def test_failed_follow_up_keeps_the_key():
+    async def scenario():
+        store, collection = make_store()
+        route = Route(fail_then=True)
+        with pytest.raises(RuntimeError, match="invalidation"):
+            await call(store, route)
+        route.fail_then = False
+        replay = await call(store, route)
+        return route, collection, replay
+
+    route, collection, replay = asyncio.run(scenario())
+    # The entry was written once and the retry gets it back instead of a second one
+    assert len(route.entries) == 1
+    assert route.follow_ups == 1
+    assert collection.records["user:key-1"]["status"] == COMPLETED
+    assert replay.body == b'{"id":1}'
+
+
+def test_failed_insert_releases_the_key():
+    async def scenario():
+        store, collection = make_store()
+        route = Route(fail_insert=True)
+        with pytest.raises(RuntimeError, match="insert"):
+            await call(store, route)
+        released = "user:key-1" not in collection.records
+        route.fail_insert = False
+        return route, released, await call(store, route)
+
+    route, released, retried = asyncio.run(scenario())
+    assert released
+    assert retried == {"id": 1}
+    assert route.follow_ups == 1
+
+
+def test_key_reused_for_another_request_is_rejected():
+    async def scenario():
+        store, _ = make_store()
+        route = Route()
+        await call(store, route)
+        await call(store, route, params={"mood_level": 2})
+
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(scenario())
+    assert error.value.status_code == 422
+
+
+def test_without_a_key_both_steps_run_every_time():
+    async def scenario():
+        store, collection = make_store()
+        route = Route()
+        await call(store, route, key=None)
+        await call(store, route, key=None)
+        return route, collection
+
+    route, collection = asyncio.run(scenario())
+    assert len(route.entries) == 2
+    assert route.follow_ups == 2
+    assert not collection.records
@@ -0,0 +1,83 @@
+"""Unit tests for the streaming JSON reader behind history imports."""
+import io
+import json
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "backend"))
+
+from importer import ImportFormatError, iter_json_rows  # noqa: E402
+
+ROWS = [
+    {"type": "mood", "date": "2024-03-01T08:00:00", "mood_level": 4, "notes": "Slept \"well\", été"},
+    {"type": "stress", "date": "2024-03-01", "stress_level": 3, "triggers": ["work", "commute"]},
+    {"type": "productivity", "date": "2024-03-02", "productivity_score": -1.5e3, "flag": False, "extra": None},
+]
+
+
+class CountingStream(io.StringIO):
+    """Remembers how many characters were read."""
+
+    def __init__(self, text: str):
+        super().__init__(text)
+        self.chars_read = 0
+
+    def read(self, size=-1):
+        chunk = super().read(size)
+        self.chars_read += len(chunk)
+        return chunk
+
+
+def read_all(text: str, chunk_size: int = 1 << 16):
+    return list(iter_json_rows(io.StringIO(text), chunk_size=chunk_size))
+
+
+@pytest.mark.parametrize("text", [
+    json.dumps(ROWS),
+    json.dumps(ROWS, indent=2),
+    "".join(json.dumps(row) + "\n" for row in ROWS),
+    " \n" + "\r\n".join(json.dumps(row) for row in ROWS) + "\n\n",
+])
+def test_every_chunk_boundary_gives_the_same_rows(text):
+    for chunk_size in range(1, len(text) + 1):
+        assert read_all(text, chunk_size) == ROWS, chunk_size
+
+
+def test_literal_cut_off_at_chunk_boundary():
+    text = "[-Infinity, 12345.678, true]"
+    for chunk_size in range(1, len(text) + 1):
+        assert read_all(text, chunk_size)[1:] == [12345.678, True]
+
+
+def test_empty_input_and_empty_array():
+    assert read_all("") == []
+    assert read_all(" [ ] \n") == []
+
+
+@pytest.mark.parametrize("text", ['[{"a": 1},', '[{"a": 1}', "[", '[{"a": "unterminated'])
+def test_truncated_array_is_rejected(text):
+    with pytest.raises(ImportFormatError):
+        read_all(text, chunk_size=4)
+
+
+@pytest.mark.parametrize("text", ['[{"a": 1}] trailing', '[{"a": 1}][{"a": 2}]', '[1]\n{"a": 2}'])
+def test_data_after_the_closing_bracket_is_rejected(text):
+    with pytest.raises(ImportFormatError, match="after the array"):
+        read_all(text, chunk_size=4)
+
+
+def test_malformed_row_fails_without_reading_the_rest():
+    text = "{oops}\n" + '{"type": "mood", "date": "2024-03-01", "mood_level": 4}\n' * 10_000
+    stream = CountingStream(text)
+    with pytest.raises(ImportFormatError):
+        list(iter_json_rows(stream, chunk_size=1024))
+    assert stream.chars_read <= 1024
+
+
+def test_rows_before_a_malformed_row_are_yielded():
+    rows = iter_json_rows(io.StringIO('{"a": 1}\n{"b": }\n{"c": 3}\n'), chunk_size=4)
+    assert next(rows) == {"a": 1}
+    with pytest.raises(ImportFormatError):
+        next(rows)
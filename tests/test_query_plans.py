@@ -0,0 +1,251 @@
+"""Query-plan regression tests for the routes' Mongo queries.
+
+Each test calls the real route code against a seeded throwaway database,
+records every query it issues and runs ``explain`` on it. A query fails the
+test if its winning plan contains a COLLSCAN, or if it examines more than
+MAX_EXAMINED_PER_RETURNED documents for each document it returns.
+
+Needs a reachable MongoDB: MONGO_URL from the environment, else from
+backend/.env, else mongodb://localhost:27017. The module is skipped when it
+is unreachable, unless REQUIRE_QUERY_PLANS=1 is set, as it should be wherever
+these plans gate index changes; then it fails instead. The seeded database
+(QUERY_PLAN_DB) is dropped afterwards.
+"""
+import asyncio
+import os
+import random
+import sys
+import uuid
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import pytest
+from dotenv import dotenv_values
+
+pytest.importorskip("pymongo")
+from pymongo import MongoClient
+from pymongo.errors import PyMongoError
+
+BACKEND_DIR = Path(__file__).resolve().parents[1] / "backend"
+sys.path.insert(0, str(BACKEND_DIR))
+
+MONGO_URL = (os.environ.get("MONGO_URL") or dotenv_values(BACKEND_DIR / ".env").get("MONGO_URL")
+             or "mongodb://localhost:27017")
+REQUIRE_QUERY_PLANS = os.environ.get("REQUIRE_QUERY_PLANS") == "1"
+QUERY_PLAN_DB = os.environ.get("QUERY_PLAN_DB", "mindmate_query_plans")
+MAX_EXAMINED_PER_RETURNED = 1.5
+
+USERS = 200
+HABITS_PER_USER = 5
+DAYS_OF_HISTORY = 90
+FRIENDS_PER_USER = 20
+CHALLENGES = 100
+
+try:
+    sync_client = MongoClient(MONGO_URL, serverSelectionTimeoutMS=1000)
+    sync_client.admin.command("ping")
+except PyMongoError as e:
+    if REQUIRE_QUERY_PLANS:
+        raise RuntimeError(f"REQUIRE_QUERY_PLANS is set but MongoDB is not reachable at {MONGO_URL}") from e
+    pytest.skip(f"MongoDB is not reachable at {MONGO_URL}", allow_module_level=True)
+
+os.environ.setdefault("MONGO_URL", MONGO_URL)
+os.environ.setdefault("DB_NAME", QUERY_PLAN_DB)
+import server  # noqa: E402
+from fastapi.security import HTTPAuthorizationCredentials  # noqa: E402
+from motor.motor_asyncio import AsyncIOMotorClient  # noqa: E402
+
+
+class RecordingCollection:
+    """Passes calls through to a Motor collection, noting each query's filter."""
+
+    def __init__(self, recorder, collection):
+        self._recorder = recorder
+        self._collection = collection
+
+    def find(self, filter=None, *args, **kwargs):
+        self._recorder.record(self._collection.name, filter, kwargs.get("sort"))
+        return self._collection.find(filter, *args, **kwargs)
+
+    async def find_one(self, filter=None, *args, **kwargs):
+        self._recorder.record(self._collection.name, filter, kwargs.get("sort"))
+        return await self._collection.find_one(filter, *args, **kwargs)
+
+    async def count_documents(self, filter, *args, **kwargs):
+        self._recorder.record(self._collection.name, filter, None)
+        return await self._collection.count_documents(filter, *args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._collection, name)
+
+
+class RecordingDatabase:
+    def __init__(self, database):
+        self._database = database
+        self.queries = []
+
+    def record(self, collection, filter, sort):
+        self.queries.append((collection, filter or {}, sort))
+
+    def __getitem__(self, name):
+        return RecordingCollection(self, self._database[name])
+
+    def __getattr__(self, name):
+        return self[name]
+
+
+def plan_stages(plan):
+    """Every stage name in an explain plan tree, for classic and SBE explain output alike."""
+    if isinstance(plan, list):
+        return [stage for child in plan for stage in plan_stages(child)]
+    if not isinstance(plan, dict):
+        return []
+    stages = [plan["stage"]] if "stage" in plan else []
+    for key in ("queryPlan", "winningPlan", "inputStage", "inputStages", "innerStage", "outerStage", "shards"):
+        if key in plan:
+            stages += plan_stages(plan[key])
+    return stages
+
+
+def explain(collection, filter, sort=None):
+    command = {"find": collection, "filter": filter}
+    if sort:
+        command["sort"] = dict(sort)
+    return sync_client[QUERY_PLAN_DB].command("explain", command, verbosity="executionStats")
+
+
+def seed(database):
+    now = datetime.utcnow()
+    rng = random.Random(42)
+    users = [
+        {"id": str(uuid.uuid4()), "email": f"user{i}@mindmate.com", "password": "x", "full_name": f"User {i}",
+         "created_at": now, "is_active": True, "friends": []}
+        for i in range(USERS)
+    ]
+    for user in users:
+        user["friends"] = [friend["id"] for friend in rng.sample(users, FRIENDS_PER_USER) if friend is not user]
+    database.users.insert_many(users)
+
+    habits, checkins, entries = [], [], {"mood_entries": [], "stress_entries": [], "productivity_entries": []}
+    for user in users:
+        for h in range(HABITS_PER_USER):
+            habit = {"id": str(uuid.uuid4()), "user_id": user["id"], "name": f"Habit {h}", "category": "exercise",
+                     "target_frequency": 1, "is_active": h != 0, "created_at": now, "current_streak": 0, "best_streak": 0}
+            habits.append(habit)
+            for day in range(0, DAYS_OF_HISTORY, 3):
+                checkins.append({"id": str(uuid.uuid4()), "habit_id": habit["id"], "user_id": user["id"],
+                                 "date": now - timedelta(days=day), "completed": rng.random() < 0.8})
+        for day in range(DAYS_OF_HISTORY):
+            date = now - timedelta(days=day)
+            entries["mood_entries"].append({"id": str(uuid.uuid4()), "user_id": user["id"], "date": date, "mood_level": rng.randint(1, 5)})
+            entries["stress_entries"].append({"id": str(uuid.uuid4()), "user_id": user["id"], "date": date, "stress_level": rng.randint(1, 5)})
+            entries["productivity_entries"].append({"id": str(uuid.uuid4()), "user_id": user["id"], "date": date,
+                                                    "productivity_score": rng.randint(1, 10)})
+    database.habits.insert_many(habits)
+    database.habit_checkins.insert_many(checkins)
+    for collection, documents in entries.items():
+        database[collection].insert_many(documents)
+
+    database.challenges.insert_many([
+        {"id": str(uuid.uuid4()), "name": f"Challenge {i}", "description": "", "category": "exercise", "duration_days": 30,
+         "created_by": users[0]["id"], "participants": [user["id"] for user in rng.sample(users, 10)],
+         "created_at": now, "is_active": i % 4 == 0}
+        for i in range(CHALLENGES)
+    ])
+    return users
+
+
+@pytest.fixture(scope="module")
+def loop():
+    loop = asyncio.new_event_loop()
+    yield loop
+    loop.close()
+
+
+@pytest.fixture(scope="module")
+def seeded(loop):
+    sync_client.drop_database(QUERY_PLAN_DB)
+    users = seed(sync_client[QUERY_PLAN_DB])
+
+    motor_client = AsyncIOMotorClient(MONGO_URL, io_loop=loop)
+    original_db = server.db
+    server.db = motor_client[QUERY_PLAN_DB]
+    loop.run_until_complete(server.ensure_core_indexes())
+    yield users
+    server.db = original_db
+    motor_client.close()
+    sync_client.drop_database(QUERY_PLAN_DB)
+
+
+@pytest.fixture
+def recorder(seeded):
+    recording = RecordingDatabase(server.db)
+    motor_db, server.db = server.db, recording
+    yield recording
+    server.db = motor_db
+
+
+def current_user(loop, user):
+    token = server.create_access_token({"sub": user["id"], "email": user["email"]})
+    credentials = HTTPAuthorizationCredentials(scheme="Bearer", credentials=token)
+    return loop.run_until_complete(server.get_current_user(credentials))
+
+
+def assert_indexed(recorder):
+    assert recorder.queries, "the route issued no queries"
+    for collection, filter, sort in recorder.queries:
+        stats = explain(collection, filter, sort)
+        winning_plan = stats["queryPlanner"]["winningPlan"]
+        stages = plan_stages(winning_plan)
+        assert "COLLSCAN" not in stages, f"{collection}.find({filter}) scans the collection: {stages}"
+
+        examined = stats["executionStats"]["totalDocsExamined"]
+        returned = stats["executionStats"]["nReturned"]
+        assert examined <= MAX_EXAMINED_PER_RETURNED * max(returned, 1), (
+            f"{collection}.find({filter}) examined {examined} documents to return {returned}: {stages}"
+        )
+
+
+def test_get_current_user(loop, seeded, recorder):
+    user = current_user(loop, seeded[0])
+    assert user.id == seeded[0]["id"]
+    assert_indexed(recorder)
+
+
+def test_get_user_habits(loop, seeded, recorder):
+    user = current_user(loop, seeded[1])
+    recorder.queries.clear()
+    habits = loop.run_until_complete(server.get_user_habits(current_user=user))
+    assert len(habits) == HABITS_PER_USER - 1
+    assert_indexed(recorder)
+
+
+def test_wellness_dashboard(loop, seeded, recorder):
+    user = current_user(loop, seeded[2])
+    recorder.queries.clear()
+    loop.run_until_complete(server.compute_wellness_dashboard(user.id))
+    assert {collection for collection, _, _ in recorder.queries} >= {
+        "habits", "habit_checkins", "mood_entries", "stress_entries", "productivity_entries", "challenges"
+    }
+    assert_indexed(recorder)
+
+
+@pytest.mark.parametrize("compact", [False, True])
+def test_get_friends(loop, seeded, recorder, compact):
+    user = current_user(loop, seeded[3])
+    recorder.queries.clear()
+    loop.run_until_complete(server.get_friends(fields=None, compact=compact, current_user=user))
+    assert_indexed(recorder)
+
+
+@pytest.mark.parametrize("compact", [False, True])
+def test_get_challenges(loop, seeded, recorder, compact):
+    loop.run_until_complete(server.get_challenges(fields=None, compact=compact))
+    assert_indexed(recorder)
+
+
+def test_get_users(loop, seeded, recorder):
+    user = current_user(loop, seeded[4])
+    recorder.queries.clear()
+    loop.run_until_complete(server.get_users(fields=None, compact=False, current_user=user))
+    assert_indexed(recorder)